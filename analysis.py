@@ -0,0 +1,250 @@
+"""
+Post-game engine analysis: per-move evaluations, best moves, inaccuracies, mistakes and blunders, accuracy
+
+Finished games are queued by Game.game_over and analysed one position at a time by a few background
+workers, each with an engine of its own pool, so live bot searches never wait for an analysis engine.
+Analysis strictly comes second to live play:
+- Before every position a worker waits while the bot pool has callers waiting or no idle capacity
+- The analysis engines run at a lower CPU priority, the OS scheduler prefers the bot engines
+Evaluations are cached by position across games, openings are rarely searched twice.
+The result reaches the players' current sessions as an `analysis` event.
+"""
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import chess
+import chess.engine
+import chess.polyglot
+from eventlet import tpool
+
+from bot_search import stockfish_pool
+from cache import LRUCache
+from share import get_logger, running, send_command
+from stockfish_pool import StockfishPool
+
+logger = get_logger(__name__)
+
+
+class AnalysisConfig:
+    ENABLED = True
+    WORKERS = 1                 # Concurrent analyses, one engine each
+    NICENESS = 10               # CPU priority of the analysis engines, relative to the server
+    QUEUE_SIZE = 1_000          # Queued games, the oldest ones are dropped beyond it
+    MIN_PLIES = 6               # Shorter games are not worth analysing
+    MAX_PLIES = 200             # Only the first plies of longer games are analysed
+    POSITION_LIMIT = {'depth': 14, 'time': 0.2}  # Budget of one position, the first one reached stops the search
+    GAME_SECONDS = 20.0         # Engine time budget of a game, the rest of it is left unanalysed
+    YIELD_SLEEP = 0.2           # Wait before checking again while live bot searches need the CPU (seconds)
+    CACHE_SIZE = 200_000        # Cached position evaluations
+
+    # Centipawn losses, from the mover's point of view, that mark a move
+    MARKS = [(300, 'blunder'), (100, 'mistake'), (50, 'inaccuracy')]
+    MATE_SCORE = 10_000
+
+
+Evaluation = Tuple[int, Optional[str]]  # (centipawns for white, best move in UCI)
+
+
+def win_percent(centipawns: int) -> float:
+    """Winning chances of white, the curve of lichess' accuracy model"""
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * centipawns)) - 1)
+
+
+def move_accuracy(win_before: float, win_after: float) -> float:
+    """Accuracy of a move from the mover's winning chances before and after it"""
+    return max(0.0, min(100.0, 103.1668 * math.exp(-0.04354 * max(0.0, win_before - win_after)) - 3.1669))
+
+
+def summarize(game_id: str, moves: List[chess.Move], evaluations: List[Evaluation]) -> dict:
+    """
+    The analysis of the plies that have an evaluation before and after them
+    evals: centipawns for white after each ply, best: the engine's move before each ply,
+    marks: None, 'inaccuracy', 'mistake' or 'blunder' per ply, accuracy: per side, 0-100
+    """
+    plies = len(evaluations) - 1
+    evals, best, marks = [], [], []
+    accuracies: Dict[str, List[float]] = {'white': [], 'black': []}
+
+    for ply in range(plies):
+        before, best_move = evaluations[ply]
+        after = evaluations[ply + 1][0]
+        sign = 1 if ply % 2 == 0 else -1
+        loss = sign * (before - after)
+
+        evals.append(after)
+        best.append(best_move)
+        marks.append(next((mark for threshold, mark in AnalysisConfig.MARKS if loss >= threshold), None))
+
+        side = 'white' if sign == 1 else 'black'
+        accuracies[side].append(move_accuracy(win_percent(sign * before), win_percent(sign * after)))
+
+    return {
+        'game_id': game_id,
+        'evals': evals,
+        'best': best,
+        'marks': marks,
+        'accuracy': {side: round(sum(values) / len(values), 1) if values else None
+                     for side, values in accuracies.items()},
+        'complete': plies == len(moves),
+    }
+
+
+class AnalysisJob:
+    def __init__(self, game_id: str, moves: List[chess.Move], players: List[Tuple[str, str]]):
+        self.game_id = game_id
+        self.moves = moves[:AnalysisConfig.MAX_PLIES]
+        self.total_plies = len(moves)
+        self.players = players  # (pid, sid at the end of the game) of each human player
+
+
+class AnalysisService:
+    def __init__(self, pool: StockfishPool, live_pool: StockfishPool):
+        self.pool = pool
+        self.live_pool = live_pool
+        self.jobs: Deque[AnalysisJob] = deque()
+        self.cache = LRUCache(AnalysisConfig.CACHE_SIZE)  # position hash -> Evaluation
+        self.enabled = False
+
+        # Metrics
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.positions = 0
+        self.cache_hits = 0
+        self.engine_seconds = 0.0
+        self.yields = 0
+
+    def submit(self, game_id: str, moves: List[chess.Move], players: List[Tuple[str, str]]) -> None:
+        """Queue a finished game, only touches memory"""
+        if not self.enabled or not players or len(moves) < AnalysisConfig.MIN_PLIES:
+            return
+
+        if len(self.jobs) >= AnalysisConfig.QUEUE_SIZE:
+            self.jobs.popleft()
+            self.dropped += 1
+
+        self.jobs.append(AnalysisJob(game_id, moves, players))
+
+    def start(self) -> None:
+        """Start the workers, analysis stays off without an engine binary"""
+        if not AnalysisConfig.ENABLED or not os.path.exists(self.pool.path):
+            logger.info('Post-game analysis is off')
+            return
+
+        self.enabled = True
+        for _ in range(AnalysisConfig.WORKERS):
+            running.socketio.start_background_task(self.run)
+
+    def run(self) -> None:
+        while True:
+            if not self.jobs:
+                running.socketio.sleep(AnalysisConfig.YIELD_SLEEP)
+                continue
+
+            job = self.jobs.popleft()
+            try:
+                result = self.analyse(job)
+            except Exception:
+                # Engine errors and crashes included, the worker carries on with the next game
+                logger.exception('Analysis failed, game ID = %s', job.game_id)
+                self.failed += 1
+                continue
+
+            self.completed += 1
+            self.deliver(job, result)
+
+    def analyse(self, job: AnalysisJob) -> dict:
+        board = chess.Board()
+        evaluation, spent = self.evaluate(board)
+        evaluations = [evaluation]
+
+        for move in job.moves:
+            if spent >= AnalysisConfig.GAME_SECONDS:
+                break
+
+            board.push(move)
+            evaluation, seconds = self.evaluate(board)
+            evaluations.append(evaluation)
+            spent += seconds
+
+        result = summarize(job.game_id, job.moves, evaluations)
+        result['complete'] = result['complete'] and job.total_plies == len(job.moves)
+        return result
+
+    def evaluate(self, board: chess.Board) -> Tuple[Evaluation, float]:
+        """The evaluation of the position, with the engine seconds it took"""
+        key = chess.polyglot.zobrist_hash(board)
+        evaluation = self.cache.get(key)
+        if evaluation is not None:
+            self.cache_hits += 1
+            return evaluation, 0.0
+
+        seconds = 0.0
+        if board.is_game_over():
+            evaluation = (self.final_score(board), None)
+        else:
+            self.wait_for_idle_engines()
+            with self.pool.slot():
+                evaluation, seconds = tpool.execute(self.search, board.copy(stack=False))
+            self.positions += 1
+            self.engine_seconds += seconds
+
+        self.cache.put(key, evaluation)
+        return evaluation, seconds
+
+    def wait_for_idle_engines(self) -> None:
+        # Live bot searches first: no analysis while one is waiting for an engine or every engine is busy
+        while self.live_pool.waiting or self.live_pool.busy >= self.live_pool.size:
+            self.yields += 1
+            running.socketio.sleep(AnalysisConfig.YIELD_SLEEP)
+
+    def search(self, board: chess.Board) -> Tuple[Evaluation, float]:
+        """Runs in a native thread"""
+        engine = self.pool.get_engine(20)
+        failed = False
+
+        try:
+            start = time.monotonic()
+            info = engine.analyse(board, chess.engine.Limit(**AnalysisConfig.POSITION_LIMIT))
+            seconds = time.monotonic() - start
+
+            pv = info.get('pv')
+            score = info['score'].white().score(mate_score=AnalysisConfig.MATE_SCORE)
+            return (score, pv[0].uci() if pv else None), seconds
+        except chess.engine.EngineError:
+            failed = True
+            raise
+        finally:
+            self.pool.return_engine(engine, failed=failed)
+
+    @staticmethod
+    def final_score(board: chess.Board) -> int:
+        if board.is_checkmate():
+            return -AnalysisConfig.MATE_SCORE if board.turn == chess.WHITE else AnalysisConfig.MATE_SCORE
+        return 0
+
+    def deliver(self, job: AnalysisJob, result: dict) -> None:
+        # The player may have reconnected since the game ended, their current session wins
+        sids = [running.sid_of_pid.get(pid, sid) for pid, sid in job.players]
+        send_command(sids, 'analysis', result)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': len(self.jobs),
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'positions': self.positions,
+            'cache_hits': self.cache_hits,
+            'engine_seconds': self.engine_seconds,
+            'yields': self.yields,
+        }
+
+
+analysis = AnalysisService(
+    StockfishPool(stockfish_pool.path, size=AnalysisConfig.WORKERS, niceness=AnalysisConfig.NICENESS),
+    live_pool=stockfish_pool,
+)
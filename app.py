@@ -1,37 +1,114 @@
-import threading
+import os
+
+if os.environ.get('ICHESS_REDIS_URL'):
+    # The Socket.IO message queue needs green sockets, threads stay native for the engine pool and tpool
+    import eventlet
+    eventlet.monkey_patch(all=False, socket=True, select=True)
+
+import signal
+import sys
 import time
 from datetime import datetime
-from random import choice, randint, shuffle
+from random import shuffle
 from typing import List, Optional
 
-from flask import Flask, request
+from flask import Flask, Response, jsonify, request
 
+from analysis import analysis
+from archive import ArchiveConfig, archive
+from bot_profiles import create_bot
+from bot_search import stockfish_pool
+from clock import clock_service
+from cluster import (adopt, forward_disconnect, forward_join, forward_unwatch, forward_watch, handlers, listen,
+                     routed)
+from dbc import connect
 from game import Game
-from player import join, level_of, player_of, update_elo, update_elo_after_game
-from share import (Reasons, create_socketio, get_logger, running, send_command,
-                   send_message)
+from journal import JournalConfig, journal
+from matchmaking import Matchmaker
+from metrics import Counter, Gauge, Histogram, handler_seconds, render, timed
+from move_source import move_source
+from player import cache_stats, forget, join, level_of, name_of, player_of
+from protocol import client_info, forget_client, register_client
+from ratelimit import limited
+from share import create_socketio, get_logger, running, send_command, send_message
+from spectators import SpectatorConfig, spectators
+from state_backend import StateConfig, state
+from write_behind import rating_writes
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'chessroad-up-up-day-day'
-socketio = create_socketio(app)
+socketio = create_socketio(app, message_queue=StateConfig.REDIS_URL)
 
 logger = get_logger(__name__)
+move_logger = get_logger(__name__, 'move')      # One record per move, the first to turn down in production
+event_logger = get_logger(__name__, 'events')   # Draw, takeback, resign and chat events
 
 
 @app.route('/')
 def index():
+    bot_moves = move_source.stats()
+    profiles = cache_stats()['profile']
+
     return 'Welcome to Chessroad!\n' \
            + f"Server time: {datetime.now().strftime('%H:%M')}\n" \
-           + f'Current online players: {len(running.online_players)}\n' \
-           + f'Current matching game waiting list: {len(running.waiting_players)}\n'
+           + f'Current online players: {state.online_count()}\n' \
+           + f'Current matching game waiting list: {state.waiting_count()}\n' \
+           + f"Bot move book/cache hit rate: {bot_moves['hit_rate']:.1%}, " \
+           + f"engine seconds saved: {bot_moves['saved_engine_seconds']:.0f}\n" \
+           + f"Cached player profiles: {profiles['size']}, hits: {profiles['hits']}, misses: {profiles['misses']}\n"
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/archive')
+def archive_segments():
+    """The archive segments, oldest first, a segment name is also a cursor, its worker's games start there"""
+    return jsonify([{'segment': name, 'bytes': size} for name, size in archive.segment_sizes()])
+
+
+@app.route('/archive/games.pgn')
+def archive_games():
+    """
+    A page of archived games as PGN, at most `limit` of them from `cursor` on, the first games without one
+    The X-Next-Cursor header carries the cursor of the next page, with a position in the segments of each worker,
+    e.g. /archive/games.pgn?limit=1000, then /archive/games.pgn?cursor=00000042-w1.pgn.gz:81920:12,...&limit=1000
+    """
+    limit = max(1, min(request.args.get('limit', ArchiveConfig.PAGE_SIZE, type=int), ArchiveConfig.PAGE_LIMIT))
+    try:
+        games, next_cursor = archive.page(request.args.get('cursor'), limit)
+    except ValueError:
+        return Response('Bad cursor\n', status=400, mimetype='text/plain')
+
+    response = Response(''.join(games), mimetype='application/x-chess-pgn')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@app.route('/games')
+def games():
+    """
+    Live games to watch, highest rated first, e.g. /games?bot=1&min_elo=2000&limit=20
+    bot=1 lists bot games only, bot=0 games between players only
+    """
+    bot = request.args.get('bot')
+    limit = min(request.args.get('limit', SpectatorConfig.LIST_LIMIT, type=int), SpectatorConfig.LIST_LIMIT)
+
+    return jsonify(spectators.live_games(limit=limit, bots=None if bot is None else bot == '1',
+                                         min_elo=request.args.get('min_elo', 0, type=int)))
 
 
 @socketio.on('connect')
+@timed(handler_seconds.labels('connect'))
 def on_connect():
     # what happens when somebody connects
-    logger.info(f'New connection made: {request.sid}')
+    logger.info('New connection made: %s', request.sid)
 
-    running.online_players.append(request.sid)
+    running.online_players.add(request.sid)
+    state.connected(1)
 
     welcome()
 
@@ -39,124 +116,231 @@ def on_connect():
 
 
 @socketio.on('disconnect')
+@timed(handler_seconds.labels('disconnect'))
 def on_disconnect():
+    state.connected(-1)
+
+    # The worker hosting their game, or the game they watch, if not this one, cleans up its side too
+    forward_disconnect(request.sid)
+    forward_unwatch(request.sid)
+
+    handle_disconnect(request.sid)
+
+
+def handle_disconnect(sid: str, _=None):
     # Maintaining numbers and lists of ALL connected players
-    running.online_players.remove(request.sid)
+    running.online_players.discard(sid)
+
+    # Disconnected player was in a waiting list
+    matchmaker.remove(sid)
+    spectators.unwatch(sid)
 
-    # Disconnected player was in a waiting list - using pop() with a default value
-    running.waiting_players.pop(request.sid, None)
+    # Disconnected player was in a game, their seat is held for a while
+    game = find_game(sid)
+    if game:
+        logger.info('Player in a chess game has disconnected')
+        game.hold_seat(sid)
 
-    # Disconnected player was in a game, checking
-    for game in running.games:
-        if request.sid in game.players:
-            logger.info('Player in a chess game has disconnected')
-            game.player_disconnected(request.sid)
+    running.unbind_sid(sid)
+    forget(sid)
+    forget_client(sid)
 
     logger.info('Connection Lost and handled by the server')
 
 
+handlers['disconnect'] = handle_disconnect  # Run here when forwarded by the player's own worker
+
+
 @socketio.on('join')
+@limited('join')
+@timed(handler_seconds.labels('join'))
 def on_join(data):
-    logger.info(f'{request.sid} logged in with {data}.')
+    logger.info('%s logged in with %s.', request.sid, data)
 
     if 'pid' not in data or 'name' not in data:
-        send_message(request.sid, 'Login failed, please check the client version!')
+        send_message([request.sid], 'Login failed, please check the client version!')
         return
 
     join(request.sid, data['pid'], data['name'])
+    register_client(request.sid, data)
+
+    # Back to a game they dropped out of, or that was in progress when the server restarted
+    game = running.away_game_of_pid.get(data['pid'])
+    if game:
+        game.seat(request.sid)
+        return
+
+    # Their seat is held by the worker hosting their game
+    if forward_join(request.sid, data):
+        return
 
     on_match(data)
 
 
 @socketio.on('match')
-def on_match(data):
-    logger.info(f'{request.sid} wants to play with time control: {data}')
+@limited('match')
+@timed(handler_seconds.labels('match'))
+@routed('match')
+def on_match(sid: str, data: dict):
+    logger.info('%s wants to play with time control: %s', sid, data)
 
-    game = find_game(request.sid)
+    game = find_game(sid)
     if game:
-        logger.info(f'{request.sid} is already in a game.')
+        logger.info('%s is already in a game.', sid)
+        return
+
+    player = player_of(sid)
+    if not player:
         return
 
     time_control_index = data.get('time_control', 0)  # 默认使用第一个时间规则
 
-    # 将玩家加入等待队列，同时保存他们选择的时间规则
-    if request.sid not in running.waiting_players:
-        running.waiting_players[request.sid] = {'join_time': time.time(), 'time_control': time_control_index}
+    # 将玩家加入等待队列，同时保存他们选择的时间规则和等级，有合适的对手时立即匹配
+    # The profile travels with the queue entry, in case another worker hosts the game
+    profile = {'pid': player['pid'], 'name': name_of(sid), 'elo': player['elo'], **client_info(sid)}
+    matchmaker.add(sid, time_control_index, level_of(player['elo']), profile)
 
 
 @socketio.on('move')
-def on_move(data):
-    logger.info(f'{request.sid} wants to move {data}.')
+@limited('move')
+@timed(handler_seconds.labels('move'))
+@routed('move')
+def on_move(sid: str, data: dict):
+    move_logger.info('%s wants to move %s.', sid, data)
 
-    game = find_game(request.sid)
+    game = find_game(sid)
     if game:
-        if not game.on_move(data, request.sid):
-            logger.info(f'{request.sid} sent an invalid move.')
+        if not game.on_move(data, sid):
+            move_logger.info('%s sent an invalid move.', sid)
     else:
-        logger.info(f'{request.sid} is not in a game.')
+        move_logger.info('%s is not in a game.', sid)
+
+
+@socketio.on('sync')
+@limited('sync')
+@timed(handler_seconds.labels('sync'))
+@routed('sync')
+def on_sync(sid: str, _=None):
+    game = find_game(sid)
+    if game:
+        game.send_sync(sid)
 
 
 @socketio.on('propose_draw')
-def on_propose_draw(_):
-    logger.info(f'{request.sid} proposed a draw.')
+@limited('propose_draw')
+@timed(handler_seconds.labels('propose_draw'))
+@routed('propose_draw')
+def on_propose_draw(sid: str, _=None):
+    event_logger.info('%s proposed a draw.', sid)
 
-    game = find_game(request.sid)
+    game = find_game(sid)
     if game:
-        if game.on_draw_proposal(request.sid):
-            logger.info(f'{request.sid} proposed a draw')
+        if game.on_draw_proposal(sid):
+            event_logger.info('%s proposed a draw', sid)
         else:
-            logger.info(f'{request.sid} draw proposal failed')
+            event_logger.info('%s draw proposal failed', sid)
 
 
 @socketio.on('draw_response')
-def on_draw_response(data):
-    logger.info(f'{request.sid} responded to draw: {data}')
+@limited('draw_response')
+@timed(handler_seconds.labels('draw_response'))
+@routed('draw_response')
+def on_draw_response(sid: str, data: dict):
+    event_logger.info('%s responded to draw: %s', sid, data)
 
-    game = find_game(request.sid)
+    game = find_game(sid)
     if game:
         accepted = data.get('accepted', False)
-        if game.on_draw_response(request.sid, accepted):
-            logger.info(f'{request.sid} responded to draw: {accepted}')
+        if game.on_draw_response(sid, accepted):
+            event_logger.info('%s responded to draw: %s', sid, accepted)
         else:
-            logger.info(f'{request.sid} draw response failed')
+            event_logger.info('%s draw response failed', sid)
 
 
 @socketio.on('propose_takeback')
-def on_propose_takeback(_):
-    game = find_game(request.sid)
+@limited('propose_takeback')
+@timed(handler_seconds.labels('propose_takeback'))
+@routed('propose_takeback')
+def on_propose_takeback(sid: str, _=None):
+    game = find_game(sid)
     if game:
-        if game.on_takeback_proposal(request.sid):
-            logger.info(f'{request.sid} requested takeback')
+        if game.on_takeback_proposal(sid):
+            event_logger.info('%s requested takeback', sid)
         else:
-            logger.info(f'{request.sid} takeback request failed')
+            event_logger.info('%s takeback request failed', sid)
 
 
 @socketio.on('takeback_response')
-def on_takeback_response(data):
-    game = find_game(request.sid)
+@limited('takeback_response')
+@timed(handler_seconds.labels('takeback_response'))
+@routed('takeback_response')
+def on_takeback_response(sid: str, data: dict):
+    game = find_game(sid)
     if game:
         accepted = data.get('accepted', False)
-        if game.on_takeback_response(request.sid, accepted):
-            logger.info(f'{request.sid} responded to takeback: {accepted}')
+        if game.on_takeback_response(sid, accepted):
+            event_logger.info('%s responded to takeback: %s', sid, accepted)
         else:
-            logger.info(f'{request.sid} takeback response failed')
+            event_logger.info('%s takeback response failed', sid)
 
 
 @socketio.on('resign')
-def on_resign(_):
-    logger.info(f'{request.sid} wants to resign.')
+@limited('resign')
+@timed(handler_seconds.labels('resign'))
+@routed('resign')
+def on_resign(sid: str, _=None):
+    event_logger.info('%s wants to resign.', sid)
 
-    game = find_game(request.sid)
+    game = find_game(sid)
     if game:
-        game.on_resign(request.sid)
+        game.on_resign(sid)
     else:
-        logger.info(f'{request.sid} is not in a game.')
+        event_logger.info('%s is not in a game.', sid)
+
+
+@socketio.on('watch')
+@limited('watch')
+@timed(handler_seconds.labels('watch'))
+def on_watch(data):
+    game_id = data.get('game_id') if isinstance(data, dict) else None
+
+    # Leaving the game watched on another worker, if any, then watching here or where the game is hosted
+    forward_unwatch(request.sid)
+    if game_id not in running.game_of_id and game_id is not None and forward_watch(request.sid, data):
+        spectators.unwatch(request.sid)
+        return
+
+    watch_game(request.sid, data)
+
+
+def watch_game(sid: str, data: dict):
+    game_id = data.get('game_id') if isinstance(data, dict) else None
+
+    game = running.game_of_id.get(game_id)
+    if game:
+        spectators.watch(sid, game)
+    else:
+        send_command([sid], 'watch_end', {'game_id': game_id, 'result': None, 'reason': 'NOT_FOUND'})
+
+
+@socketio.on('unwatch')
+@limited('unwatch')
+@timed(handler_seconds.labels('unwatch'))
+def on_unwatch(_=None):
+    spectators.unwatch(request.sid)
+    forward_unwatch(request.sid)
+
+
+# Run here when forwarded by the spectator's own worker
+handlers['watch'] = watch_game
+handlers['unwatch'] = lambda sid, _: spectators.unwatch(sid)
 
 
 @socketio.on('message')
+@limited('message')
 def on_message(data):
     # we got something from a client
-    logger.info(f'{request.sid} sent a message: {data}')
+    event_logger.info('%s sent a message: %s', request.sid, data)
 
 
 # Constant definitions
@@ -164,20 +348,6 @@ WELCOME_MESSAGE = 'Welcome to Chessroad!'
 SERVER_SECRET = 'chessroad-up-up-day-day'
 
 
-class MatchConfig:
-    DIFF_INIT = 1          # Initial level difference
-    DIFF_INCREMENT = 1     # Incremental level difference
-    DIFF_MAX = 4           # Maximum level difference
-    BOT_WAIT_TIME = 15     # Waiting time for bot matching (seconds)
-    CHECK_INTERVAL = 5     # Matching check interval (seconds)
-
-    BOT_NAMES = [
-        "Chess Master", "Chess Grandmaster", "Chess Expert",
-        "Rising Star", "Chess Proficient", "Chess Virtuoso",
-        "Chess Champion", "Chess Phenomenon"
-    ]
-
-
 class GameConfig:
     # 定义不同的时间规则 (总时间(分钟), 增量(秒))
     TIME_CONTROLS = [
@@ -200,8 +370,8 @@ def welcome():
     messages = [
         WELCOME_MESSAGE,
         f"Server time: {datetime.now().strftime('%H:%M')}",
-        f'Current online players: {len(running.online_players)}',
-        f'Current matching game waiting list: {len(running.waiting_players) + 1}'
+        f'Current online players: {state.online_count()}',
+        f'Current matching game waiting list: {state.waiting_count() + 1}'
     ]
     for message in messages:
         send_message([request.sid], message)
@@ -210,94 +380,33 @@ def welcome():
 def match_players():
     """
     Background matching system main loop
-    - Handle player matching
+    - Widen the level window of waiting players
     - Create bot opponents after timeout
     """
-    threading.current_thread().name = 'match_players'
-
     while True:
-        socketio.sleep(MatchConfig.CHECK_INTERVAL)
+        socketio.sleep(matchmaker.sleep_time())
         process_matching_queue()
 
 
 def process_matching_queue():
-    """Process player matching in the waiting queue"""
-    current_time = time.time()
-    to_remove = []  # Players to be removed from the waiting queue
-
-    for sid, data in running.waiting_players.items():
-        if sid in to_remove:
-            continue
-
-        time_waited = current_time - data['join_time']
-        if try_match_player(sid, time_waited, to_remove, data['time_control']):
-            continue
-
-        if try_create_bot_match(sid, time_waited, to_remove, data['time_control']):
-            continue
-
-    # Clean up matched players
-    for sid in to_remove:
-        running.waiting_players.pop(sid, None)
-
-
-def try_match_player(sid: str, time_waited: float, to_remove: List[str], time_control_index: int) -> bool:
-    """Try to match a player with an opponent"""
-    level = level_of(player_of(sid)['elo'])
+    """Process the matching deadlines that have passed"""
+    with matching_tick_seconds.time():
+        matchmaker.process_due(time.time())
 
-    allowed_difference = min(
-        MatchConfig.DIFF_INIT + (MatchConfig.DIFF_INCREMENT * int(time_waited / 5)),
-        MatchConfig.DIFF_MAX
-    )
-    for other_sid, other_data in running.waiting_players.items():
-        if other_sid == sid or other_sid in to_remove:
-            continue
 
-        # 检查时间规则是否匹配
-        if other_data['time_control'] != time_control_index:
-            continue
-
-        if is_suitable_opponent(level, other_sid, allowed_difference):
-            create_match([sid, other_sid], to_remove, time_control_index)
-            return True
-
-    return False
-
-
-def is_suitable_opponent(player_level: int, opponent_sid: str, allowed_difference: int) -> bool:
-    """Check if the opponent is suitable for matching"""
-    opponent_level = level_of(player_of(opponent_sid)['elo'])
-    return abs(player_level - opponent_level) <= allowed_difference
-
-
-def try_create_bot_match(sid: str, time_waited: float, to_remove: List[str], time_control_index: int) -> bool:
-    """Try to create a bot match"""
-    if time_waited > MatchConfig.BOT_WAIT_TIME and sid not in to_remove:
-        bot_sid = create_bot_player(sid)
-        create_match([sid, bot_sid], to_remove, time_control_index, is_bot=bot_sid)
-        return True
-
-    return False
+def create_bot_match(sid: str, time_control_index: int):
+    """Match a player who waited too long with a bot"""
+    bot_sid = create_bot_player(sid)
+    create_match([sid, bot_sid], time_control_index, is_bot=bot_sid)
 
 
 def create_bot_player(player_sid: str) -> str:
-    """Create and initialize a bot player"""
-    bot_sid = f"bot_{time.time()}"
-    bot_name = choice(MatchConfig.BOT_NAMES)
-
-    join(bot_sid, bot_sid, bot_name)
-
-    # Set bot level
-    bot_player = player_of(bot_sid)
-    bot_player['elo'] = player_of(player_sid)['elo'] + randint(-100, 100)
-    update_elo(bot_player)
-
-    return bot_sid
+    """Seat an in-memory roster bot close to the player's rating"""
+    return create_bot(player_of(player_sid)['elo'])
 
 
-def create_match(pair: List[str], to_remove: List[str], time_control_index: int, is_bot: str = None):
+def create_match(pair: List[str], time_control_index: int, is_bot: str = None):
     """Create a match and notify players"""
-    to_remove.extend([p for p in pair if not p.startswith('bot_')])
     send_message(pair, 'Match found.. Connecting')
     make_game(pair, time_control_index=time_control_index, is_bot=is_bot)
 
@@ -321,53 +430,103 @@ def make_game(pair: List[str], time_control_index: int, is_bot: str = None):
 
     # Running the game
     game = Game(pair, total_time, increment, bot_sid=is_bot)
-    running.games.append(game)
-
-    logger.info(f'Hosted a game. ID = {game.game_id}' + (' (with bot)' if is_bot else ''))
+    running.add_game(game)
+
+    logger.info('Hosted a game. ID = %s%s', game.game_id, ' (with bot)' if is_bot else '')
+
+
+matchmaker = Matchmaker(on_pair=create_match, on_bot=create_bot_match, backend=state, on_adopt=adopt)
+
+matching_tick_seconds = Histogram('ichess_matching_tick_seconds', 'Duration of a matching queue tick')
+Gauge('ichess_waiting_players', 'Players of this worker waiting for a match', read=lambda: len(running.waiting_players))
+Gauge('ichess_matching_deadlines', 'Pending matching deadlines, stale ones included',
+      read=lambda: len(matchmaker.deadlines))
+Gauge('ichess_active_games', 'Games hosted by this worker', read=lambda: len(running.games))
+Gauge('ichess_online_players', 'Players connected to this worker or hosted here',
+      read=lambda: len(running.online_players))
+Gauge('ichess_engines', 'Stockfish pool engines by state', ['state'],
+      read=lambda: {('busy',): stockfish_pool.busy, ('idle',): len(stockfish_pool.pool)})
+Gauge('ichess_engine_waiters', 'Bot searches waiting for a free engine', read=lambda: stockfish_pool.waiting)
+Counter('ichess_engine_checkout_timeouts_total', 'Engine checkouts that gave up waiting',
+        read=lambda: stockfish_pool.timeouts)
+Counter('ichess_engines_spawned_total', 'Stockfish processes started, replacements included',
+        read=lambda: stockfish_pool.stats()['spawned'])
+Counter('ichess_engines_replaced_total', 'Crashed or failed Stockfish processes discarded',
+        read=lambda: stockfish_pool.stats()['replaced'])
+Counter('ichess_bot_moves_total', 'Bot moves by source', ['source'],
+        read=lambda: {('book',): move_source.book_hits, ('cache',): move_source.cache_hits,
+                      ('engine',): move_source.misses})
+Gauge('ichess_rating_writes_pending', 'Rating changes waiting to be written', read=lambda: len(rating_writes.pending))
+Counter('ichess_rating_write_failures_total', 'Failed rating write batches', read=lambda: rating_writes.failures)
+Gauge('ichess_analysis_queue', 'Finished games waiting for analysis', read=lambda: len(analysis.jobs))
+Counter('ichess_analysis_games_total', 'Post-game analyses by outcome', ['outcome'],
+        read=lambda: {('completed',): analysis.completed, ('dropped',): analysis.dropped, ('failed',): analysis.failed})
+Counter('ichess_analysis_positions_total', 'Positions analysed, by source', ['source'],
+        read=lambda: {('engine',): analysis.positions, ('cache',): analysis.cache_hits})
+Counter('ichess_analysis_yields_total', 'Times analysis waited for live bot searches', read=lambda: analysis.yields)
+Gauge('ichess_spectators', 'Spectators watching a game of this worker', read=lambda: len(spectators.watching))
+Counter('ichess_spectator_updates_total', 'Coalesced updates sent to watch rooms', read=lambda: spectators.updates)
+Gauge('ichess_archive_pending_games', 'Finished games waiting to be archived', read=lambda: len(archive.pending))
+Counter('ichess_archived_games_total', 'Finished games written to the archive', read=lambda: archive.archived)
+Counter('ichess_archive_failures_total', 'Failed archive batches', read=lambda: archive.failures)
+Gauge('ichess_journal_pending_records', 'Game journal records waiting to be written', read=lambda: len(journal.pending))
+Counter('ichess_journal_flushes_total', 'Game journal batches written', read=lambda: journal.flushes)
+Gauge('ichess_restored_games_waiting', 'Restored games still missing a player',
+      read=lambda: len(set(running.away_game_of_pid.values())))
 
 
 def find_game(sid: str) -> Optional[Game]:
-    for game in running.games:
-        if sid in game.players:
-            return game
-
-    return None
+    return running.find_game(sid)
 
 
 def timer_task():
-    threading.current_thread().name = 'timer_task'
+    clock_service.run()
 
-    while True:
-        running.socketio.sleep(1)
 
-        for game in running.games:
-            if game.is_game_over:
-                continue
+def live_games():
+    return [game.record() for game in running.games]
 
-            game.update_timer()
 
-            current = game.players[game.current_player_index]
-            opponent = game.opponent_of(current)
+def restore_games():
+    """Resume the games the journal has in progress, then start journaling"""
+    if not JournalConfig.PATH:
+        return
 
-            current_time = int(game.player_times[game.current_player_index])
-            opponent_time = int(game.player_times[(game.current_player_index + 1) % 2])
+    start = time.monotonic()
+    for record in journal.replay().values():
+        try:
+            running.add_game(Game.restore(record))
+        except ValueError:
+            logger.exception('Failed to restore game %s', record.game_id)
 
-            if current_time < 0 or opponent_time < 0:
-                loser = current if current_time < 0 else opponent
-                winner = game.opponent_of(loser)
+    # Only the restored games are carried over, the records of finished games go
+    journal.open()
+    journal.compact(live_games())
 
-                game.declare_loser([loser], Reasons.Lose.OUT_OF_TIME)
-                game.declare_winner([winner], Reasons.Win.OPPONENT_OUT_OF_TIME)
+    logger.info('Restored %s games in %.2fs', len(running.games), time.monotonic() - start)
+    socketio.start_background_task(journal.run, live_games)
 
-                update_elo_after_game(winner, loser, 1)
 
-            else:
-                send_command([current], 'timer', {'mine': current_time, 'opponent': opponent_time})
-                send_command([opponent], 'timer', {'mine': opponent_time, 'opponent': current_time})
+def serve(host: str = '0.0.0.0', port: int = 8888):
+    """Start the background tasks and serve until stopped"""
+    state.start()
+    restore_games()
+    socketio.start_background_task(target=match_players)
+    socketio.start_background_task(target=timer_task)
+    socketio.start_background_task(target=rating_writes.run)
+    socketio.start_background_task(target=archive.run)
+    socketio.start_background_task(target=spectators.run)
+    analysis.start()
+    socketio.start_background_task(listen, matchmaker.forget)
+
+    # docker stop sends SIGTERM, whose default action skips atexit: stop as on Ctrl-C instead,
+    # so the rating changes, journal records and finished games still queued are written on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    socketio.run(app, host=host, port=port)
 
 
 if __name__ == '__main__':
     logger.info('Starting server...')
-    socketio.start_background_task(target=match_players)
-    socketio.start_background_task(target=timer_task)
-    socketio.run(app, host='0.0.0.0', port=8888)
+    connect()  # Fail early if the database is unreachable, and make sure the indexes exist
+    stockfish_pool.start()
+    serve(port=int(os.environ.get('ICHESS_PORT', 8888)))
@@ -0,0 +1,290 @@
+"""
+Archive of finished games, as PGN with clock comments, in gzip segment files
+
+Finished games are queued as plain snapshots and a background loop writes them in batches:
+PGN serialization, compression and the write all run in a native thread, one gzip member per batch
+appended to the current segment. A segment is closed for good once it reaches SEGMENT_BYTES.
+Segments are named <number>-<worker>.pgn.gz, so workers can share the directory. Workers write at the same time,
+each to its own last segment, so the directory as a whole has no write order: an export cursor keeps one position
+per worker, whose own segments do sort in write order.
+"""
+import atexit
+import gzip
+import io
+import itertools
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import chess.pgn
+
+from batch_writer import BatchWriter
+from share import get_logger, running
+from state_backend import StateConfig
+
+logger = get_logger(__name__)
+
+
+class ArchiveConfig:
+    DIRECTORY = os.environ.get('ICHESS_ARCHIVE_DIR', './data/archive')  # Empty to disable
+    FLUSH_SIZE = 500               # Queued games that trigger an early flush
+    FLUSH_INTERVAL = 5.0           # Longest time a finished game waits before being written (seconds)
+    SEGMENT_BYTES = 64 * 2 ** 20   # Compressed size at which a new segment is started
+    COMPRESS_LEVEL = 6
+    PAGE_SIZE = 100                # Games of an export page unless asked otherwise
+    PAGE_LIMIT = 5_000             # Most games of an export page
+
+
+SEGMENT_SUFFIX = '.pgn.gz'
+READ_BYTES = 64 * 2 ** 10
+
+# Where an export stands in the segments of one worker: (segment, byte offset of a batch, games of the batch read)
+Position = Tuple[str, int, int]
+
+
+def to_pgn(game: Dict[str, Any]) -> str:
+    """A finished game snapshot as PGN, each move annotated with the mover's clock, e.g. { [%clk 0:04:58] }"""
+    pgn = chess.pgn.Game()
+    pgn.headers.update({
+        'Event': 'iChess casual game',
+        'Site': 'iChess',
+        'Date': game['date'],
+        'Round': '-',
+        'White': game['names'][0],
+        'Black': game['names'][1],
+        'Result': game['result'],
+        'WhiteElo': str(game['elos'][0]),
+        'BlackElo': str(game['elos'][1]),
+        'TimeControl': game['time_control'],
+        'Termination': game['termination'],
+        'GameId': game['game_id'],
+    })
+
+    node = pgn
+    for ply, (move, clocks) in enumerate(zip(game['moves'], game['clocks'])):
+        node = node.add_variation(move)
+        node.set_clock(max(0.0, clocks[ply % 2]))
+
+    return str(pgn) + '\n\n'
+
+
+class GameArchive(BatchWriter):
+    """
+    - add() only queues the snapshot of a finished game
+    - A background loop writes every FLUSH_INTERVAL, or sooner once FLUSH_SIZE games are queued
+    - A failed batch goes back to the queue and is retried with the next flush
+    """
+
+    ITEMS = 'finished games'
+    FLUSH_INTERVAL = ArchiveConfig.FLUSH_INTERVAL
+
+    def __init__(self, directory: str):
+        super().__init__(logger)
+        self.directory = directory
+        self.pending: List[Dict[str, Any]] = []
+        self.segment: Optional[str] = None
+
+        # Metrics
+        self.archived = 0
+
+    def add(self, game: Dict[str, Any]) -> None:
+        if not self.directory:
+            return
+
+        self.pending.append(game)
+
+        if len(self.pending) >= ArchiveConfig.FLUSH_SIZE and not self.flushing:
+            running.socketio.start_background_task(self.flush)
+
+    # Writing
+
+    def segments(self) -> List[str]:
+        """Segment names, oldest first"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def segments_by_worker(self) -> Dict[str, List[str]]:
+        """The segments of each worker, oldest first"""
+        by_worker: Dict[str, List[str]] = {}
+        for name in self.segments():
+            by_worker.setdefault(segment_worker(name), []).append(name)
+
+        return by_worker
+
+    def segment_sizes(self) -> List[Tuple[str, int]]:
+        return [(name, os.path.getsize(os.path.join(self.directory, name))) for name in self.segments()]
+
+    def current_segment(self) -> str:
+        if self.segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Segments left by an earlier run are never appended to, a crash may have torn their end
+            segments = self.segments()
+            self.segment = segment_name(segment_number(segments[-1]) + 1 if segments else 1)
+
+        path = os.path.join(self.directory, self.segment)
+        if os.path.exists(path) and os.path.getsize(path) >= ArchiveConfig.SEGMENT_BYTES:
+            self.segment = segment_name(segment_number(self.segment) + 1)
+
+        return os.path.join(self.directory, self.segment)
+
+    def has_pending(self) -> bool:
+        return bool(self.pending)
+
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    def take(self) -> List[Dict[str, Any]]:
+        batch, self.pending = self.pending, []
+        return batch
+
+    def write(self, batch: List[Dict[str, Any]]) -> bool:
+        # Serializing and compressing is CPU work too
+        text = ''.join(to_pgn(game) for game in batch)
+        data = gzip.compress(text.encode(), compresslevel=ArchiveConfig.COMPRESS_LEVEL)
+
+        # Each batch is a complete gzip member, a reader sees the members of a segment as one stream
+        with open(self.current_segment(), 'ab') as segment:
+            segment.write(data)
+
+        return True
+
+    def settle(self, batch: List[Dict[str, Any]], ok: bool) -> None:
+        if ok:
+            self.archived += len(batch)
+        else:
+            self.pending[:0] = batch
+
+    # Reading
+
+    def export(self, cursor: str = None) -> Iterator[Tuple[str, str]]:
+        """
+        Archived games as PGN text, one game per item along with the cursor of the game after it, from `cursor` on
+        - The games of each worker in write order, one worker after the other
+        - Reads one batch at a time, memory stays constant whatever the size of the archive
+        - The cursor holds the byte offset of a batch, resuming decompresses at most that batch again
+        """
+        positions = parse_cursor(cursor) if cursor else {}
+
+        for worker, names in self.segments_by_worker().items():
+            start_segment, offset, skip = positions.get(worker, (names[0], 0, 0))
+
+            for name in names:
+                if name < start_segment:
+                    continue
+                if name > start_segment:
+                    offset, skip = 0, 0
+
+                try:
+                    for next_offset, text in read_batches(os.path.join(self.directory, name), offset):
+                        games = list(_split_games(text.splitlines(keepends=True)))
+                        for index in range(skip, len(games)):
+                            last = index == len(games) - 1
+                            positions[worker] = (name, next_offset, 0) if last else (name, offset, index + 1)
+                            yield games[index], make_cursor(positions)
+
+                        offset, skip = next_offset, 0
+                except zlib.error:
+                    # A batch torn by a crash, the segment is never appended to again
+                    logger.error('Segment %s has a damaged batch at byte %s', name, offset)
+
+    def page(self, cursor: str = None, limit: int = ArchiveConfig.PAGE_SIZE) -> Tuple[List[str], Optional[str]]:
+        """
+        Up to `limit` games from `cursor` on, and the cursor to ask for the next page with
+        Past the last game the cursor stays where it is, asking again later returns the games archived since
+        """
+        games, next_cursor = [], cursor
+        for pgn, next_cursor in itertools.islice(self.export(cursor), limit):
+            games.append(pgn)
+
+        return games, next_cursor
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'archived': self.archived}
+
+
+def segment_name(number: int) -> str:
+    return f'{number:08d}-{StateConfig.WORKER_ID}{SEGMENT_SUFFIX}'
+
+
+def segment_number(name: str) -> int:
+    return int(name.split('-')[0])
+
+
+def segment_worker(name: str) -> str:
+    return name[:-len(SEGMENT_SUFFIX)].split('-', 1)[1]
+
+
+def read_batches(path: str, offset: int) -> Iterator[Tuple[int, str]]:
+    """
+    (byte offset after the batch, its text) of each batch of a segment from `offset` on, one gzip member each
+    Stops before an incomplete batch: being appended by its worker, or torn by a crash; raises zlib.error if damaged
+    """
+    with open(path, 'rb') as segment:
+        segment.seek(offset)
+
+        while True:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            text, read = [], 0
+            while not decompressor.eof:
+                chunk = segment.read(READ_BYTES)
+                if not chunk:
+                    return
+
+                read += len(chunk)
+                text.append(decompressor.decompress(chunk))
+
+            offset += read - len(decompressor.unused_data)
+            segment.seek(offset)
+            yield offset, b''.join(text).decode()
+
+
+def make_cursor(positions: Dict[str, Position]) -> str:
+    """Where an export resumes, in the segments of every worker: <segment>:<offset>:<games>,..."""
+    return ','.join(f'{segment}:{offset}:{skip}' for segment, offset, skip in positions.values())
+
+
+def parse_cursor(cursor: str) -> Dict[str, Position]:
+    """
+    Worker -> position, the workers left out start with their first segment, ValueError if malformed
+    A bare segment name starts the games of its worker at that segment
+    """
+    positions = {}
+    for item in cursor.split(','):
+        segment, offset, skip = item.split(':') if ':' in item else (item, '0', '0')
+        if not segment.endswith(SEGMENT_SUFFIX) or '-' not in segment or not (offset.isdigit() and skip.isdigit()):
+            raise ValueError(f'Bad archive cursor: {cursor!r}')
+
+        positions[segment_worker(segment)] = (segment, int(offset), int(skip))
+
+    return positions
+
+
+def _split_games(lines: Iterator[str]) -> Iterator[str]:
+    # Games are separated by the blank line before the headers of the next one
+    game = io.StringIO()
+    in_moves = False
+
+    for line in lines:
+        if line.startswith('[') and in_moves:
+            yield game.getvalue()
+            game = io.StringIO()
+            in_moves = False
+        elif line.strip() and not line.startswith('['):
+            in_moves = True
+
+        game.write(line)
+
+    if game.tell():
+        yield game.getvalue()
+
+
+def utc_date() -> str:
+    return datetime.now(timezone.utc).strftime('%Y.%m.%d')
+
+
+archive = GameArchive(ArchiveConfig.DIRECTORY)
+atexit.register(archive.close)
@@ -0,0 +1,139 @@
+"""
+Base of the queues written behind by a background loop: rating changes, the game journal, the game archive
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+import time
+from typing import Any
+
+from eventlet import tpool
+
+from share import running
+
+
+class BatchWriter(ABC):
+    """
+    Items are queued in memory and written in batches, one batch at a time
+    - Subclasses keep the queue: has_pending(), take() a batch, write() it, settle() it once written or failed
+    - The write runs in a native thread, the event loop never waits on the disk or the database,
+      flush(blocking=True) writes inline instead, for shutdown and for callers that need it done
+    - A batch that failed goes back to the queue in settle() and is retried with the next flush
+    - close() also writes the batch of a flush that shutdown cut short, the greenlet waiting on it never resumes
+    """
+
+    ITEMS = 'items'          # What is queued, for the logs
+    FLUSH_INTERVAL = 1.0     # Seconds between two flushes of the background loop
+    SHUTDOWN_RETRIES = 1     # Attempts to write what is left at shutdown
+    SHUTDOWN_BACKOFF = 0.5   # Seconds between them
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.flushing = False
+
+        # The batch being written, and whether it was, None until written or failed
+        self.batch: Any = None
+        self.batch_ok = None
+        self.write_lock = threading.Lock()  # A native lock, held by whoever writes the batch
+        self.flush_started = 0.0
+
+        # Metrics
+        self.flushes = 0
+        self.failures = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    # Implemented by the queues
+
+    @abstractmethod
+    def has_pending(self) -> bool:
+        ...
+
+    @abstractmethod
+    def pending_count(self) -> int:
+        ...
+
+    @abstractmethod
+    def take(self) -> Any:
+        """Empty the queue into a batch"""
+
+    @abstractmethod
+    def write(self, batch: Any) -> bool:
+        """Runs in a native thread, True once the batch is written, False or an exception if it failed"""
+
+    @abstractmethod
+    def settle(self, batch: Any, ok: bool) -> None:
+        """Back on the event loop after the write, a failed batch goes back to the queue"""
+
+    # Writing
+
+    def flush(self, blocking: bool = False) -> bool:
+        if self.flushing or not self.has_pending():
+            return True
+
+        self.flushing = True
+        self.batch, self.batch_ok = self.take(), None
+        self.flush_started = time.monotonic()
+
+        ok = self.write_batch() if blocking else tpool.execute(self.write_batch)
+        self.finish(ok)
+
+        return ok
+
+    def write_batch(self) -> bool:
+        """Writes the batch once, whoever gets to it first, its flush or close()"""
+        with self.write_lock:
+            if self.batch_ok is None:
+                try:
+                    self.batch_ok = bool(self.write(self.batch))
+                except Exception:
+                    self.logger.exception('Failed to write %s %s', len(self.batch), self.ITEMS)
+                    self.batch_ok = False
+
+            return self.batch_ok
+
+    def finish(self, ok: bool) -> None:
+        if not self.flushing:
+            return
+
+        elapsed = time.monotonic() - self.flush_started
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+        if ok:
+            self.flushes += 1
+        else:
+            self.failures += 1
+
+        batch, self.batch = self.batch, None
+        self.settle(batch, ok)
+        self.flushing = False
+
+    def run(self) -> None:
+        while True:
+            running.socketio.sleep(self.FLUSH_INTERVAL)
+            self.flush()
+
+    def close(self) -> None:
+        """Write everything still queued, called at shutdown"""
+        if self.flushing:
+            # Waits for the native thread of the flush in progress, or writes its batch if it never started
+            self.finish(self.write_batch())
+
+        for attempt in range(self.SHUTDOWN_RETRIES):
+            if attempt:
+                time.sleep(self.SHUTDOWN_BACKOFF)
+
+            if self.flush(blocking=True) and not self.has_pending():
+                return
+
+        self.logger.error('Lost %s %s at shutdown', self.pending_count(), self.ITEMS)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.pending_count(),
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+        }
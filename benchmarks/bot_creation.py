@@ -0,0 +1,63 @@
+"""
+Bot creation latency: the old path through join and Mongo against the in-memory roster.
+
+The old path loaded the never-existing bot pid, upserted a new document, then
+upserted its rating again. Runs against the database configured in dbc.DBConfig,
+or an in-process stand-in with --mongomock. Run from the repository root:
+
+    python -m benchmarks.bot_creation [--mongomock] [--count 1000]
+"""
+import argparse
+import statistics
+import time
+
+import dbc
+from bot_profiles import create_bot, release_bot
+
+
+def legacy_create_bot(index: int) -> None:
+    bot_pid = f'bot_bench_{index}'
+
+    if dbc.load(bot_pid) is None:
+        dbc.upsert({'pid': bot_pid, 'elo': 1500, 'name': 'Chess Master'})
+
+    dbc.upsert({'pid': bot_pid, 'elo': 1520})
+
+
+def roster_create_bot(_: int) -> None:
+    release_bot(create_bot(1520))
+
+
+def measure(create, count: int) -> list:
+    timings = []
+    for index in range(count):
+        start = time.perf_counter()
+        create(index)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mongomock', action='store_true', help='use an in-process Mongo stand-in')
+    parser.add_argument('--count', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        dbc.connect(mongomock.MongoClient())
+    else:
+        dbc.connect()
+
+    for label, create in (('join + Mongo', legacy_create_bot), ('roster', roster_create_bot)):
+        timings = measure(create, args.count)
+        print(f'{label:>14}: median {statistics.median(timings) * 1e6:9.1f}us, '
+              f'max {max(timings) * 1e6:9.1f}us')
+
+    for index in range(args.count):
+        dbc.delete_user(f'bot_bench_{index}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Game journal benchmarks: the cost of journaling a move, the batched write throughput, and the
+time to restore the games in progress after a restart, with the transport stubbed out.
+
+    python -m benchmarks.journal [--games 10000] [--plies 40] [--json result.json]
+
+Reported:
+- move_record_ns: queuing one move record, what a move pays on the request path
+- move_ns_journal_off/on: a whole Game.on_move, without and with the journal open
+- flush: records per second and seconds per batch, write and fsync included
+- replay/restore: reading a journal of --games games of --plies plies each, then rebuilding the games
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import chess
+
+from archive import archive
+from benchmarks.micro import best_ns, git_commit, new_game, reset  # Stubs the transport on import
+from game import Game
+from journal import Journal, JournalConfig, journal
+from share import running
+
+
+def random_moves(plies: int) -> list:
+    """Random legal moves, up to `plies` of them, that neither end the game nor repeat a position three times"""
+    board = chess.Board()
+    moves = []
+    while len(moves) < plies and not board.is_game_over(claim_draw=True):
+        move = random.choice(list(board.legal_moves))
+        board.push(move)
+        moves.append(move.uci())
+
+    return moves if not board.is_game_over(claim_draw=True) else moves[:-1]
+
+
+def bench_move_record() -> float:
+    clocks = [287.5, 291.25]
+    result = best_ns(lambda: journal.moved('0123456789abcdef', 'e2e4', clocks), number=100_000)
+    journal.pending.clear()
+    return result
+
+
+def bench_move(journal_open: bool, games: int = 50, plies: int = 40) -> float:
+    """A whole Game.on_move, over fresh games playing random moves, so every call is a legal move of a live game"""
+    openings = [random_moves(plies) for _ in range(games)]
+
+    def play() -> float:
+        seconds, count = 0.0, 0
+        for moves in openings:
+            game = new_game([])
+            start = time.perf_counter()
+            for move in moves:
+                game.on_move({'move': move}, game.players[game.current_player_index])
+            seconds += time.perf_counter() - start
+            count += len(moves)
+
+        reset()
+        return seconds / count * 1e9
+
+    file = journal.file
+    if not journal_open:
+        journal.file = None
+
+    try:
+        return min(play() for _ in range(5))
+    finally:
+        journal.file = file
+        journal.pending.clear()
+
+
+def bench_flush(records: int, batches: int) -> dict:
+    seconds = []
+    for _ in range(batches):
+        for _ in range(records):
+            journal.moved('0123456789abcdef', 'e2e4', [287.5, 291.25])
+
+        start = time.perf_counter()
+        journal.flush(blocking=True)
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        'batch_records': records,
+        'batch_seconds_median': sorted(seconds)[len(seconds) // 2],
+        'records_per_second': records * batches / sum(seconds),
+    }
+
+
+def bench_recovery(directory: str, games: int, plies: int) -> dict:
+    path = os.path.join(directory, 'recovery.journal')
+    openings = [random_moves(plies) for _ in range(100)]
+
+    with open(path, 'w') as file:
+        for index in range(games):
+            game_id = f'{index:016x}'
+            file.write(json.dumps(['S', game_id, f'white_{index}', f'black_{index}', 300, 2]) + '\n')
+            for ply, move in enumerate(openings[index % len(openings)]):
+                file.write(json.dumps(['M', game_id, move, 300_000 - ply * 1000, 300_000 - ply * 1000]) + '\n')
+
+    recovery = Journal(path)
+
+    start = time.perf_counter()
+    records = recovery.replay()
+    replay_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for record in records.values():
+        running.add_game(Game.restore(record))
+    restore_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    recovery.compact([game.record() for game in running.games])
+    compact_seconds = time.perf_counter() - start
+
+    return {
+        'games': len(records),
+        'journal_bytes': os.path.getsize(path),
+        'replay_seconds': replay_seconds,
+        'restore_seconds': restore_seconds,
+        'compact_seconds': compact_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=10_000, help='games in progress to recover')
+    parser.add_argument('--plies', type=int, default=40, help='plies played in each of them')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    random.seed('journal')
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal.path = os.path.join(directory, 'games.journal')
+        journal.open()
+        archive.directory = os.path.join(directory, 'archive')  # Games that end here never reach ./data
+
+        results = {
+            'move_record_ns': bench_move_record(),
+            'move_ns_journal_off': bench_move(journal_open=False),
+            'move_ns_journal_on': bench_move(journal_open=True),
+            'flush': bench_flush(records=500, batches=20),
+            'fsync': JournalConfig.FSYNC,
+        }
+        reset()
+
+        results['recovery'] = bench_recovery(directory, args.games, args.plies)
+        reset()
+
+        journal.close()
+        archive.close()
+
+    for name, value in results.items():
+        print(f'{name:>20}: {value}')
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'commit': git_commit(), 'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+The game server for local load tests, with mongomock standing in for MongoDB.
+
+Started by benchmarks.load_test --spawn-server, or by hand from the repository root:
+
+    python -m benchmarks.load_server [--port 8888]
+
+The Stockfish pool is only pre-spawned if the engine binary exists, bot games
+stall without it, which the load test clients resign out of.
+"""
+import argparse
+import os
+
+import mongomock
+
+import dbc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    args = parser.parse_args()
+
+    dbc.connect(mongomock.MongoClient())
+
+    import app  # Imported after the stand-in is connected, like the other benchmarks
+
+    if os.path.exists(app.stockfish_pool.path):
+        app.stockfish_pool.start()
+
+    app.serve(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+"""
+Load test: many simulated players against one server, or against several workers sharing Redis.
+
+Each simulated player connects with the python-socketio client, joins with a random pid,
+matches on one of the GameConfig.TIME_CONTROLS and plays random legal moves after a random
+think time. Some resign, offer draws or drop the connection and come back as a new session.
+The clients are eventlet green threads of this process, so thousands fit in it.
+
+With --spawn-server a local server is started with mongomock standing in for MongoDB
+(benchmarks.load_server), its CPU and RSS are sampled from /proc. Run from the repository root:
+
+    python -m benchmarks.load_test --spawn-server --clients 1000 --duration 60 [--json result.json]
+    python -m benchmarks.load_test --url http://127.0.0.1:8888 --server-pid 1234
+
+With --workers N, N servers are started on consecutive ports, sharing the Redis at --redis-url
+like workers behind sticky sessions, and each client sticks to one of them. --clients is per worker,
+so several counts measure the scaling, each run with fresh servers:
+
+    python -m benchmarks.load_test --spawn-server --redis-url redis://127.0.0.1:6379 --workers 1 2 4
+
+Spawned servers journal and archive nothing. The clients share one process: when its CPU
+nears 100% the load generator, not the server, is the limit. The scaling only shows with a core
+for each worker, one for Redis and one for the load generator, on a single core the runs share it.
+
+Reported:
+- matches and moves per second
+- move round trip p50/p99: a move sent until the server's `ply` comes back (`timer` for legacy clients)
+- clock jitter: spacing of the periodic `clock` resyncs against ClockConfig.RESYNC_INTERVAL
+- server CPU and peak RSS, and the CPU of the load generator itself, which shares the machine
+- with several worker counts, moves per second of each against linear scaling of the first
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402  (after monkey patching)
+import json  # noqa: E402
+import os  # noqa: E402
+import random  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+
+import chess  # noqa: E402
+import socketio  # noqa: E402
+
+from app import GameConfig  # noqa: E402
+from clock import ClockConfig  # noqa: E402
+
+
+class Stats:
+    def __init__(self):
+        self.matches = 0
+        self.games_finished = 0
+        self.moves = 0
+        self.resigns = 0
+        self.draw_offers = 0
+        self.disconnects = 0
+        self.connect_errors = 0
+        self.stalled = 0
+        self.connect_times = []
+        self.round_trips = []
+        self.clock_jitter = []
+
+
+class SimulatedPlayer:
+    def __init__(self, index: int, url: str, args, stats: Stats, stop: eventlet.event.Event):
+        self.index = index
+        self.url = url
+        self.args = args
+        self.stats = stats
+        self.stop = stop
+
+        self.legacy = random.random() < args.legacy
+        self.sio = None
+        self.board = chess.Board()
+        self.side = None
+        self.ply = 0
+        self.sent_at = None
+        self.last_event = time.monotonic()
+        self.last_clock = None
+
+    def run(self) -> None:
+        eventlet.sleep(random.uniform(0, self.args.ramp))
+
+        while not self.stop.ready():
+            if not self.session():
+                eventlet.sleep(1)
+
+            eventlet.sleep(random.uniform(0.5, 2.0))
+
+    def session(self) -> bool:
+        """One connection, until the player drops it or the test ends"""
+        self.sio = socketio.Client(reconnection=False)
+        self.register(self.sio)
+
+        start = time.monotonic()
+        try:
+            # A loaded server can take a while to accept, that is measured rather than failed
+            self.sio.connect(self.url, transports=['websocket'], wait_timeout=self.args.connect_timeout)
+            self.stats.connect_times.append(time.monotonic() - start)
+        except socketio.exceptions.ConnectionError:
+            self.stats.connect_errors += 1
+            return False
+
+        self.side = None
+        self.sio.emit('join', {
+            'pid': f'load_{uuid.uuid4().hex[:12]}', 'name': f'Load {self.index}',
+            'protocol': 1 if self.legacy else 2, 'time_control': self.time_control(),
+        })
+
+        while self.sio.connected and not self.stop.ready():
+            eventlet.sleep(1)
+
+            if self.side is not None and time.monotonic() - self.last_event > self.args.stall:
+                # A bot game without an engine, or a lost opponent
+                self.stats.stalled += 1
+                self.side = None
+                self.sio.emit('resign', {})
+
+        if self.sio.connected:
+            self.sio.disconnect()
+
+        return True
+
+    @staticmethod
+    def time_control() -> int:
+        return random.randrange(len(GameConfig.TIME_CONTROLS))
+
+    def register(self, sio: socketio.Client) -> None:
+        sio.on('game_mode', self.on_game_mode)
+        sio.on('sync', self.on_sync)
+        sio.on('ply', self.on_ply)
+        sio.on('clock', self.on_clock)
+        sio.on('move', self.on_legacy_move)
+        sio.on('go', self.on_go)
+        sio.on('timer', self.on_timer)
+        sio.on('draw_request', self.on_draw_request)
+        sio.on('takeback_request', self.on_takeback_request)
+        sio.on('game_over', self.on_game_over)
+        sio.on('*', self.on_other)
+
+    def touch(self) -> None:
+        self.last_event = time.monotonic()
+
+    def on_game_mode(self, data: dict) -> None:
+        self.touch()
+        self.stats.matches += 1
+        self.side = chess.WHITE if data['side'] == 'white' else chess.BLACK
+        self.board = chess.Board()
+        self.ply = 0
+        self.sent_at = None
+        self.last_clock = None
+
+    def on_sync(self, data: dict) -> None:
+        self.touch()
+        self.board = chess.Board(data['fen'])
+        self.ply = data['n']
+        self.sent_at = None
+        self.maybe_play(data['t'])
+
+    def on_ply(self, data: dict) -> None:
+        self.touch()
+        if data['n'] != self.ply + 1:
+            self.sio.emit('sync', {})
+            return
+
+        self.board.push_uci(data['u'])
+        self.ply = data['n']
+
+        if self.sent_at is not None:
+            self.stats.round_trips.append(time.monotonic() - self.sent_at)
+            self.sent_at = None
+
+        self.maybe_play(data['t'])
+
+    def on_clock(self, _: dict) -> None:
+        now = time.monotonic()
+        if self.last_clock is not None:
+            self.stats.clock_jitter.append(now - self.last_clock - ClockConfig.RESYNC_INTERVAL)
+
+        self.last_clock = now
+
+    def on_legacy_move(self, data: dict) -> None:
+        self.touch()
+        self.board.push_uci(data['move'])
+        self.ply += 1
+
+    def on_go(self, _: dict) -> None:
+        self.touch()
+        self.schedule_move()
+
+    def on_timer(self, _: dict) -> None:
+        if self.sent_at is not None:
+            self.stats.round_trips.append(time.monotonic() - self.sent_at)
+            self.sent_at = None
+
+    def on_draw_request(self, _: dict) -> None:
+        self.sio.emit('draw_response', {'accepted': random.random() < 0.3})
+
+    def on_takeback_request(self, _: dict) -> None:
+        self.sio.emit('takeback_response', {'accepted': False})
+
+    def on_game_over(self, _: dict) -> None:
+        self.stats.games_finished += 1
+        self.side = None
+        eventlet.spawn_after(random.uniform(0.5, 2.0), self.rematch)
+
+    def on_other(self, *_) -> None:
+        pass
+
+    def rematch(self) -> None:
+        if self.sio.connected and self.side is None and not self.stop.ready():
+            self.sio.emit('match', {'time_control': self.time_control()})
+
+    def maybe_play(self, turn: str) -> None:
+        if self.side is not None and turn == ('w' if self.side == chess.WHITE else 'b'):
+            self.schedule_move()
+
+    def schedule_move(self) -> None:
+        eventlet.spawn_after(random.uniform(*self.args.think), self.play, self.ply)
+
+    def play(self, ply: int) -> None:
+        # The game moved on, ended or was taken back while thinking
+        if self.side is None or ply != self.ply or not self.sio.connected or self.board.is_game_over():
+            return
+
+        roll = random.random()
+        if roll < self.args.resign:
+            self.stats.resigns += 1
+            self.side = None
+            self.sio.emit('resign', {})
+            return
+
+        roll -= self.args.resign
+        if roll < self.args.disconnect:
+            self.stats.disconnects += 1
+            self.sio.disconnect()
+            return
+
+        roll -= self.args.disconnect
+        if roll < self.args.draw:
+            self.stats.draw_offers += 1
+            self.sio.emit('propose_draw', {})
+
+        move = random.choice(list(self.board.legal_moves)).uci()
+        data = {'move': move} if self.legacy else {'move': move, 'n': self.ply + 1}
+
+        if self.legacy:
+            # Legacy clients are not echoed their own move
+            self.board.push_uci(move)
+            self.ply += 1
+
+        self.stats.moves += 1
+        self.sent_at = time.monotonic()
+        self.sio.emit('move', data)
+
+
+class ProcessSampler:
+    """CPU and RSS of a process, from /proc, so Linux only"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.peak_rss = 0
+        self.start_cpu = self.cpu_seconds()
+        self.start = time.monotonic()
+
+    def cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+
+        return (int(fields[11]) + int(fields[12])) / self.ticks  # utime + stime
+
+    def rss_bytes(self) -> int:
+        with open(f'/proc/{self.pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+
+        return 0
+
+    def sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, self.rss_bytes())
+
+    def cpu_percent(self) -> float:
+        return 100 * (self.cpu_seconds() - self.start_cpu) / (time.monotonic() - self.start)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return float('nan')
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            eventlet.sleep(0.2)
+
+    raise RuntimeError(f'Server did not start on port {port}')
+
+
+def spawn_servers(ports: list, redis_url: str = None) -> list:
+    """One server per port, workers sharing the Redis at `redis_url` if there is one"""
+    servers = []
+    for index, port in enumerate(ports):
+        # Nothing written to ./data, a journal left behind would be resumed by the next run
+        env = dict(os.environ, ICHESS_JOURNAL='', ICHESS_ARCHIVE_DIR='')
+        if redis_url:
+            env.update(ICHESS_REDIS_URL=redis_url, ICHESS_WORKER_ID=f'load{index}')
+
+        servers.append(subprocess.Popen([sys.executable, '-m', 'benchmarks.load_server', '--port', str(port)],
+                                        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    for port in ports:
+        wait_for_port(port)
+
+    return servers
+
+
+def run(args, urls: list, server_pids: list) -> dict:
+    """--clients per server for --ramp plus --duration seconds, measured after the ramp-up"""
+    stats = Stats()
+    stop = eventlet.event.Event()
+    players = [eventlet.spawn(SimulatedPlayer(index, urls[index % len(urls)], args, stats, stop).run)
+               for index in range(args.clients * len(urls))]
+
+    eventlet.sleep(args.ramp)
+    matches, moves, finished, started = stats.matches, stats.moves, stats.games_finished, time.monotonic()
+    stats.connect_times.clear()
+    stats.round_trips.clear()
+    stats.clock_jitter.clear()
+    client_cpu = sum(os.times()[:2])
+
+    samplers = [ProcessSampler(pid) for pid in server_pids]
+
+    while time.monotonic() - started < args.duration:
+        eventlet.sleep(1)
+        for sampler in samplers:
+            sampler.sample()
+
+    elapsed = time.monotonic() - started
+    result = {
+        'workers': len(urls),
+        'clients': len(players),
+        'seconds': round(elapsed, 1),
+        'matches_per_second': (stats.matches - matches) / 2 / elapsed,
+        'moves_per_second': (stats.moves - moves) / elapsed,
+        'games_finished': (stats.games_finished - finished) // 2,  # Both players hear game_over
+        'resigns': stats.resigns,
+        'draw_offers': stats.draw_offers,
+        'disconnects': stats.disconnects,
+        'connect_errors': stats.connect_errors,
+        'stalled_games': stats.stalled,
+        'connect_p99_ms': percentile(stats.connect_times, 0.99) * 1000,
+        'move_rtt_p50_ms': percentile(stats.round_trips, 0.5) * 1000,
+        'move_rtt_p99_ms': percentile(stats.round_trips, 0.99) * 1000,
+        'clock_jitter_p50_ms': percentile([abs(j) for j in stats.clock_jitter], 0.5) * 1000,
+        'clock_jitter_p99_ms': percentile([abs(j) for j in stats.clock_jitter], 0.99) * 1000,
+        'server_cpu_percent': sum(sampler.cpu_percent() for sampler in samplers) if samplers else None,
+        'server_peak_rss_mb': sum(sampler.peak_rss for sampler in samplers) / 2 ** 20 if samplers else None,
+        'client_cpu_percent': 100 * (sum(os.times()[:2]) - client_cpu) / elapsed,
+    }
+
+    stop.send()
+    for player in players:
+        player.wait()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', action='append', default=None,
+                        help='server to test, repeat it for several workers, default local ones from --port')
+    parser.add_argument('--port', type=int, default=8888, help='port of the first spawned server')
+    parser.add_argument('--spawn-server', action='store_true', help='start benchmarks.load_server on --port')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='servers to spawn, several counts measure the scaling')
+    parser.add_argument('--redis-url', default=None, help='Redis shared by the spawned servers')
+    parser.add_argument('--server-pid', type=int, action='append', default=[],
+                        help='sample CPU/RSS of this local process, repeat it for several')
+    parser.add_argument('--clients', type=int, default=200, help='per server')
+    parser.add_argument('--duration', type=float, default=60, help='seconds, after the ramp-up')
+    parser.add_argument('--ramp', type=float, default=10, help='seconds to connect every client')
+    parser.add_argument('--think', type=float, nargs=2, default=(0.5, 3.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--resign', type=float, default=0.01, help='chance per move')
+    parser.add_argument('--draw', type=float, default=0.01, help='chance per move')
+    parser.add_argument('--disconnect', type=float, default=0.005, help='chance per move')
+    parser.add_argument('--legacy', type=float, default=0.2, help='share of protocol v1 clients')
+    parser.add_argument('--connect-timeout', type=float, default=10, help='seconds')
+    parser.add_argument('--stall', type=float, default=30, help='resign after this long without a game event')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.spawn_server and max(args.workers) > 1 and not args.redis_url:
+        parser.error('several workers share their state through --redis-url')
+
+    results = []
+    if not args.spawn_server:
+        urls = args.url or [f'http://127.0.0.1:{args.port + index}' for index in range(args.workers[0])]
+        results.append(run(args, urls, args.server_pid))
+
+    for workers in args.workers if args.spawn_server else []:
+        ports = [args.port + index for index in range(workers)]
+        servers = spawn_servers(ports, args.redis_url)
+        try:
+            urls = [f'http://127.0.0.1:{port}' for port in ports]
+            results.append(run(args, urls, [server.pid for server in servers]))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    for result in results:
+        for key, value in result.items():
+            print(f'{key:>22}: {value:.2f}' if isinstance(value, float) else f'{key:>22}: {value}')
+        print()
+
+    if len(results) > 1:
+        # Against the first run's throughput per worker, multiplied by the worker count
+        per_worker = results[0]['moves_per_second'] / results[0]['workers']
+        for result in results:
+            linear = per_worker * result['workers']
+            print(f"{result['workers']:>3} workers: {result['moves_per_second']:10.1f} moves/s, "
+                  f"{100 * result['moves_per_second'] / linear:5.1f}% of linear")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results[0] if len(results) == 1 else results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Microbenchmarks of the server's hot functions, with the transport and the database stubbed out.
+
+Each benchmark reports the best of several repeats, in nanoseconds per call. Results can be
+written as JSON and compared against an earlier run, e.g. of the parent commit:
+
+    python -m benchmarks.micro [--json after.json] [--compare before.json] [--filter matching]
+
+Covered: Game.verify_move, Game.check_game_end, app.find_game, process_matching_queue at
+100/1k/10k waiting players, one clock sweep and one clock resync at 1k/10k games, and calc_elo.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+import timeit
+
+from share import running
+
+
+class NullServer:
+    def enter_room(self, *args, **kwargs):
+        pass
+
+    def close_room(self, *args, **kwargs):
+        pass
+
+
+class NullSocketIO:
+    """Accepts every send and drops it, background tasks are not run"""
+
+    def __init__(self):
+        self.server = NullServer()
+
+    def emit(self, *args, **kwargs):
+        pass
+
+    def send(self, *args, **kwargs):
+        pass
+
+    def start_background_task(self, *args, **kwargs):
+        pass
+
+    def sleep(self, *args):
+        pass
+
+
+import app  # noqa: E402  (creates the real Socket.IO server, replaced below)
+from game import Game  # noqa: E402
+from player import calc_elo, join, level_of  # noqa: E402
+from protocol import register_client  # noqa: E402
+
+running.socketio = NullSocketIO()
+
+# A middlegame after 1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7
+OPENING = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5a4', 'g8f6', 'e1g1', 'f8e7']
+
+_players = iter(range(10 ** 9))
+
+
+def new_player(elo: int = 1500) -> str:
+    """A logged-in compact client, its profile cached so no database is needed"""
+    index = next(_players)
+    sid, pid = f'sid_{index}', f'pid_{index}'
+
+    join(sid, pid, pid, profile={'pid': pid, 'name': pid, 'elo': elo})
+    register_client(sid, {'protocol': 2})
+    running.online_players.add(sid)
+
+    return sid
+
+
+def new_game(moves=OPENING) -> Game:
+    game = Game([new_player(), new_player()], 300, 2)
+    for move in moves:
+        game.board.push_uci(move)
+
+    running.add_game(game)
+    return game
+
+
+def reset() -> None:
+    for game in list(running.games):
+        running.remove_game(game)
+
+    running.waiting_players.clear()
+    app.matchmaker.deadlines.clear()
+    app.state.buckets.clear()
+    app.state.waiting = 0
+    app.clock_service.deadlines.clear()
+    app.clock_service.live.clear()
+
+
+def best_ns(function, number: int, repeat: int = 5) -> float:
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e9
+
+
+def best_ns_with_setup(setup, function, repeat: int = 5) -> float:
+    """For calls that consume their input: a fresh setup before every timed call"""
+    timings = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+        reset()
+
+    return min(timings) * 1e9
+
+
+def bench_verify_move() -> float:
+    game = new_game()
+    moves = ['c2c3', 'd2d4', 'f1e1', 'h2h3', 'e4e5', 'a2a8']  # The last one is illegal
+    return best_ns(lambda: [game.verify_move(move) for move in moves], number=2000) / len(moves)
+
+
+def bench_check_game_end() -> float:
+    game = new_game()
+    return best_ns(game.check_game_end, number=5000)
+
+
+def bench_find_game(count: int):
+    def run():
+        sids = [sid for game in [new_game([]) for _ in range(count)] for sid in game.players]
+        lookups = [random.choice(sids) for _ in range(1000)]
+        return best_ns(lambda: [app.find_game(sid) for sid in lookups], number=20) / len(lookups)
+
+    return run
+
+
+def bench_matching(count: int):
+    def setup():
+        # Everyone waited 5.5s, so every deadline is due and the windows have widened once
+        now = time.time()
+        for _ in range(count):
+            elo = random.randint(1100, 3000)
+            sid = new_player(elo)
+            entry = {'join_time': now - 5.5, 'time_control': random.randrange(4), 'level': level_of(elo)}
+
+            running.waiting_players[sid] = entry
+            app.state.add_waiting(sid, entry)
+            app.matchmaker.schedule(sid, entry, entry['join_time'])
+
+    return lambda: best_ns_with_setup(setup, lambda _: app.process_matching_queue(), repeat=3)
+
+
+def bench_clock_sweep(count: int):
+    def setup():
+        games = [new_game([]) for _ in range(count)]
+
+        # 1% of the games run out of time now
+        for game in random.sample(games, max(1, count // 100)):
+            game.player_times[0] = -1
+            app.clock_service.schedule(game)
+
+        return time.time()
+
+    return lambda: best_ns_with_setup(setup, app.clock_service.process_due, repeat=3)
+
+
+def bench_clock_resync(count: int):
+    def setup():
+        for _ in range(count):
+            new_game([])
+
+    return lambda: best_ns_with_setup(setup, lambda _: app.clock_service.resync(), repeat=3)
+
+
+def bench_calc_elo() -> float:
+    return best_ns(lambda: calc_elo(1500, 1620, 1), number=100_000)
+
+
+BENCHMARKS = {
+    'verify_move': bench_verify_move,
+    'check_game_end': bench_check_game_end,
+    'find_game_1k': bench_find_game(1_000),
+    'find_game_10k': bench_find_game(10_000),
+    'matching_tick_100': bench_matching(100),
+    'matching_tick_1k': bench_matching(1_000),
+    'matching_tick_10k': bench_matching(10_000),
+    'clock_sweep_1k': bench_clock_sweep(1_000),
+    'clock_sweep_10k': bench_clock_sweep(10_000),
+    'clock_resync_1k': bench_clock_resync(1_000),
+    'clock_resync_10k': bench_clock_resync(10_000),
+    'calc_elo': bench_calc_elo,
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--compare', default=None, help='results of an earlier run to compare against')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)['results']
+
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+
+        random.seed(name)
+        results[name] = bench()
+        reset()
+
+        line = f'{name:>20}: {results[name]:>14,.0f} ns'
+        if name in baseline:
+            line += f'   {results[name] / baseline[name]:5.2f}x of {baseline[name]:,.0f} ns'
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'unit': 'ns per call',
+                'results': results,
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
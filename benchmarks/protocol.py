@@ -0,0 +1,112 @@
+"""
+Bytes and emits per ply of the game wire protocols.
+
+Plays the same moves through the real handlers with Socket.IO test clients and
+counts the server-side emits and the frames delivered to both players. The
+"before" row rebuilds the per-ply events of the old server (move, ASCII board
+to both players, two timers, go). Needs mongomock. Run from the repository root:
+
+    python -m benchmarks.protocol
+"""
+import chess
+import mongomock
+from socketio import packet
+
+import dbc
+
+dbc.connect(mongomock.MongoClient())
+
+import app  # noqa: E402  (needs the database stand-in first)
+from game import SessionConfig  # noqa: E402
+from ratelimit import RateLimitConfig  # noqa: E402
+
+# Every ply is counted, and a run's players leave their game for good before the next run starts
+RateLimitConfig.ENABLED = False
+SessionConfig.RECONNECT_GRACE = 0
+
+MOVES = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5a4', 'g8f6', 'e1g1', 'f8e7',
+         'f1e1', 'b7b5', 'a4b3', 'd7d6', 'c2c3', 'e8g8', 'h2h3', 'c6b8', 'd2d4', 'b8d7']
+
+
+class Counter:
+    def __init__(self, server):
+        self.emits = 0
+        self.frames = 0
+        self.bytes = 0
+
+        emit, send_eio_packet = server.emit, server._send_eio_packet
+
+        def counting_emit(*args, **kwargs):
+            self.emits += 1
+            return emit(*args, **kwargs)
+
+        def counting_send_eio_packet(eio_sid, eio_pkt):
+            self.frames += 1
+            self.bytes += len(eio_pkt.encode())
+            return send_eio_packet(eio_sid, eio_pkt)
+
+        server.emit, server._send_eio_packet = counting_emit, counting_send_eio_packet
+        self.restore = lambda: setattr(server, 'emit', emit) or setattr(server, '_send_eio_packet', send_eio_packet)
+
+
+def old_protocol() -> tuple:
+    """Frames the server used to send per ply, encoded the same way"""
+    board = chess.Board()
+    emits = frames = size = 0
+
+    for move in MOVES:
+        board.push_uci(move)
+        events = [
+            ('move', {'move': move}, 1),
+            ('message', f'\n{str(board)}', 2),
+            ('timer', {'mine': 299, 'opponent': 301}, 1),
+            ('timer', {'mine': 301, 'opponent': 299}, 1),
+            ('go', {}, 1),
+        ]
+        for event, data, recipients in events:
+            emits += recipients  # one emit per recipient
+            frames += recipients
+            size += recipients * (1 + len(packet.Packet(packet.EVENT, data=[event, data]).encode()))
+
+    return emits, frames, size
+
+
+def play(run: int, options: dict) -> tuple:
+    clients = []
+    for index in range(2):
+        client = app.socketio.test_client(app.app)
+        client.emit('join', {'pid': f'bench_{run}_{index}', 'name': f'Bench {index}', **options})
+        clients.append(client)
+
+    sides = {}
+    for client in clients:
+        for received in client.get_received():
+            if received['name'] == 'game_mode':
+                sides[received['args'][0]['side']] = client
+
+    counter = Counter(app.socketio.server)
+    for ply, move in enumerate(MOVES, 1):
+        sides['white' if ply % 2 else 'black'].emit('move', {'move': move, 'n': ply})
+    counter.restore()
+
+    for client in clients:
+        client.disconnect()
+
+    # The counted emits include nothing but the server's answers to the moves
+    return counter.emits, counter.frames, counter.bytes
+
+
+def main():
+    rows = [('before', old_protocol()),
+            ('legacy (v1)', play(1, {})),
+            ('compact (v2)', play(2, {'protocol': 2})),
+            ('compact msgpack', play(3, {'protocol': 2, 'binary': True}))]
+
+    print(f'{"protocol":>16} {"emits/ply":>10} {"frames/ply":>11} {"bytes/ply":>10}')
+    for label, (emits, frames, size) in rows:
+        plies = len(MOVES)
+        print(f'{label:>16} {emits / plies:>10.1f} {frames / plies:>11.1f} {size / plies:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
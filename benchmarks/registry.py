@@ -0,0 +1,80 @@
+"""
+Per-event lookup cost of the session/game registry in share.running.
+
+Compares the old linear scan over running.games against the indexed lookups,
+for 10 up to 50k concurrent games. Run from the repository root:
+
+    python -m benchmarks.registry
+"""
+import timeit
+from random import choice
+
+from share import running
+
+GAME_COUNTS = [10, 100, 1000, 10000, 50000]
+LOOKUPS = 2000
+
+
+class FakeGame:
+    def __init__(self, index: int):
+        self.game_id = f'game_{index}'
+        self.start_ratings = [('white', 1500), ('black', 1500)]
+        self.player1, self.player2 = f'sid_{index}_w', f'sid_{index}_b'
+        self.players = [self.player1, self.player2]
+
+
+def reset():
+    running.games.clear()
+    running.game_of_sid.clear()
+    running.game_of_id.clear()
+    running.games_by_rating.clear()
+    running.online_players.clear()
+
+
+def linear_find_game(games, sid):
+    for game in games:
+        if sid in game.players:
+            return game
+
+    return None
+
+
+def bench(count: int) -> tuple:
+    reset()
+
+    games = [FakeGame(i) for i in range(count)]
+    for game in games:
+        running.add_game(game)
+        running.online_players.update(game.players)
+
+    online_list = list(running.online_players)
+    sids = [choice(choice(games).players) for _ in range(LOOKUPS)]
+
+    def scan():
+        for sid in sids:
+            linear_find_game(games, sid)
+            _ = sid in online_list
+
+    def indexed():
+        for sid in sids:
+            running.find_game(sid)
+            _ = sid in running.online_players
+
+    repeat = 1 if count >= 10000 else 3
+    scan_ns = min(timeit.repeat(scan, number=1, repeat=repeat)) / LOOKUPS * 1e9
+    indexed_ns = min(timeit.repeat(indexed, number=1, repeat=5)) / LOOKUPS * 1e9
+
+    return scan_ns, indexed_ns
+
+
+def main():
+    print(f'{"games":>8} {"scan ns/event":>15} {"registry ns/event":>18}')
+    for count in GAME_COUNTS:
+        scan_ns, indexed_ns = bench(count)
+        print(f'{count:>8} {scan_ns:>15.0f} {indexed_ns:>18.0f}')
+
+    reset()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import itertools
+from random import choice
+from typing import Any, Dict, List
+
+# Fixed bot identities, one per level, Elo calibrated to the skill level they play at (see player.level_of)
+BOT_ROSTER = [
+    ('bot_rookie', 'Rising Star', 1150),
+    ('bot_pawn', 'Chess Proficient', 1250),
+    ('bot_knight', 'Chess Expert', 1350),
+    ('bot_bishop', 'Chess Virtuoso', 1450),
+    ('bot_rook', 'Chess Master', 1550),
+    ('bot_queen', 'Chess Champion', 1650),
+    ('bot_king', 'Chess Grandmaster', 1750),
+    ('bot_fianchetto', 'Chess Phenomenon', 1850),
+    ('bot_gambit', 'Gambit Hunter', 1950),
+    ('bot_endgame', 'Endgame Artist', 2050),
+    ('bot_tactician', 'Tactician', 2150),
+    ('bot_strategist', 'Strategist', 2250),
+    ('bot_blitz', 'Blitz Wizard', 2350),
+    ('bot_positional', 'Positional Sage', 2450),
+    ('bot_attacker', 'Kingside Attacker', 2550),
+    ('bot_defender', 'Iron Defender', 2650),
+    ('bot_prodigy', 'Prodigy', 2750),
+    ('bot_legend', 'Legend', 2850),
+    ('bot_titan', 'Titan', 2950),
+    ('bot_engine', 'Silicon Sage', 3050),
+]
+
+BOT_PROFILES: List[Dict[str, Any]] = [{'pid': pid, 'name': name, 'elo': elo} for pid, name, elo in BOT_ROSTER]
+
+# Live bot sessions, sid -> profile, one sid per game
+sessions: Dict[str, Dict[str, Any]] = {}
+_session_ids = itertools.count(1)
+
+
+def is_bot(sid: str) -> bool:
+    return sid.startswith('bot_')
+
+
+def create_bot(opponent_elo: int, spread: int = 100) -> str:
+    """Seat a roster bot close to the opponent's rating, returns its sid"""
+    candidates = [profile for profile in BOT_PROFILES if abs(profile['elo'] - opponent_elo) <= spread]
+    if not candidates:
+        candidates = [min(BOT_PROFILES, key=lambda profile: abs(profile['elo'] - opponent_elo))]
+
+    return _seat(choice(candidates))
+
+
+def restore_bot(pid: str) -> str:
+    """Seat the roster bot of this pid again, for a game restored after a restart"""
+    profile = next((profile for profile in BOT_PROFILES if profile['pid'] == pid), None)
+    if profile is None:
+        raise ValueError(f'Unknown bot {pid}')
+
+    return _seat(profile)
+
+
+def _seat(profile: Dict[str, Any]) -> str:
+    sid = f"{profile['pid']}_{next(_session_ids)}"
+    sessions[sid] = profile
+
+    return sid
+
+
+def bot_profile_of(sid: str) -> Dict[str, Any]:
+    return sessions.get(sid)
+
+
+def release_bot(sid: str) -> None:
+    sessions.pop(sid, None)
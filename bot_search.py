@@ -0,0 +1,78 @@
+import random
+import time
+from typing import Tuple
+
+import chess
+import chess.engine
+from eventlet import tpool
+
+from metrics import engine_search_seconds
+from move_source import move_source
+from player import level_of, player_of
+from search_budget import budget_for
+from share import get_logger, get_native_engine_path, running
+from stockfish_pool import StockfishPool
+
+logger = get_logger(__name__)
+
+stockfish_pool = StockfishPool(get_native_engine_path(), size=5)  # Shared pool, caps concurrent searches
+
+
+def start_search(game) -> None:
+    """Search the bot's move off the event loop, the result is posted back through Game.on_move"""
+    running.socketio.start_background_task(run_search, game, game.board.copy(), game.position_version)
+
+
+def run_search(game, board: chess.Board, position_version: int) -> None:
+    if game.is_game_over:
+        return
+
+    start = time.monotonic()
+
+    level = level_of(player_of(game.bot_sid)['elo'])
+    remaining = game.player_times[game.players.index(game.bot_sid)]
+    limit, delay = budget_for(level, remaining, game.step_increment_time)
+
+    # Opening book or cached move first, the engine only on a miss
+    move = move_source.lookup(board, level)
+    if move is None:
+        try:
+            # Waits for a free engine here, then the engine call, which blocks, runs in a native thread
+            with stockfish_pool.slot():
+                move, seconds = tpool.execute(search_move, board, level, limit)
+        except Exception:
+            # No free engine, a crashed, hung or missing engine: a weak move beats a bot that never moves
+            logger.exception('Bot search failed, playing a random move, game ID = %s', game.game_id)
+            move = random.choice(list(board.legal_moves))
+        else:
+            engine_search_seconds.observe(seconds)
+            move_source.store(board, level, move, seconds)
+
+    # Human-like thinking time, the engine is already back in the pool
+    delay -= time.monotonic() - start
+    if delay > 0:
+        running.socketio.sleep(delay)
+
+    # The game ended, or a takeback changed the position, while the engine was thinking
+    if game.is_game_over or game.position_version != position_version:
+        logger.info('Discarded a stale bot move, game ID = %s', game.game_id)
+        return
+
+    game.on_move({'move': move.uci()}, game.bot_sid)
+
+
+def search_move(board: chess.Board, level: int, limit: chess.engine.Limit) -> Tuple[chess.Move, float]:
+    engine = stockfish_pool.get_engine(level)
+    failed = False
+
+    try:
+        start = time.monotonic()
+        result = engine.play(board, limit)
+        return result.move, time.monotonic() - start
+    except Exception:
+        # A timed-out engine may still be searching, it is replaced like a crashed one
+        failed = True
+        raise
+    finally:
+        # Return engine after thinking, a crashed one gets replaced
+        stockfish_pool.return_engine(engine, failed=failed)
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from metrics import Gauge, Histogram
+from share import get_logger, running
+
+if TYPE_CHECKING:
+    from game import Game
+
+logger = get_logger(__name__)
+
+
+class ClockConfig:
+    RESYNC_INTERVAL = 10   # Seconds between clock resyncs of every game, 0 disables
+    IDLE_SLEEP = 60        # Longest sleep when no game is running (seconds)
+    COMPACT_MIN = 1_000    # Stale heap entries tolerated before the heap is compacted, beyond one per live entry
+
+
+clock_sweep_seconds = Histogram('ichess_clock_sweep_seconds', 'Duration of a flag-fall sweep of the clock service')
+
+
+class ClockService:
+    """
+    Flag-fall detection driven by a deadline heap
+    - Each game pushes the moment its side to move runs out of time whenever its clock changes
+    - The service sleeps until the earliest deadline, or until an earlier one is scheduled
+    - Clients count down locally from the snapshots sent on move and turn changes
+    - Entries of older clock versions and of finished games go stale, skipped when due,
+      and dropped at once when they outnumber the live ones, so finished games aren't kept alive
+    """
+
+    def __init__(self):
+        # (when, seq, game, clock_version), the live entry of a game has its current clock version
+        self.deadlines = []
+        self.live: Dict['Game', int] = {}  # game -> clock version of its live entry
+        self.seq = itertools.count()
+        self.wakeup = None
+        self.next_resync = None
+
+    def schedule(self, game) -> None:
+        when = game.flag_deadline()
+        earliest = self.next_deadline()
+
+        heapq.heappush(self.deadlines, (when, next(self.seq), game, game.clock_version))
+        self.live[game] = game.clock_version
+
+        if len(self.deadlines) > 2 * len(self.live) + ClockConfig.COMPACT_MIN:
+            self.compact()
+
+        if self.wakeup is not None and (earliest is None or when < earliest):
+            self.wakeup.set()
+
+    def cancel(self, game) -> None:
+        """The game is over, its entry goes stale"""
+        self.live.pop(game, None)
+
+    def compact(self) -> None:
+        # Linear, and only once the stale entries are as many as the live ones plus COMPACT_MIN
+        self.deadlines = [entry for entry in self.deadlines if self.live.get(entry[2]) == entry[3]]
+        heapq.heapify(self.deadlines)
+
+    def next_deadline(self) -> Optional[float]:
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def sleep_time(self, now: float) -> float:
+        wake_at = now + ClockConfig.IDLE_SLEEP
+
+        next_deadline = self.next_deadline()
+        if next_deadline is not None:
+            wake_at = min(wake_at, next_deadline)
+
+        if self.next_resync is not None:
+            wake_at = min(wake_at, self.next_resync)
+
+        return max(0, wake_at - now)
+
+    def process_due(self, now: float) -> None:
+        """Flag every game whose deadline has passed"""
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, game, clock_version = heapq.heappop(self.deadlines)
+
+            if game.is_game_over or game.clock_version != clock_version:
+                continue
+
+            self.live.pop(game, None)
+
+            # One broken game must not stop the flag-fall of the others
+            try:
+                self.check_flag(game)
+            except Exception:
+                logger.exception('Failed to check the clock of game %s', game.game_id)
+
+    def check_flag(self, game) -> None:
+        game.update_timer()
+        if game.player_times[game.current_player_index] <= 0:
+            game.on_flag()
+        else:
+            # Woke up a little early, the clock itself is authoritative
+            self.schedule(game)
+
+    def resync(self) -> None:
+        for game in list(running.games):
+            if not game.is_game_over:
+                game.send_clocks()
+
+    def run(self) -> None:
+        self.wakeup = running.socketio.server.eio.create_event()
+        if ClockConfig.RESYNC_INTERVAL:
+            self.next_resync = time.time() + ClockConfig.RESYNC_INTERVAL
+
+        while True:
+            self.wakeup.wait(self.sleep_time(time.time()))
+            self.wakeup.clear()
+
+            now = time.time()
+            with clock_sweep_seconds.time():
+                self.process_due(now)
+
+            if self.next_resync is not None and now >= self.next_resync:
+                self.resync()
+                self.next_resync = now + ClockConfig.RESYNC_INTERVAL
+
+
+clock_service = ClockService()
+
+Gauge('ichess_clock_deadlines', 'Pending clock deadlines, stale ones included',
+      read=lambda: len(clock_service.deadlines))
@@ -0,0 +1,158 @@
+"""
+Cross-worker game delivery
+
+With several workers behind sticky sessions, a game is owned by the worker that created it.
+An opponent connected to another worker is adopted: the owner registers their session and hosts the game,
+while their home worker forwards their game events to the owner until the game ends.
+A player who drops out and logs in again, on any worker, is forwarded to the worker holding their seat.
+A spectator watching a game of another worker is registered there, which sends them the game's events.
+Emits and room changes reach the player's connection through the Socket.IO message queue.
+"""
+import functools
+from typing import Callable, Dict
+
+from flask import request
+
+from player import forget, join
+from protocol import forget_client, register_client
+from share import get_logger, running
+from state_backend import state
+
+logger = get_logger(__name__)
+
+# sid -> owner worker, players connected here whose game is hosted elsewhere
+owners: Dict[str, str] = {}
+
+# sid -> home worker, players connected elsewhere whose game is hosted here
+guests: Dict[str, str] = {}
+
+# sid -> worker hosting the game, spectators connected here watching a game hosted elsewhere
+watched_on: Dict[str, str] = {}
+
+# event -> handler(sid, data), what a forwarded event runs on the owner
+handlers: Dict[str, Callable] = {}
+
+
+def routed(event: str):
+    """Run the handler on the worker that owns the sender's game, with the sender's sid"""
+
+    def decorator(handler: Callable[[str, dict], None]):
+        handlers[event] = handler
+
+        @functools.wraps(handler)
+        def on_event(data=None):
+            owner = owners.get(request.sid)
+            if owner is None:
+                return handler(request.sid, data)
+
+            state.publish(owner, {'type': 'event', 'event': event, 'sid': request.sid, 'data': data})
+
+        return on_event
+
+    return decorator
+
+
+def adopt(sid: str, entry: dict) -> None:
+    """Host a player claimed from another worker's queue, `entry` carries their profile"""
+    home = entry['worker']
+    guests[sid] = home
+
+    join(sid, entry['pid'], entry['name'], profile={'pid': entry['pid'], 'name': entry['name'], 'elo': entry['elo']})
+    register_client(sid, entry)
+    running.online_players.add(sid)
+
+    state.publish(home, {'type': 'adopted', 'sid': sid, 'owner': state.worker_id})
+    logger.info('Adopted %s from worker %s', sid, home)
+
+
+def release(sid: str) -> None:
+    """Hand a guest back to their home worker once their game is over"""
+    home = guests.pop(sid, None)
+    if home is None:
+        return
+
+    running.online_players.discard(sid)
+    running.unbind_sid(sid)
+    forget(sid)
+    forget_client(sid)
+
+    state.publish(home, {'type': 'released', 'sid': sid})
+
+
+def forward_join(sid: str, data: dict) -> bool:
+    """A player logged in here while another worker holds their seat, True if the login went there"""
+    owner = state.seat_holder(data['pid'])
+    if owner is None or owner == state.worker_id:
+        return False
+
+    owners[sid] = owner
+    state.publish(owner, {'type': 'rejoin', 'sid': sid, 'home': state.worker_id, 'data': data})
+    logger.info('Forwarded the login of %s to worker %s', sid, owner)
+    return True
+
+
+def rejoin(sid: str, home: str, data: dict) -> None:
+    """Seat a player back in their game hosted here, their home worker forwards their events from now on"""
+    guests[sid] = home
+
+    join(sid, data['pid'], data['name'])
+    register_client(sid, data)
+    running.online_players.add(sid)
+
+    game = running.away_game_of_pid.get(data['pid'])
+    if game is None:
+        # The game ended meanwhile
+        release(sid)
+        return
+
+    game.seat(sid)
+
+
+def forward_watch(sid: str, data: dict) -> bool:
+    """A spectator connected here asked for a game of another worker, True if the request went there"""
+    owner = state.game_owner(data['game_id'])
+    if owner is None or owner == state.worker_id:
+        return False
+
+    watched_on[sid] = owner
+    state.publish(owner, {'type': 'event', 'event': 'watch', 'sid': sid, 'data': data})
+    return True
+
+
+def forward_unwatch(sid: str) -> None:
+    """Stop watching a game of another worker"""
+    owner = watched_on.pop(sid, None)
+    if owner is not None:
+        state.publish(owner, {'type': 'event', 'event': 'unwatch', 'sid': sid, 'data': None})
+
+
+def forward_disconnect(sid: str) -> None:
+    """Tell the owner of the player's game they are gone"""
+    owner = owners.pop(sid, None)
+    if owner is not None:
+        state.publish(owner, {'type': 'event', 'event': 'disconnect', 'sid': sid, 'data': None})
+
+
+def on_worker_message(message: dict, on_adopted: Callable[[str], None]) -> None:
+    kind, sid = message['type'], message['sid']
+
+    if kind == 'event':
+        if message['event'] == 'disconnect':
+            guests.pop(sid, None)
+
+        handlers[message['event']](sid, message['data'])
+
+    elif kind == 'adopted':
+        owners[sid] = message['owner']
+        on_adopted(sid)
+
+    elif kind == 'released':
+        owners.pop(sid, None)
+
+    elif kind == 'rejoin':
+        rejoin(sid, message['home'], message['data'])
+
+
+def listen(on_adopted: Callable[[str], None]) -> None:
+    """Handle the messages other workers send here, `on_adopted` drops a player another worker claimed"""
+    state.listen(lambda message: on_worker_message(message, on_adopted))
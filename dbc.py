@@ -1,20 +1,78 @@
-from typing import Any, Dict
+import os
+from typing import Any, Dict, List, Optional
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
 
-client = MongoClient(host='mongo_db', port=27017, username='zhaoyun', password='801129')
-# client = MongoClient(host='127.0.0.1', port=27017, username='zhaoyun', password='801129')
+from metrics import mongo_seconds, timed
+from share import get_logger
 
-db = client['ichess']
-players = db['players']
+logger = get_logger(__name__)
 
 
+class DBConfig:
+    HOST = os.environ.get('ICHESS_MONGO_HOST', 'mongo_db')  # '127.0.0.1' outside docker
+    PORT = int(os.environ.get('ICHESS_MONGO_PORT', 27017))
+    USERNAME = os.environ.get('ICHESS_MONGO_USER', 'zhaoyun')
+    PASSWORD = os.environ.get('ICHESS_MONGO_PASSWORD', '801129')
+    DATABASE = os.environ.get('ICHESS_MONGO_DB', 'ichess')
+
+    MAX_POOL_SIZE = int(os.environ.get('ICHESS_MONGO_MAX_POOL', 50))
+    MIN_POOL_SIZE = int(os.environ.get('ICHESS_MONGO_MIN_POOL', 2))
+    CONNECT_TIMEOUT_MS = int(os.environ.get('ICHESS_MONGO_CONNECT_TIMEOUT_MS', 5000))
+    SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('ICHESS_MONGO_SELECT_TIMEOUT_MS', 5000))
+    SOCKET_TIMEOUT_MS = int(os.environ.get('ICHESS_MONGO_SOCKET_TIMEOUT_MS', 10000))
+
+
+# Only the fields the server uses are read back
+PLAYER_FIELDS = {'_id': 0, 'pid': 1, 'name': 1, 'elo': 1}
+
+_players: Optional[Collection] = None
+
+
+def connect(client: MongoClient = None) -> Collection:
+    """
+    Set up the players collection and its indexes
+    - Without a client, one is built from DBConfig; tests can pass a mongomock or throwaway mongod client
+    - Called at server start, otherwise on first use, so importing this module never touches the database
+    """
+    global _players
+
+    if client is None:
+        client = MongoClient(
+            host=DBConfig.HOST, port=DBConfig.PORT,
+            username=DBConfig.USERNAME, password=DBConfig.PASSWORD,
+            maxPoolSize=DBConfig.MAX_POOL_SIZE, minPoolSize=DBConfig.MIN_POOL_SIZE,
+            connectTimeoutMS=DBConfig.CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=DBConfig.SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=DBConfig.SOCKET_TIMEOUT_MS,
+        )
+
+    players = client[DBConfig.DATABASE]['players']
+
+    try:
+        players.create_index('pid', unique=True)
+    except OperationFailure:
+        # Duplicated pids from before the index existed, lookups still work, just slower
+        logger.exception('Failed to create the unique index on players.pid')
+
+    _players = players
+    return players
+
+
+def players_collection() -> Collection:
+    return _players if _players is not None else connect()
+
+
+@timed(mongo_seconds.labels('load'))
 def load(pid: str) -> Dict[str, Any]:
-    return players.find_one({'pid': pid}, {'_id': 0})
+    return players_collection().find_one({'pid': pid}, PLAYER_FIELDS)
 
 
+@timed(mongo_seconds.labels('upsert'))
 def upsert(user: Dict[str, Any]) -> Dict[str, Any]:
-    result = players.update_one(
+    result = players_collection().update_one(
         filter={'pid': user['pid']},
         update={'$set': user},
         upsert=True
@@ -23,6 +81,20 @@ def upsert(user: Dict[str, Any]) -> Dict[str, Any]:
     return result.acknowledged
 
 
+@timed(mongo_seconds.labels('bulk_upsert'))
+def bulk_upsert(users: List[Dict[str, Any]]) -> bool:
+    if not users:
+        return True
+
+    result = players_collection().bulk_write(
+        [UpdateOne({'pid': user['pid']}, {'$set': user}, upsert=True) for user in users],
+        ordered=False
+    )
+
+    return result.acknowledged
+
+
+@timed(mongo_seconds.labels('delete_user'))
 def delete_user(pid: str) -> bool:
-    result = players.delete_one({'pid': pid})
+    result = players_collection().delete_one({'pid': pid})
     return result.deleted_count == 1
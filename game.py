@@ -1,95 +1,354 @@
+import itertools
+import os
 import time
-from typing import Dict, List
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
 
 import chess
-import chess.engine
 
-from player import level_of, player_of, update_elo_after_game
-from share import (Reasons, get_logger, get_native_engine_path, running,
-                   send_command, send_message)
-from stockfish_pool import StockfishPool
+from analysis import analysis
+from archive import archive, utc_date
+from bot_profiles import is_bot, release_bot, restore_bot
+from bot_search import start_search
+from clock import clock_service
+from cluster import release
+from journal import GameRecord, JournalConfig, journal
+from player import forget, join, name_of, player_of, update_elo_after_game
+from protocol import (broadcast, clock_fields, is_legacy, legacy_room, ply_payload, protocol_room, send_to,
+                      sync_payload)
+from share import (AWAY_PREFIX, Reasons, away_pid, close_room, enter_room, get_logger, has_connection, running,
+                   send_command, send_message, send_room_command, send_room_message)
+from spectators import spectators
+from state_backend import state
 
 logger = get_logger(__name__)
 
 
-class Game:
-    stockfish_pool = StockfishPool(get_native_engine_path(), max_size=5)  # Shared pool
+class SessionConfig:
+    # Seconds a dropped player's seat is held, 0 ends the game at once
+    RECONNECT_GRACE = int(os.environ.get('ICHESS_RECONNECT_GRACE', 30))
+
+
+# Game ids are unique across restarts and workers: a random prefix drawn once per process, then a counter
+_game_id_prefix = os.urandom(6).hex()
+_game_numbers = itertools.count(1)
+
+
+def name_and_rating(profile: dict) -> Tuple[str, int]:
+    return profile.get('name', profile['pid']), profile['elo']
+
 
-    def __init__(self, pair: List[str], total_time: int, step_increment_time: int, bot_sid=None):
+class Game:
+    def __init__(self, pair: List[str], total_time: int, step_increment_time: int, bot_sid=None,
+                 restored: GameRecord = None):
         self.players = pair
         self.player1, self.player2 = self.players[0], self.players[1]
-        self.game_id = hash(self.player1) + hash(self.player2)
 
+        # The journal refers to games by it
+        self.game_id = restored.game_id if restored else f'{_game_id_prefix}{next(_game_numbers):x}'
+        profiles = None if restored else [player_of(player) for player in self.players]
+        self.pids = restored.pids if restored else [profile['pid'] for profile in profiles]
+
+        # Names and ratings at the start, restored games take them when first asked, see ratings()
+        self.start_ratings = None if restored else [name_and_rating(profile) for profile in profiles]
+
+        self.total_time = total_time
         self.player_times = [total_time, total_time]
         self.step_increment_time = step_increment_time
+        self.clock_history: List[Tuple[float, float]] = []  # Both clocks after each move
 
         self.start_time = None
         self.current_player_index: int = 0
+        self.clock_version = 0
 
         self.board = chess.Board()
+        self.position_version = 0  # Bumped whenever the board changes, to spot stale bot searches
+
+        # Occurrences of each position, kept in step with the board so repetitions never replay the move stack
+        self.repetitions = Counter([self.position_key()])
         self.is_game_over = False
         self.game_state = {'draw_proposer': None, 'takeback_proposer': None}
 
         self.bot_sid = bot_sid
-        self.start_game()
+        self.away_deadlines: Dict[str, float] = {}  # Placeholder sid of a dropped player -> when they forfeit
+
+        # Events for both players go to the game's room, serialized once,
+        # the protocol room of each player gets the per-move events of its protocol version
+        self.room = f'game_{self.game_id}'
+        self.protocol_rooms = self.connected_protocol_rooms()
+        for player in self.players:
+            enter_room(player, self.room)
+            enter_room(player, protocol_room(self.room, player))
+
+        if restored:
+            self.replay(restored)
+        else:
+            journal.started(self.game_id, self.pids, total_time, step_increment_time)
+
+        self.start_game(JournalConfig.RESUME_GRACE if restored else 0)
+
+    @classmethod
+    def restore(cls, record: GameRecord) -> 'Game':
+        """
+        A game recorded in the journal before a restart
+        Players get a placeholder seat until they log in again, bots are seated right away
+        """
+        pair, bot_sid = [], None
+        for pid in record.pids:
+            if is_bot(pid):
+                bot_sid = restore_bot(pid)
+                pair.append(bot_sid)
+            else:
+                sid = AWAY_PREFIX + pid
+                join(sid, pid, pid)  # The profile is loaded from the database when needed
+                state.hold_seat(pid)
+                pair.append(sid)
+
+        return cls(pair, record.total_time, record.increment, bot_sid=bot_sid, restored=record)
+
+    def replay(self, record: GameRecord) -> None:
+        # The moves were checked when they were played, pushed without testing their legality again
+        for move in record.moves:
+            self.board.push(chess.Move.from_uci(move))
+            self.repetitions[self.position_key()] += 1
+
+        self.player_times = list(record.clocks)
+        self.clock_history = [tuple(clocks) for clocks in record.clock_history]
+        self.current_player_index = len(self.board.move_stack) % 2
+
+    def record(self) -> GameRecord:
+        """The game as the journal would replay it"""
+        record = GameRecord(self.game_id, *self.pids, self.total_time, self.step_increment_time)
+        record.moves = [move.uci() for move in self.board.move_stack]
+        record.clock_history = [list(clocks) for clocks in self.clock_history]
+        record.clocks = list(self.player_times)
+        return record
+
+    def connected_protocol_rooms(self) -> Set[str]:
+        return {protocol_room(self.room, player) for player in self.players if has_connection(player)}
+
+    def replace_player(self, old_sid: str, new_sid: str) -> int:
+        """Put another sid in a player's seat, returns the seat index"""
+        index = self.players.index(old_sid)
+
+        self.players[index] = new_sid
+        self.player1, self.player2 = self.players[0], self.players[1]
+        running.replace_sid(self, old_sid, new_sid)
+        self.protocol_rooms = self.connected_protocol_rooms()
+
+        # A pending draw or takeback proposal moves with the seat
+        for proposal, proposer in self.game_state.items():
+            if proposer == old_sid:
+                self.game_state[proposal] = new_sid
+
+        return index
+
+    def hold_seat(self, sid: str) -> None:
+        """
+        A player dropped out of the game: their seat is held for RECONNECT_GRACE seconds while their clock runs,
+        logging in again with the same pid takes it back, see seat()
+        """
+        pid = running.pid_of_sid.get(sid)
+        if not SessionConfig.RECONNECT_GRACE or pid is None:
+            return self.player_disconnected(sid)
+
+        away_sid = AWAY_PREFIX + pid
+        join(away_sid, pid, name_of(sid))  # Their profile stays cached for the rating update
+        self.replace_player(sid, away_sid)
+        state.hold_seat(pid)  # Their next login, on whichever worker, comes back here
+
+        deadline = time.time() + SessionConfig.RECONNECT_GRACE
+        self.away_deadlines[away_sid] = deadline
+        running.socketio.start_background_task(self.forfeit_if_away, away_sid, deadline)
+
+        logger.info('%s dropped out of game %s, holding the seat', sid, self.game_id)
+        send_message([self.opponent_of(away_sid)],
+                     f'Opponent disconnected, waiting {SessionConfig.RECONNECT_GRACE}s for them to come back.')
+
+    def forfeit_if_away(self, away_sid: str, deadline: float) -> None:
+        running.socketio.sleep(max(0.0, deadline - time.time()))
+
+        # Back in time, or dropped again since, which set a new deadline
+        if self.is_game_over or self.away_deadlines.get(away_sid) != deadline:
+            return
+
+        del self.away_deadlines[away_sid]
+        logger.info('%s did not come back to game %s', away_sid, self.game_id)
+        self.player_disconnected(away_sid)
+
+    def seat(self, sid: str) -> None:
+        """A player logged in again after dropping out, or after a restart, they take over their placeholder seat"""
+        away_sid = AWAY_PREFIX + running.pid_of_sid[sid]
+        index = self.replace_player(away_sid, sid)
+        self.away_deadlines.pop(away_sid, None)
+        state.free_seat(running.pid_of_sid[sid])
+        running.unbind_sid(away_sid)
+        forget(away_sid)
+
+        enter_room(sid, self.room)
+        enter_room(sid, protocol_room(self.room, sid))
+
+        logger.info('%s is back in game %s', sid, self.game_id)
+
+        white_player, black_player = player_of(self.player1), player_of(self.player2)
+        send_command([sid], 'game_mode', {
+            'side': 'white' if index == 0 else 'black', 'white_player': white_player, 'black_player': black_player
+        })
 
-    def start_game(self) -> None:
-        self.start_time = time.time()
-        self.send_board_state()
+        # The clock waits out the grace period only while someone is still missing
+        if not any(away_pid(player) for player in self.players) and self.start_time > time.time():
+            self.start_time = time.time()
+            self.clock_changed()
+
+        self.announce_turn()
+
+    def ratings(self) -> List[Tuple[str, int]]:
+        """Names and ratings of white and black"""
+        if self.start_ratings is None:
+            self.start_ratings = [name_and_rating(player_of(player)) for player in (self.player1, self.player2)]
+
+        return self.start_ratings
+
+    def start_game(self, grace: float = 0) -> None:
+        self.start_time = time.time() + grace
+        self.clock_changed()
+        self.announce_turn()
 
         if self.bot_sid and self.players[self.current_player_index] == self.bot_sid:
             self.make_bot_move()
-        else:
-            send_command([self.players[self.current_player_index]], 'go', {})
 
-        logger.info(f'Waiting for player to make a move, game ID = {self.game_id}')
+        logger.info('Waiting for player to make a move, game ID = %s', self.game_id)
 
     def update_timer(self):
-        # Calculate elapsed time based on current time and subtract it from current player's remaining time
+        # Calculate elapsed time based on current time and subtract it from current player's remaining time,
+        # nothing during the grace period of a restored game
         current_time = time.time()
-        elapsed = current_time - self.start_time
+        elapsed = max(0.0, current_time - self.start_time)
         self.player_times[self.current_player_index] -= elapsed
-        self.start_time = current_time
+        self.start_time = max(current_time, self.start_time)
 
-    def send_board_state(self):
-        # This sends the board state to both players
-        send_message(self.players, f'\n{str(self.board)}')
-        logger.info(f'GAME STATUS. ID = {self.game_id}')
-        logger.info(self.board)
+    def flag_deadline(self) -> float:
+        return self.start_time + self.player_times[self.current_player_index]
 
-    def make_bot_move(self) -> None:
-        # Get engine
-        level = level_of(player_of(self.bot_sid)['elo'])
-        engine = Game.stockfish_pool.get_engine(level)
+    def clock_changed(self) -> None:
+        # Reschedule the flag deadline, clients count down locally from the snapshot sent with the turn
+        self.clock_version += 1
+        clock_service.schedule(self)
+
+    def announce_turn(self, move: str = None) -> None:
+        """Tell both players whose turn it is, after a move, at the start or after a takeback"""
+        if move:
+            broadcast(self.protocol_rooms, 'ply', ply_payload(self, move))
+        else:
+            broadcast(self.protocol_rooms, 'sync', sync_payload(self))
+
+        self.send_legacy_clocks()
+        spectators.changed(self)
+
+        current = self.players[self.current_player_index]
+        if is_legacy(current):
+            send_command([current], 'go', {})
+
+    def send_clocks(self) -> None:
+        broadcast(self.protocol_rooms, 'clock', clock_fields(self))
+        self.send_legacy_clocks()
 
-        result = engine.play(self.board, chess.engine.Limit(time=1.0))
-        self.on_move({'move': str(result.move)}, self.bot_sid)
+    def send_legacy_clocks(self) -> None:
+        current = self.players[self.current_player_index]
+        opponent = self.opponent_of(current)
 
-        # Return engine after thinking
-        Game.stockfish_pool.return_engine(engine)
+        current_time = int(self.player_times[self.current_player_index])
+        opponent_time = int(self.player_times[(self.current_player_index + 1) % 2])
+
+        if is_legacy(current):
+            send_command([current], 'timer', {'mine': current_time, 'opponent': opponent_time})
+        if is_legacy(opponent):
+            send_command([opponent], 'timer', {'mine': opponent_time, 'opponent': current_time})
+
+    def send_sync(self, sid: str) -> None:
+        send_to(sid, 'sync', sync_payload(self))
+
+    def on_flag(self) -> None:
+        loser = self.players[self.current_player_index]
+        winner = self.opponent_of(loser)
+
+        logger.info('%s ran out of time, game ID = %s', loser, self.game_id)
+
+        update_elo_after_game(winner, loser, 1)
+
+        self.declare_loser([loser], Reasons.Lose.OUT_OF_TIME)
+        self.declare_winner([winner], Reasons.Win.OPPONENT_OUT_OF_TIME)
+
+    def make_bot_move(self) -> None:
+        # The search runs in the background and comes back through on_move
+        start_search(self)
 
     def on_move(self, move: Dict[str, str], player: str) -> bool:
+        # A move may still arrive after the game ended, e.g. a bot search finishing late
+        if self.is_game_over:
+            return False
 
-        if 'move' in move and self.verify_move(move['move']):
-            self.make_move(move['move'], self.opponent_of(player))
+        # A compact client numbers its moves, a mismatch means it is out of step with the game
+        if 'n' in move and move['n'] != len(self.board.move_stack) + 1:
+            self.send_sync(player)
+            return False
+
+        # Only the side to move may move, e.g. not a human sending the reply of a bot that is still thinking
+        on_turn = player == self.players[self.current_player_index]
+        legal_move = self.verify_move(move['move']) if on_turn and 'move' in move else None
+        if legal_move:
+            # Charge the thinking time to the mover before the turn changes
+            self.update_timer()
+            if self.player_times[self.current_player_index] < 0:
+                self.on_flag()
+                return True
+
+            self.make_move(legal_move, self.opponent_of(player))
             self.player_times[self.current_player_index] += self.step_increment_time
+            self.clock_history.append((self.player_times[0], self.player_times[1]))
+            journal.moved(self.game_id, legal_move.uci(), self.player_times)
 
             self.after_move()
             return True
 
         else:
-            send_message([player], f'Command error: {move}, please re-enter.')
+            if is_legacy(player):
+                send_message([player], f'Command error: {move}, please re-enter.')
+            else:
+                self.send_sync(player)
             return False
 
-    def verify_move(self, move: str) -> bool:
+    def verify_move(self, move: str) -> Optional[chess.Move]:
+        """The parsed move if it is legal, tested directly instead of generating every legal move"""
         try:
-            return chess.Move.from_uci(move) in self.board.legal_moves
-        except (ValueError, IndexError):
-            return False
-
-    def make_move(self, move: str, opponent: str):
-        self.board.push_uci(move)
-        send_command([opponent], 'move', {'move': self.board.peek().uci()})
+            parsed = chess.Move.from_uci(move)
+        except (ValueError, IndexError, TypeError):
+            return None
+
+        return parsed if self.board.is_legal(parsed) else None
+
+    def position_key(self) -> tuple:
+        # What python-chess itself compares for repetitions: pieces, side to move, castling rights and en passant,
+        # built from public attributes only; zobrist_hash would do too, at about 80 times the cost
+        board = self.board
+        return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.turn,
+                board.clean_castling_rights(), board.ep_square if board.has_legal_en_passant() else None)
+
+    def make_move(self, move: chess.Move, opponent: str):
+        self.board.push(move)
+        self.repetitions[self.position_key()] += 1
+        self.position_version += 1
+        if legacy_room(self.room) in self.protocol_rooms:
+            send_room_command(legacy_room(self.room), 'move', {'move': move.uci()}, skip_sid=self.opponent_of(opponent))
+
+    def undo_move(self) -> None:
+        key = self.position_key()
+        self.repetitions[key] -= 1
+        if not self.repetitions[key]:
+            del self.repetitions[key]
+
+        self.board.pop()
 
     def after_move(self):
         if not self.check_players_connected():
@@ -118,7 +377,7 @@ class Game:
             self.player_disconnected(disconnected_player)
 
     def is_player_connected(self, player: str) -> bool:
-        if player in running.online_players or player.startswith('bot_'):
+        if player in running.online_players or not has_connection(player):
             return True
         else:
             self.players.remove(player)
@@ -126,79 +385,130 @@ class Game:
 
     def player_disconnected(self, player: str):
         winner = self.player2 if self.player1 == player else self.player1
-        self.declare_winner([winner], Reasons.Win.OPPONENT_LEFT)
         update_elo_after_game(winner, player, 1)
+        self.declare_winner([winner], Reasons.Win.OPPONENT_LEFT)
 
     def check_game_end(self) -> bool:
-        if self.board.is_checkmate():
-            self.handle_checkmate()
-            return True
+        outcome = self.outcome()
+        if outcome is None:
+            return False
 
-        if self.board.is_stalemate():
-            self.draw('Stalemate!')
+        if outcome == Reasons.Win.CHECKMATE:
+            self.handle_checkmate()
+        else:
             update_elo_after_game(self.player1, self.player2, 0.5)
-            return True
+            self.draw(outcome)
 
-        if self.board.is_insufficient_material():
-            self.draw('Insufficient material!')
-            update_elo_after_game(self.player1, self.player2, 0.5)
-            return True
+        return True
 
-        return False
+    def outcome(self) -> Optional[str]:
+        """
+        How the game ended with the last move: CHECKMATE or the draw message, None if it goes on
+        A single legal move generation tells mate from stalemate, the draw rules are counter lookups
+        """
+        board = self.board
+
+        if not any(board.generate_legal_moves()):
+            return Reasons.Win.CHECKMATE if board.is_check() else 'Stalemate!'
+
+        if board.is_insufficient_material():
+            return 'Insufficient material!'
+
+        if self.repetitions[self.position_key()] >= 3:
+            return 'Threefold repetition!'
+
+        if board.halfmove_clock >= 100:
+            return 'Fifty-move rule!'
+
+        return None
 
     def prepare_next_turn(self) -> None:
-        self.send_board_state()
         self.current_player_index = (self.current_player_index + 1) % 2
+        self.clock_changed()
+        self.announce_turn(self.board.peek().uci())
 
         if self.bot_sid and self.players[self.current_player_index] == self.bot_sid:
             self.make_bot_move()
-        else:
-            send_command([self.players[self.current_player_index]], 'go', {})
-
-        self.update_timer()
 
-    def game_over(self):
-        logger.info(f'The game has ended. ID = {self.game_id}')
-        send_command(self.players, 'game_over', {})
+    def game_over(self, result: str = '*', termination: str = ''):
+        logger.info('The game has ended. ID = %s', self.game_id)
+        send_room_command(self.room, 'game_over', {})
 
         self.is_game_over = True
-        running.games.remove(self)
+        running.remove_game(self)
+        clock_service.cancel(self)
+        journal.ended(self.game_id)
+        snapshot = self.snapshot(result, termination)
+        archive.add(snapshot)
+        analysis.submit(self.game_id, snapshot['moves'],
+                        [(pid, sid) for pid, sid in zip(self.pids, (self.player1, self.player2)) if not is_bot(sid)])
+        spectators.game_over(self, result, termination)
+
+        # Players hosted for another worker go back to it, seats held for absent players are given up
+        for player in (self.player1, self.player2):
+            release(player)
+            if away_pid(player):
+                state.free_seat(away_pid(player))
+                running.unbind_sid(player)
+                forget(player)
+
+        # Bot sessions live for one game only
+        if self.bot_sid:
+            release_bot(self.bot_sid)
 
         self.return_to_lobby_after_game()
 
+        close_room(self.room)
+        for room in self.protocol_rooms:
+            close_room(room)
+
+    def snapshot(self, result: str, termination: str) -> dict:
+        """What the archive needs of a finished game, copied so the PGN can be written later"""
+        ratings = self.ratings()
+        return {
+            'game_id': self.game_id,
+            'date': utc_date(),
+            'names': [name for name, _ in ratings],
+            'elos': [elo for _, elo in ratings],
+            'time_control': f'{self.total_time}+{self.step_increment_time}',
+            'result': result,
+            'termination': termination,
+            'moves': list(self.board.move_stack),
+            'clocks': list(self.clock_history),
+        }
+
     def return_to_lobby_after_game(self):
-        for player in self.players:
-            send_message([player], 'Tap MATCH to match immediately.')
-            send_command([player], 'waiting_match', {})
+        send_room_message(self.room, 'Tap MATCH to match immediately.')
+        send_room_command(self.room, 'waiting_match', {})
 
     def declare_winner(self, players: List[str], reason: str):
         send_command(players, 'win', {'reason': reason})
-        self.game_over()
+        self.game_over('1-0' if players[0] == self.player1 else '0-1', reason)
 
     def declare_loser(self, players: List[str], reason: str):
         send_command(players, 'lost', {'reason': reason})
 
     def draw(self, reason: str):
-        send_command(self.players, 'draw', {'reason': reason})
-        self.game_over()
+        send_room_command(self.room, 'draw', {'reason': reason})
+        self.game_over('1/2-1/2', reason)
 
     def handle_checkmate(self) -> None:
         winner = self.players[self.current_player_index]
         loser = self.opponent_of(winner)
 
+        update_elo_after_game(winner, loser, 1)
+
         self.declare_winner([winner], Reasons.Win.CHECKMATE)
         self.declare_loser([loser], Reasons.Lose.CHECKMATED)
 
-        update_elo_after_game(winner, loser, 1)
-
     def on_resign(self, player: str):
         if player == self.player1:
-            self.declare_winner([self.player2], Reasons.Win.OPPONENT_RESIGNED)
             update_elo_after_game(self.player2, self.player1, 1)
+            self.declare_winner([self.player2], Reasons.Win.OPPONENT_RESIGNED)
 
         else:
-            self.declare_winner([self.player1], Reasons.Win.OPPONENT_RESIGNED)
             update_elo_after_game(self.player1, self.player2, 1)
+            self.declare_winner([self.player1], Reasons.Win.OPPONENT_RESIGNED)
 
     def on_draw_proposal(self, proposer: str) -> bool:
         if self.game_state['draw_proposer'] is None:
@@ -206,8 +516,7 @@ class Game:
             opponent = self.opponent_of(proposer)
 
             if self.bot_sid and opponent == self.bot_sid:
-                running.socketio.sleep(1)
-                self.on_draw_response(self.bot_sid, True)
+                self.bot_accepts(self.on_draw_response)
                 return True
 
             send_command([opponent], 'draw_request', {})
@@ -219,8 +528,8 @@ class Game:
     def on_draw_response(self, responder: str, accepted: bool) -> bool:
         if self.game_state['draw_proposer'] and responder == self.opponent_of(self.game_state['draw_proposer']):
             if accepted:
-                self.draw('Draw agreed!')
                 update_elo_after_game(self.player1, self.player2, 0.5)
+                self.draw('Draw agreed!')
 
             else:
                 send_command([self.game_state['draw_proposer']], 'draw_declined', {})
@@ -237,8 +546,7 @@ class Game:
             opponent = self.opponent_of(proposer)
 
             if self.bot_sid and opponent == self.bot_sid:
-                running.socketio.sleep(1)
-                self.on_takeback_response(self.bot_sid, True)
+                self.bot_accepts(self.on_takeback_response)
                 return True
 
             send_command([opponent], 'takeback_request', {})
@@ -248,34 +556,34 @@ class Game:
         return False
 
     def on_takeback_response(self, responder: str, accepted: bool) -> bool:
-        if self.game_state['takeback_proposer'] and responder == self.opponent_of(self.game_state['takeback_proposer']):
-            if accepted:
-                # Check if there are at least two moves to take back
-                if len(self.board.move_stack) >= 2:
-                    # Take back the last two moves of both players
-                    _ = self.board.pop()  # Take back opponent's move
-                    _ = self.board.pop()  # Take back own move
+        proposer = self.game_state['takeback_proposer']
+        if proposer and responder == self.opponent_of(proposer):
+            # Needs two moves to take back, and the proposer still in their seat
+            if accepted and len(self.board.move_stack) >= 2 and proposer in self.players:
+                self.update_timer()
 
-                    # Restore time (subtract increment time for both)
-                    self.player_times[0] -= self.step_increment_time
-                    self.player_times[1] -= self.step_increment_time
-                    self.start_time = time.time()
+                # Take back the last two moves of both players
+                self.undo_move()  # Take back opponent's move
+                self.undo_move()  # Take back own move
+                del self.clock_history[-2:]
+                self.position_version += 1
 
-                    # It's the turn of the player who initiated the takeback
-                    self.current_player_index = self.players.index(self.game_state['takeback_proposer'])
+                # Restore time (subtract increment time for both)
+                self.player_times[0] -= self.step_increment_time
+                self.player_times[1] -= self.step_increment_time
+                journal.took_back(self.game_id, self.player_times)
 
-                    # Notify both players
-                    send_command(self.players, 'takeback_success', {})
+                # It's the turn of the player who initiated the takeback
+                self.current_player_index = self.players.index(proposer)
+                self.clock_changed()
 
-                    self.send_board_state()
-                    send_command([self.players[self.current_player_index]], 'go', {})
+                # Notify both players
+                send_room_command(self.room, 'takeback_success', {})
 
-                else:
-                    # Not enough moves, decline takeback
-                    send_command([self.game_state['takeback_proposer']], 'takeback_declined', {})
+                self.announce_turn()
 
             else:
-                send_command([self.game_state['takeback_proposer']], 'takeback_declined', {})
+                send_command([proposer], 'takeback_declined', {})
 
             self.game_state['takeback_proposer'] = None
 
@@ -283,5 +591,15 @@ class Game:
 
         return False
 
+    def bot_accepts(self, respond) -> None:
+        """The bot agrees after a second, answered from a background task so the proposer's handler returns at once"""
+
+        def answer():
+            running.socketio.sleep(1)
+            if not self.is_game_over:
+                respond(self.bot_sid, True)
+
+        running.socketio.start_background_task(answer)
+
     def opponent_of(self, player: str) -> str:
         return self.player2 if player == self.player1 else self.player1
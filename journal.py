@@ -0,0 +1,220 @@
+"""
+Append-only journal of the games in progress, replayed at startup so a restart doesn't end them
+
+One JSON array per line:
+    ["S", game_id, white_pid, black_pid, total_time, increment]   game started
+    ["M", game_id, uci, white_ms, black_ms]                         move, with both clocks after it
+    ["T", game_id, white_ms, black_ms]                              takeback of the last two moves
+    ["E", game_id]                                                  game over
+The pids are written once per game, in its start record, instead of with every move.
+"""
+import atexit
+import json
+import mmap
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+from batch_writer import BatchWriter
+from share import get_logger, running
+
+logger = get_logger(__name__)
+
+
+class JournalConfig:
+    # Empty to disable. One journal per worker, each worker replays and compacts its own only;
+    # a worker started without ICHESS_WORKER_ID runs alone, its journal keeps one name across restarts
+    PATH = os.environ.get('ICHESS_JOURNAL', f"./data/games-{os.environ.get('ICHESS_WORKER_ID', 'local')}.journal")
+    FLUSH_INTERVAL = 0.05         # Longest time a record waits to be written and fsynced (seconds)
+    FSYNC = True                  # False only writes to the OS cache: survives a server crash, not a machine crash
+    COMPACT_BYTES = 64 * 2 ** 20  # Journal size that triggers a rewrite with the live games only
+    RESUME_GRACE = 30             # Seconds a restored game waits for its players before the clock runs again
+
+
+def start_line(game_id: str, pids: Iterable[str], total_time: int, increment: int) -> str:
+    return json.dumps(['S', game_id, *pids, total_time, increment]) + '\n'
+
+
+def move_line(game_id: str, move: str, clocks: List[float]) -> str:
+    return f'["M","{game_id}","{move}",{int(clocks[0] * 1000)},{int(clocks[1] * 1000)}]\n'
+
+
+class GameRecord:
+    """A game rebuilt from the journal"""
+
+    def __init__(self, game_id: str, white_pid: str, black_pid: str, total_time: int, increment: int):
+        self.game_id = game_id
+        self.pids = [white_pid, black_pid]
+        self.total_time = total_time
+        self.increment = increment
+        self.moves: List[str] = []
+        self.clock_history: List[List[float]] = []  # Both clocks after each move
+        self.clocks = [float(total_time), float(total_time)]
+
+    def lines(self) -> List[str]:
+        """
+        The shortest journal of the game: its start, then its moves with the clocks after each of them
+        The last move carries the current clocks, which differ from the ones after it since a takeback
+        """
+        lines = [start_line(self.game_id, self.pids, self.total_time, self.increment)]
+        lines.extend(move_line(self.game_id, move, clocks) for move, clocks in zip(self.moves, self.clock_history))
+        if self.moves:
+            lines[-1] = move_line(self.game_id, self.moves[-1], self.clocks)
+        return lines
+
+
+class Journal(BatchWriter):
+    """
+    Game records are queued in memory and written in batches by a background loop, one fsync per batch
+    A move is acknowledged before it is on disk, at most FLUSH_INTERVAL of moves can be lost in a crash
+    """
+
+    ITEMS = 'journal records'
+    FLUSH_INTERVAL = JournalConfig.FLUSH_INTERVAL
+
+    def __init__(self, path: str):
+        super().__init__(logger)
+        self.path = path
+        self.file = None
+        self.pending: List[str] = []
+        self.size = 0
+
+        # Metrics
+        self.records = 0
+
+    # Recording, called on every move, only touches memory
+
+    def append(self, line: str) -> None:
+        if self.file is not None:
+            self.pending.append(line)
+
+    def started(self, game_id: str, pids: Iterable[str], total_time: int, increment: int) -> None:
+        self.append(start_line(game_id, pids, total_time, increment))
+
+    def moved(self, game_id: str, move: str, clocks: List[float]) -> None:
+        self.append(move_line(game_id, move, clocks))
+
+    def took_back(self, game_id: str, clocks: List[float]) -> None:
+        self.append(f'["T","{game_id}",{int(clocks[0] * 1000)},{int(clocks[1] * 1000)}]\n')
+
+    def ended(self, game_id: str) -> None:
+        self.append(f'["E","{game_id}"]\n')
+
+    # Writing
+
+    def open(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+    def has_pending(self) -> bool:
+        return bool(self.pending) and self.file is not None
+
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    def take(self) -> List[str]:
+        lines, self.pending = self.pending, []
+        return lines
+
+    def write(self, lines: List[str]) -> bool:
+        # fsync blocks
+        self.file.write(''.join(lines).encode())
+        self.file.flush()
+        if JournalConfig.FSYNC:
+            os.fsync(self.file.fileno())
+        return True
+
+    def settle(self, lines: List[str], ok: bool) -> None:
+        if ok:
+            self.records += len(lines)
+            self.size += sum(map(len, lines))  # Records are ASCII, JSON escapes the rest
+        else:
+            self.pending[:0] = lines
+
+    def run(self, live_games: Callable[[], Iterable[GameRecord]]) -> None:
+        """Flush loop, `live_games` snapshots the games in progress when the journal needs compacting"""
+        while True:
+            running.socketio.sleep(JournalConfig.FLUSH_INTERVAL)
+            self.flush()
+
+            if self.size > JournalConfig.COMPACT_BYTES and not self.pending:
+                self.compact(live_games())
+
+    def close(self) -> None:
+        if self.file is not None:
+            super().close()
+            self.file.close()
+            self.file = None
+
+    def compact(self, games: Iterable[GameRecord]) -> None:
+        """Rewrite the journal with the given games only"""
+        reopen = self.file is not None
+        if reopen:
+            self.flush(blocking=True)
+            self.file.close()
+            self.file = None
+
+        temporary = self.path + '.compact'
+        with open(temporary, 'w') as compacted:
+            for game in games:
+                compacted.writelines(game.lines())
+
+            compacted.flush()
+            os.fsync(compacted.fileno())
+
+        os.replace(temporary, self.path)
+        logger.info('Compacted the game journal to %s bytes', os.path.getsize(self.path))
+
+        if reopen:
+            self.open()
+
+    # Recovery
+
+    def replay(self) -> Dict[str, GameRecord]:
+        """The games that were still in progress, in start order"""
+        games: Dict[str, GameRecord] = {}
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return games
+
+        with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line in iter(data.readline, b''):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record torn by a crash can only be the last one
+                    logger.error('Skipped a damaged journal record: %r', line[:100])
+                    continue
+
+                self.apply(games, record)
+
+        return games
+
+    @staticmethod
+    def apply(games: Dict[str, GameRecord], record: list) -> None:
+        kind, game_id = record[0], record[1]
+
+        if kind == 'S':
+            games[game_id] = GameRecord(*record[1:])
+            return
+
+        game: Optional[GameRecord] = games.get(game_id)
+        if game is None:
+            return
+
+        if kind == 'M':
+            game.moves.append(record[2])
+            game.clocks = [record[3] / 1000, record[4] / 1000]
+            game.clock_history.append(game.clocks)
+        elif kind == 'T':
+            del game.moves[-2:]
+            del game.clock_history[-2:]
+            game.clocks = [record[2] / 1000, record[3] / 1000]
+        elif kind == 'E':
+            del games[game_id]
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'records': self.records, 'size': self.size}
+
+
+journal = Journal(JournalConfig.PATH)
+atexit.register(journal.close)
@@ -0,0 +1,177 @@
+import heapq
+import itertools
+import time
+from typing import Callable, List, Optional
+
+from share import get_logger, running
+
+logger = get_logger(__name__)
+
+
+class MatchConfig:
+    DIFF_INIT = 1          # Initial level difference
+    DIFF_INCREMENT = 1     # Incremental level difference
+    DIFF_MAX = 4           # Maximum level difference
+    WIDEN_INTERVAL = 5     # Seconds of waiting per level difference increment
+    BOT_WAIT_TIME = 15     # Waiting time for bot matching (seconds)
+    CHECK_INTERVAL = 5     # Longest idle sleep of the matching loop, must not exceed WIDEN_INTERVAL (seconds)
+
+
+class Matchmaker:
+    """
+    Event-driven matching of waiting players
+    - Waiting players live in the state backend, indexed by time control and level, so every worker sees them
+    - A new player is matched immediately if a suitable opponent is waiting
+    - Window widening and the bot fallback of this worker's players are driven by a deadline heap
+    - An opponent waiting on another worker is handed to `on_adopt` before the game is created here
+    """
+
+    def __init__(self, on_pair: Callable[[List[str], int], None], on_bot: Callable[[str, int], None],
+                 backend, on_adopt: Callable[[str, dict], None] = None):
+        self.on_pair = on_pair
+        self.on_bot = on_bot
+        self.on_adopt = on_adopt
+        self.backend = backend
+
+        # (when, seq, sid, entry), entries that left the queue are skipped lazily
+        self.deadlines = []
+        self.seq = itertools.count()
+
+    def add(self, sid: str, time_control: int, level: int, profile: dict = None) -> bool:
+        """
+        Put a player in the queue, returns False if they are already waiting
+        `profile` travels with the entry, so another worker can host the game
+        """
+        if sid in running.waiting_players:
+            return False
+
+        now = time.time()
+        entry = {'join_time': now, 'time_control': time_control, 'level': level, **(profile or {})}
+        running.waiting_players[sid] = entry
+
+        if not self.try_match(sid, entry, now):
+            self.backend.add_waiting(sid, entry)
+            self.schedule(sid, entry, now)
+
+        return True
+
+    def remove(self, sid: str) -> Optional[dict]:
+        entry = running.waiting_players.get(sid)
+        if entry is not None:
+            self.claim(sid, entry)
+
+        return entry
+
+    def claim(self, sid: str, entry: dict) -> bool:
+        """Take a player of this worker out of the queue, False if another worker got them first"""
+        running.waiting_players.pop(sid, None)
+        return self.backend.remove_waiting(sid, entry)
+
+    def forget(self, sid: str) -> None:
+        """Another worker claimed this player"""
+        running.waiting_players.pop(sid, None)
+
+    @staticmethod
+    def waited_steps(entry: dict, now: float) -> int:
+        # The small tolerance keeps float rounding from missing a step exactly at its deadline
+        return int((now - entry['join_time']) / MatchConfig.WIDEN_INTERVAL + 1e-6)
+
+    @staticmethod
+    def allowed_difference(entry: dict, now: float) -> int:
+        return min(
+            MatchConfig.DIFF_INIT + MatchConfig.DIFF_INCREMENT * Matchmaker.waited_steps(entry, now),
+            MatchConfig.DIFF_MAX
+        )
+
+    def try_match(self, sid: str, entry: dict, now: float, queued: bool = False) -> bool:
+        """Look for the closest-level opponent, accepted if either side's window allows it"""
+        level = entry['level']
+        window = self.allowed_difference(entry, now)
+
+        levels = range(level - MatchConfig.DIFF_MAX, level + MatchConfig.DIFF_MAX + 1)
+        candidates = self.backend.oldest_waiting(entry['time_control'], levels, skip=sid)
+        if not candidates:
+            return False
+
+        for diff in range(MatchConfig.DIFF_MAX + 1):
+            for other_level in {level - diff, level + diff}:
+                candidate = candidates.get(other_level)
+                if candidate is None:
+                    continue
+
+                # The oldest player of a bucket has the widest window of that bucket
+                other_sid, other = candidate
+                if diff > window and diff > self.allowed_difference(other, now):
+                    continue
+
+                # Both sides may be claimed by another worker in the meantime
+                if not self.backend.remove_waiting(other_sid, other):
+                    continue
+
+                if queued and not self.claim(sid, entry):
+                    self.backend.add_waiting(other_sid, other)
+                    return True
+
+                running.waiting_players.pop(sid, None)
+                running.waiting_players.pop(other_sid, None)
+
+                if other.get('worker', self.backend.worker_id) != self.backend.worker_id:
+                    self.on_adopt(other_sid, other)
+
+                logger.info('Matched %s with %s, level difference %s', sid, other_sid, diff)
+                self.on_pair([sid, other_sid], entry['time_control'])
+                return True
+
+        return False
+
+    def schedule(self, sid: str, entry: dict, now: float) -> None:
+        """Queue the next moment the player's situation changes: a wider window or the bot fallback"""
+        join_time = entry['join_time']
+        when = join_time + MatchConfig.BOT_WAIT_TIME
+
+        steps = -(-(MatchConfig.DIFF_MAX - MatchConfig.DIFF_INIT) // MatchConfig.DIFF_INCREMENT)
+        waited_steps = self.waited_steps(entry, now)
+        if waited_steps < steps:
+            when = min(when, join_time + (waited_steps + 1) * MatchConfig.WIDEN_INTERVAL)
+
+        heapq.heappush(self.deadlines, (when, next(self.seq), sid, entry))
+
+    def next_deadline(self) -> Optional[float]:
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def sleep_time(self) -> float:
+        """How long the matching loop may sleep without missing a deadline"""
+        next_deadline = self.next_deadline()
+        if next_deadline is None:
+            return MatchConfig.CHECK_INTERVAL
+
+        return max(0, min(next_deadline - time.time(), MatchConfig.CHECK_INTERVAL))
+
+    def process_due(self, now: float) -> None:
+        """Handle every deadline that has passed"""
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, sid, entry = heapq.heappop(self.deadlines)
+
+            # Matched, disconnected or re-queued since this deadline was set
+            if running.waiting_players.get(sid) is not entry:
+                continue
+
+            # One failed pairing must not stop the tick for the other waiting players
+            try:
+                self.handle_due(sid, entry, now)
+            except Exception:
+                logger.exception('Failed to match %s', sid)
+
+    def handle_due(self, sid: str, entry: dict, now: float) -> None:
+        if self.try_match(sid, entry, now, queued=True):
+            return
+
+        if now >= entry['join_time'] + MatchConfig.BOT_WAIT_TIME:
+            if not self.claim(sid, entry):
+                return
+
+            logger.info('%s waited %.1fs, matching with a bot', sid, now - entry['join_time'])
+            self.on_bot(sid, entry['time_control'])
+            return
+
+        self.schedule(sid, entry, now)
@@ -0,0 +1,214 @@
+"""
+Metrics in the Prometheus text exposition format, served at /metrics
+
+Recording is a bisect and a few attribute updates, with no lock: request handlers and background tasks
+share one thread under eventlet. Metrics recorded from native threads (Mongo calls, engine checkouts)
+may, rarely, lose an increment to a concurrent one, which is fine for monitoring.
+Values that already live elsewhere (game counts, queue depths) are read by a callback at scrape time.
+"""
+import functools
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds, from sub-millisecond handlers up to long engine searches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: List['Metric'] = []
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        registry.append(self)
+
+    def labels(self, *values: str):
+        """The child for these label values, keep it around on hot paths to skip the lookup"""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+
+        return child
+
+    @abstractmethod
+    def new_child(self):
+        ...
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def all_children(self) -> List[Tuple[Tuple[str, ...], object]]:
+        # A metric without labels is reported as zero before its first update
+        if not self.labelnames:
+            self.labels()
+
+        return list(self.children.items())
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    """
+    A value that only goes up
+    With `read`, the value is taken from an existing counter at scrape time: a number, or a dict by label values
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), read: Callable = None):
+        super().__init__(name, documentation, labelnames)
+        self.read = read
+
+    def new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        if self.read is None:
+            return {labels: child.value for labels, child in self.all_children()}
+
+        value = self.read()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_label_text(self.labelnames, labels)} {_number(value)}'
+                for labels, value in self.values().items()]
+
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+    kind = 'gauge'
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Observes the time spent in a `with` block"""
+    __slots__ = ('buckets', 'start')
+
+    def __init__(self, buckets: _Buckets):
+        self.buckets = buckets
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.buckets.observe(time.perf_counter() - self.start)
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, cumulated only when scraped"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def new_child(self) -> _Buckets:
+        return _Buckets(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self.labels())
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, child in self.all_children():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}')
+
+            lines.append(f'{self.name}_sum{_label_text(self.labelnames, labels)} {_number(child.sum)}')
+            lines.append(f'{self.name}_count{_label_text(self.labelnames, labels)} {child.count}')
+
+        return lines
+
+
+def timed(buckets: _Buckets):
+    """Decorator observing the duration of every call"""
+
+    def decorator(function: Callable):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                buckets.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+# Metrics recorded across modules, the rest are declared next to what they measure
+
+handler_seconds = Histogram('ichess_handler_seconds', 'Socket.IO event handler latency', ['event'])
+mongo_seconds = Histogram('ichess_mongo_seconds', 'MongoDB call latency', ['operation'])
+engine_checkout_seconds = Histogram('ichess_engine_checkout_seconds', 'Wait for an engine from the Stockfish pool')
+engine_search_seconds = Histogram('ichess_engine_search_seconds', 'Engine search time of bot moves')
@@ -0,0 +1,106 @@
+import os
+import random
+from typing import Optional
+
+import chess
+import chess.polyglot
+
+from cache import LRUCache
+from share import get_logger
+
+logger = get_logger(__name__)
+
+
+class MoveSourceConfig:
+    BOOK_PATH = os.environ.get('ICHESS_BOOK', './books/book.bin')  # Polyglot opening book
+    BOOK_MIN_LEVEL = 5          # Weaker bots leave theory from the first move
+    CACHE_SIZE = 100_000        # Cached positions, per (position, skill level)
+    MAX_CANDIDATES = 4          # Distinct engine moves remembered per cached position
+    REFRESH_PROBABILITY = 0.25  # Chance a cache hit still asks the engine, to collect more candidates
+
+
+class MoveSource:
+    """
+    Moves a bot can play without a full engine search
+    - A memory-mapped Polyglot opening book
+    - An LRU cache keyed by (position hash, skill level), picking at random among the engine moves seen there
+    """
+
+    def __init__(self, book_path: str, cache_size: int):
+        self.book_path = book_path
+        self.book = None
+        self.book_checked = False
+
+        self.cache = LRUCache(cache_size)  # (position hash, level) -> candidate moves
+
+        # Metrics
+        self.book_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.engine_searches = 0
+        self.engine_seconds = 0.0
+
+    def open_book(self) -> Optional[chess.polyglot.MemoryMappedReader]:
+        if not self.book_checked:
+            self.book_checked = True
+
+            if os.path.exists(self.book_path):
+                self.book = chess.polyglot.open_reader(self.book_path)
+                logger.info('Opened opening book %s', self.book_path)
+            else:
+                logger.info('No opening book at %s, bots search from the first move', self.book_path)
+
+        return self.book
+
+    def lookup(self, board: chess.Board, level: int) -> Optional[chess.Move]:
+        """A book or cached move for the position, None if the engine has to search"""
+        book = self.open_book() if level >= MoveSourceConfig.BOOK_MIN_LEVEL else None
+        if book is not None:
+            try:
+                move = book.weighted_choice(board).move
+                if board.is_legal(move):
+                    self.book_hits += 1
+                    return move
+            except IndexError:
+                pass
+
+        key = (chess.polyglot.zobrist_hash(board), level)
+        candidates = self.cache.get(key)
+
+        if candidates and random.random() >= MoveSourceConfig.REFRESH_PROBABILITY:
+            self.cache_hits += 1
+            return random.choice(candidates)
+
+        self.misses += 1
+        return None
+
+    def store(self, board: chess.Board, level: int, move: chess.Move, seconds: float) -> None:
+        """Remember an engine move, with the time the search took"""
+        self.engine_searches += 1
+        self.engine_seconds += seconds
+
+        key = (chess.polyglot.zobrist_hash(board), level)
+        candidates = self.cache.get(key)
+
+        if candidates is None:
+            self.cache.put(key, [move])
+
+        elif move not in candidates and len(candidates) < MoveSourceConfig.MAX_CANDIDATES:
+            candidates.append(move)
+
+    def stats(self) -> dict:
+        lookups = self.book_hits + self.cache_hits + self.misses
+        hits = self.book_hits + self.cache_hits
+        average_search = self.engine_seconds / self.engine_searches if self.engine_searches else 0.0
+
+        return {
+            'book_hits': self.book_hits,
+            'cache_hits': self.cache_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'cached_positions': len(self.cache),
+            'saved_engine_seconds': hits * average_search,
+        }
+
+
+move_source = MoveSource(MoveSourceConfig.BOOK_PATH, MoveSourceConfig.CACHE_SIZE)
@@ -1,9 +1,10 @@
 from typing import Any, Dict, Optional, Tuple
 
-from flask_socketio import send
-
+from bot_profiles import bot_profile_of, is_bot
+from cache import LRUCache
 from dbc import load, upsert
-from share import get_logger
+from share import get_logger, running, send_message
+from write_behind import rating_writes
 
 # Constants definition
 DEFAULT_ELO = 1500
@@ -15,46 +16,72 @@ ELO_K_FACTOR = 30
 PlayerData = Dict[str, Any]
 JoinInfo = Tuple[str, str]
 
+
+class PlayerCacheConfig:
+    JOIN_SIZE = 100_000      # Logged-in sessions, entries leave on disconnect
+    PROFILE_SIZE = 50_000    # Loaded profiles, kept a while after disconnect for reconnects
+    PROFILE_TTL = 30 * 60    # Seconds
+
+
 # Cache
-join_cache: Dict[str, JoinInfo] = {}
-player_cache: Dict[str, PlayerData] = {}
+join_cache = LRUCache(PlayerCacheConfig.JOIN_SIZE)  # sid -> JoinInfo
+player_cache = LRUCache(PlayerCacheConfig.PROFILE_SIZE, ttl=PlayerCacheConfig.PROFILE_TTL)  # pid -> PlayerData
 
 logger = get_logger(__name__)
 
 
-def join(sid: str, pid: str, name: str) -> None:
-    join_cache[sid] = (pid, name)
+def join(sid: str, pid: str, name: str, profile: PlayerData = None) -> None:
+    join_cache.put(sid, (pid, name))
+    running.bind_pid(sid, pid)
+
+    # Handed over by another worker, at least as fresh as the stored document
+    if profile is not None:
+        player_cache.put(pid, profile)
+
+
+def forget(sid: str) -> None:
+    """Evict a session, the profile stays cached for a reconnect"""
+    join_cache.pop(sid)
 
 
 def pid_of(sid: str) -> Optional[str]:
-    if sid not in join_cache:
-        logger.error(f'Player {sid} not logged in')
+    join_info = join_cache.get(sid)
+    if join_info is None:
+        logger.error('Player %s not logged in', sid)
         return None
-    
-    return join_cache[sid][0]
+
+    return join_info[0]
 
 
 def name_of(sid: str) -> str:
-    return join_cache[sid][1]
+    return join_cache.get(sid)[1]
 
 
 def player_of(sid: str) -> Dict[str, Any]:
-
-    if sid in player_cache:
-        return player_cache[sid]
+    # Bots are in-memory roster profiles, they never touch the database
+    if is_bot(sid):
+        return bot_profile_of(sid)
 
     pid = pid_of(sid)
     if not pid:
-        send('Please login first!')
+        send_message([sid], 'Please login first!')
         return None
 
+    player = player_cache.get(pid)
+    if player is not None:
+        return player
+
     player = load(pid)
 
+    if player is not None:
+        # Rating changes still queued for writing are newer than the stored document
+        player.update(rating_writes.pending_of(pid))
+
     if player is None:
         player = {'pid': pid, 'elo': DEFAULT_ELO, 'name': name_of(sid)}
         upsert(player)
 
-    player_cache[sid] = player
+    player_cache.put(pid, player)
 
     return player
 
@@ -71,15 +98,26 @@ def update_elo_after_game(player_sid: str, opponent_sid: str, result: float) ->
         logger.error("Cannot update ELO: player not found")
         return
         
-    player['elo'] = calc_elo(player['elo'], opponent['elo'], result)
-    opponent['elo'] = calc_elo(opponent['elo'], player['elo'], 1 - result)
+    player_elo, opponent_elo = player['elo'], opponent['elo']
 
-    update_elo(player)
-    update_elo(opponent)
+    # Bots keep their calibrated rating, only the human side changes
+    if not is_bot(player_sid):
+        player['elo'] = calc_elo(player_elo, opponent_elo, result)
+        update_elo(player)
+
+    if not is_bot(opponent_sid):
+        opponent['elo'] = calc_elo(opponent_elo, player_elo, 1 - result)
+        update_elo(opponent)
 
 
 def update_elo(player: Dict[str, Any]) -> bool:
-    return upsert({'pid': player['pid'], 'elo': player['elo']})
+    # Written behind, in batches, by the background flush loop
+    rating_writes.put({'pid': player['pid'], 'elo': player['elo']})
+    return True
+
+
+def cache_stats() -> dict:
+    return {'join': join_cache.stats(), 'profile': player_cache.stats()}
 
 
 def calc_elo(player_elo: int, opponent_elo: int, result: float, K: int = ELO_K_FACTOR) -> int:
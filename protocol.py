@@ -0,0 +1,95 @@
+"""
+Game wire protocol
+
+Version 1 (legacy) sends a `move` to the opponent, a `timer` to each player and a `go` to the side to move.
+Version 2 (compact) sends one `ply` event to both players per move:
+    {'v': 2, 'u': 'e2e4', 'n': 1, 'w': 299500, 'b': 300000, 't': 'b'}
+    u: the move in UCI, n: ply number after the move, w/b: clocks in milliseconds, t: side to move
+A full `sync` (the same fields plus 'fen', without 'u') is sent at game start, after a takeback,
+when the client asks for it with a `sync` event, and when a move carries an unexpected ply number.
+Version 2 clients that join with 'binary': true get MessagePack-encoded binary frames instead of JSON.
+"""
+from typing import Dict, Iterable, Tuple
+
+from share import send_command, send_room_command
+
+try:
+    import msgpack
+except ImportError:  # Optional, binary frames are simply not offered without it
+    msgpack = None
+
+LEGACY = 1
+COMPACT = 2
+
+# sid -> (protocol version, binary frames)
+clients: Dict[str, Tuple[int, bool]] = {}
+
+
+def register_client(sid: str, data: dict) -> None:
+    version = COMPACT if data.get('protocol') == COMPACT else LEGACY
+    binary = version == COMPACT and bool(data.get('binary')) and msgpack is not None
+    clients[sid] = (version, binary)
+
+
+def client_info(sid: str) -> dict:
+    """What register_client needs to recreate the client on another worker"""
+    version, binary = clients.get(sid, (LEGACY, False))
+    return {'protocol': version, 'binary': binary}
+
+
+def forget_client(sid: str) -> None:
+    clients.pop(sid, None)
+
+
+def is_legacy(sid: str) -> bool:
+    return clients.get(sid, (LEGACY, False))[0] == LEGACY
+
+
+def protocol_room(room: str, sid: str) -> str:
+    version, binary = clients.get(sid, (LEGACY, False))
+    if version == LEGACY:
+        return f'{room}/v1'
+
+    return f'{room}/v2b' if binary else f'{room}/v2'
+
+
+def legacy_room(room: str) -> str:
+    return f'{room}/v1'
+
+
+def clock_fields(game) -> dict:
+    return {
+        'v': COMPACT,
+        'n': len(game.board.move_stack),
+        'w': int(game.player_times[0] * 1000),
+        'b': int(game.player_times[1] * 1000),
+        't': 'w' if game.current_player_index == 0 else 'b',
+    }
+
+
+def ply_payload(game, move: str) -> dict:
+    payload = clock_fields(game)
+    payload['u'] = move
+    return payload
+
+
+def sync_payload(game) -> dict:
+    payload = clock_fields(game)
+    payload['fen'] = game.board.fen()
+    return payload
+
+
+def broadcast(rooms: Iterable[str], event: str, payload: dict) -> None:
+    """Send to the compact protocol rooms among `rooms`, encoding once per format"""
+    for room in rooms:
+        if room.endswith('/v2'):
+            send_room_command(room, event, payload)
+        elif room.endswith('/v2b'):
+            send_room_command(room, event, msgpack.packb(payload))
+
+
+def send_to(sid: str, event: str, payload: dict) -> None:
+    if clients.get(sid, (LEGACY, False))[1]:
+        payload = msgpack.packb(payload)
+
+    send_command([sid], event, payload)
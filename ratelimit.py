@@ -0,0 +1,130 @@
+"""
+Per-client rate limiting of Socket.IO events
+
+Every client has a token bucket per event, keyed by pid once logged in, so reconnecting doesn't refill it.
+An event without a token is dropped before its handler runs, in constant time and without a reply.
+A client that keeps sending past its limits is disconnected.
+"""
+import functools
+import time
+from typing import Callable, Dict
+
+from flask import request
+
+from cache import LRUCache
+from metrics import Counter
+from share import disconnect, get_logger, running
+
+logger = get_logger(__name__)
+
+
+class RateLimitConfig:
+    ENABLED = True
+    DEFAULT = (10.0, 20)    # (tokens per second, burst) of events without a limit of their own
+    EVENTS = {
+        'join': (0.5, 3),
+        'match': (1.0, 3),
+        'move': (5.0, 10),
+        'sync': (2.0, 5),
+        'propose_draw': (0.1, 2),
+        'draw_response': (1.0, 3),
+        'propose_takeback': (0.1, 2),
+        'takeback_response': (1.0, 3),
+        'resign': (1.0, 3),
+        'watch': (1.0, 5),
+        'unwatch': (1.0, 5),
+        'message': (1.0, 5),
+    }
+    DISCONNECT_DROPS = 50   # Dropped events within DROP_WINDOW that get a client disconnected
+    DROP_WINDOW = 10.0      # Seconds
+    MAX_CLIENTS = 200_000   # Clients whose buckets are remembered, the least recently active are forgotten
+
+
+throttled_events = Counter('ichess_throttled_events_total', 'Socket.IO events dropped by the rate limiter', ['event'])
+throttle_disconnects = Counter('ichess_throttle_disconnects_total', 'Clients disconnected for exceeding rate limits')
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class ClientLimits:
+    __slots__ = ('buckets', 'window_start', 'window_drops')
+
+    def __init__(self):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.window_start = 0.0
+        self.window_drops = 0
+
+
+class RateLimiter:
+    def __init__(self):
+        self.clients = LRUCache(RateLimitConfig.MAX_CLIENTS)  # pid, or sid before login -> ClientLimits
+
+    def allow(self, sid: str, event: str, now: float) -> bool:
+        key = running.pid_of_sid.get(sid, sid)
+
+        client = self.clients.get(key)
+        if client is None:
+            client = ClientLimits()
+            self.clients.put(key, client)
+
+        bucket = client.buckets.get(event)
+        if bucket is None:
+            rate, burst = RateLimitConfig.EVENTS.get(event, RateLimitConfig.DEFAULT)
+            bucket = client.buckets[event] = TokenBucket(rate, burst, now)
+
+        if bucket.take(now):
+            return True
+
+        self.dropped(sid, key, client, now)
+        return False
+
+    @staticmethod
+    def dropped(sid: str, key: str, client: ClientLimits, now: float) -> None:
+        if now - client.window_start > RateLimitConfig.DROP_WINDOW:
+            client.window_start, client.window_drops = now, 0
+
+        client.window_drops += 1
+        if client.window_drops == RateLimitConfig.DISCONNECT_DROPS:
+            logger.warning('Disconnecting %s (%s), %s events dropped within %ss',
+                           sid, key, client.window_drops, RateLimitConfig.DROP_WINDOW)
+            throttle_disconnects.inc()
+            disconnect(sid)
+
+
+limiter = RateLimiter()
+
+
+def limited(event: str):
+    """Drop the event when the sender is over its rate limit for it, place right under @socketio.on"""
+    dropped = throttled_events.labels(event)
+
+    def decorator(handler: Callable):
+        @functools.wraps(handler)
+        def on_event(*args):
+            if RateLimitConfig.ENABLED and not limiter.allow(request.sid, event, time.monotonic()):
+                dropped.inc()
+                return None
+
+            return handler(*args)
+
+        return on_event
+
+    return decorator
@@ -0,0 +1,58 @@
+import random
+from typing import Tuple
+
+import chess.engine
+
+
+class SearchBudgetConfig:
+    # (highest level, limit), the first row whose level bound is reached applies
+    LEVEL_LIMITS = [
+        (4, {'depth': 4}),
+        (8, {'nodes': 20_000}),
+        (12, {'nodes': 100_000}),
+        (16, {'time': 0.3}),
+        (20, {'time': 1.0}),
+    ]
+
+    MOVES_TO_GO = 30        # Moves the remaining clock is assumed to be shared across
+    INCREMENT_SHARE = 0.8   # Share of the increment a single move may use
+    MIN_TIME = 0.05         # Lower bound of the per-move time cap (seconds)
+
+    HUMAN_DELAY = True          # Pad fast searches up to a human-looking thinking time
+    HUMAN_DELAY_RANGE = (0.5, 2.5)  # Thinking time range before the clock cap (seconds)
+
+
+def clock_share(remaining: float, increment: float) -> float:
+    """The time one move may take without endangering the clock"""
+    share = remaining / SearchBudgetConfig.MOVES_TO_GO + increment * SearchBudgetConfig.INCREMENT_SHARE
+    return max(SearchBudgetConfig.MIN_TIME, share)
+
+
+def limit_for(level: int, remaining: float, increment: float) -> chess.engine.Limit:
+    """Engine limit for the level, never using more than the clock allows"""
+    limit = SearchBudgetConfig.LEVEL_LIMITS[-1][1]
+    for max_level, level_limit in SearchBudgetConfig.LEVEL_LIMITS:
+        if level <= max_level:
+            limit = level_limit
+            break
+
+    # Node and depth limits get the clock share as a time cap too, the first one reached stops the search
+    time_cap = clock_share(remaining, increment)
+    return chess.engine.Limit(
+        time=min(limit.get('time', time_cap), time_cap),
+        nodes=limit.get('nodes'),
+        depth=limit.get('depth'),
+    )
+
+
+def thinking_delay(remaining: float, increment: float) -> float:
+    """How long the bot should appear to think, the move is held back without holding an engine"""
+    if not SearchBudgetConfig.HUMAN_DELAY:
+        return 0.0
+
+    low, high = SearchBudgetConfig.HUMAN_DELAY_RANGE
+    return min(random.uniform(low, high), clock_share(remaining, increment))
+
+
+def budget_for(level: int, remaining: float, increment: float) -> Tuple[chess.engine.Limit, float]:
+    return limit_for(level, remaining, increment), thinking_delay(remaining, increment)
@@ -1,75 +1,295 @@
+import atexit
+import bisect
+import json
 import logging
+import os
 import platform
-import threading
-from logging.handlers import TimedRotatingFileHandler
-from typing import Dict, List
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 from flask import Flask
-from flask_socketio import SocketIO, emit, send
+from flask_socketio import SocketIO
+
+if TYPE_CHECKING:
+    from game import Game
+
+# Placeholder sid of a player seated in a restored game before they reconnect, followed by the pid
+AWAY_PREFIX = 'away:'
+
+
+def away_pid(sid: str) -> Optional[str]:
+    return sid[len(AWAY_PREFIX):] if sid.startswith(AWAY_PREFIX) else None
+
+
+def rating_key(game: 'Game') -> Tuple[int, str]:
+    # Highest average rating at the start first
+    (_, white_elo), (_, black_elo) = game.start_ratings
+    return -((white_elo + black_elo) // 2), game.game_id
 
 
 class running:
-    online_players: List[str] = []
-    waiting_players: Dict[str, str] = {}
-    games = []
+    online_players: Set[str] = set()
+    waiting_players: Dict[str, dict] = {}
+    games = set()
     socketio: SocketIO = None
 
+    # Indexes kept in step with the collections above, so lookups stay O(1)
+    game_of_sid: Dict[str, 'Game'] = {}
+    game_of_id: Dict[str, 'Game'] = {}
+    sid_of_pid: Dict[str, str] = {}
+    pid_of_sid: Dict[str, str] = {}
+    away_game_of_pid: Dict[str, 'Game'] = {}  # Games holding the seat of a player who dropped out or was restored
+    games_by_rating: List[Tuple[int, str]] = []  # rating_key() of the rated games, sorted
+    unrated_games: Set['Game'] = set()           # Restored games, their ratings are loaded when first listed
+
+    @classmethod
+    def add_game(cls, game: 'Game') -> None:
+        cls.games.add(game)
+        cls.game_of_id[game.game_id] = game
+        if game.start_ratings is None:
+            cls.unrated_games.add(game)
+        else:
+            cls.rank_game(game)
+        for sid in (game.player1, game.player2):
+            cls.game_of_sid[sid] = game
+            if away_pid(sid):
+                cls.away_game_of_pid[away_pid(sid)] = game
+
+    @classmethod
+    def remove_game(cls, game: 'Game') -> None:
+        cls.games.discard(game)
+        cls.game_of_id.pop(game.game_id, None)
+        if game in cls.unrated_games:
+            cls.unrated_games.discard(game)
+        else:
+            key = rating_key(game)
+            index = bisect.bisect_left(cls.games_by_rating, key)
+            if index < len(cls.games_by_rating) and cls.games_by_rating[index] == key:
+                del cls.games_by_rating[index]
+        for sid in (game.player1, game.player2):
+            if cls.game_of_sid.get(sid) is game:
+                del cls.game_of_sid[sid]
+            if away_pid(sid) and cls.away_game_of_pid.get(away_pid(sid)) is game:
+                del cls.away_game_of_pid[away_pid(sid)]
+
+    @classmethod
+    def rank_game(cls, game: 'Game') -> None:
+        """Index a game by rating, once its start ratings are known"""
+        cls.unrated_games.discard(game)
+        bisect.insort(cls.games_by_rating, rating_key(game))
+
+    @classmethod
+    def replace_sid(cls, game: 'Game', old_sid: str, new_sid: str) -> None:
+        """A player took over the seat of `old_sid` in the game"""
+        if cls.game_of_sid.get(old_sid) is game:
+            del cls.game_of_sid[old_sid]
+        cls.game_of_sid[new_sid] = game
+
+        if away_pid(old_sid) and cls.away_game_of_pid.get(away_pid(old_sid)) is game:
+            del cls.away_game_of_pid[away_pid(old_sid)]
+        if away_pid(new_sid):
+            cls.away_game_of_pid[away_pid(new_sid)] = game
+
+    @classmethod
+    def find_game(cls, sid: str) -> Optional['Game']:
+        return cls.game_of_sid.get(sid)
+
+    @classmethod
+    def bind_pid(cls, sid: str, pid: str) -> None:
+        old_pid = cls.pid_of_sid.get(sid)
+        if old_pid is not None and old_pid != pid and cls.sid_of_pid.get(old_pid) == sid:
+            del cls.sid_of_pid[old_pid]
+
+        cls.pid_of_sid[sid] = pid
+        cls.sid_of_pid[pid] = sid
+
+    @classmethod
+    def unbind_sid(cls, sid: str) -> None:
+        pid = cls.pid_of_sid.pop(sid, None)
+        if pid is not None and cls.sid_of_pid.get(pid) == sid:
+            del cls.sid_of_pid[pid]
 
-def create_socketio(app: Flask):
+
+def create_socketio(app: Flask, message_queue: str = None):
+    # With a message queue, emits and room changes reach clients connected to the other workers
     if running.socketio is None:
-        running.socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins='*')
+        running.socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins='*', message_queue=message_queue)
 
     return running.socketio
 
 
-def send_message(sids: List[str], message: str):
-    thread_name = threading.current_thread().name
+# The server-level API works from request handlers, background tasks and worker greenlets alike.
+# Bots, and the seats of players who haven't come back to a restored game, have no connection,
+# they are skipped here and never enter a room.
 
-    # message privately everyone on the list
-    if thread_name.startswith('timer_task') or thread_name == 'match_players':
-        for sid in sids:
-            if sid.startswith('bot_'):
-                continue
-            running.socketio.send(message, to=sid)
+def has_connection(sid: str) -> bool:
+    return not sid.startswith(('bot_', AWAY_PREFIX))
 
-    else:
-        for sid in sids:
-            if sid.startswith('bot_'):
-                continue
-            send(message, to=sid)
+
+def send_message(sids: List[str], message: str):
+    # message privately everyone on the list
+    for sid in sids:
+        if not has_connection(sid):
+            continue
+        running.socketio.send(message, to=sid)
 
 
 def send_command(sids: List[str], event: str, data: dict):
-    thread_name = threading.current_thread().name
+    for sid in sids:
+        if not has_connection(sid):
+            continue
+        running.socketio.emit(event, data, to=sid)
 
-    if thread_name.startswith('timer_task') or thread_name == 'match_players':
-        for sid in sids:
-            if sid.startswith('bot_'):
-                continue
-            running.socketio.emit(event, data, to=sid)
 
-    else:
-        for sid in sids:
-            if sid.startswith('bot_'):
-                continue
-            emit(event, data, to=sid)
+def send_room_message(room: str, message: str, skip_sid: str = None):
+    # One serialization for every member of the room
+    running.socketio.send(message, to=room, skip_sid=skip_sid)
+
+
+def send_room_command(room: str, event: str, data: dict, skip_sid: str = None):
+    running.socketio.emit(event, data, to=room, skip_sid=skip_sid)
+
+
+def enter_room(sid: str, room: str):
+    if has_connection(sid):
+        running.socketio.server.enter_room(sid, room, namespace='/')
+
+
+def leave_room(sid: str, room: str):
+    if has_connection(sid):
+        running.socketio.server.leave_room(sid, room, namespace='/')
+
+
+def disconnect(sid: str):
+    if has_connection(sid):
+        running.socketio.server.disconnect(sid, namespace='/')
 
 
-def get_logger(mod_name) -> logging.Logger:
+def close_room(room: str):
+    running.socketio.server.close_room(room, namespace='/')
+
+
+def _parse_log_settings(value: str) -> Dict[str, str]:
+    # 'game.move=WARNING,app.events=0.1' -> {'game.move': 'WARNING', 'app.events': '0.1'}
+    settings = {}
+    for item in filter(None, value.split(',')):
+        name, _, setting = item.partition('=')
+        settings[name.strip()] = setting.strip()
+
+    return settings
+
+
+class LogConfig:
+    DIRECTORY = os.environ.get('ICHESS_LOG_DIR', './logs')
+    LEVEL = os.environ.get('ICHESS_LOG_LEVEL', 'INFO')
+    CATEGORY_LEVELS = _parse_log_settings(os.environ.get('ICHESS_LOG_LEVELS', ''))      # e.g. 'game.move=WARNING'
+    CATEGORY_SAMPLING = _parse_log_settings(os.environ.get('ICHESS_LOG_SAMPLING', ''))  # e.g. 'app.move=0.01'
+    JSON = os.environ.get('ICHESS_LOG_JSON') == '1'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets one record in every 1/rate through"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.every:
+            return False
+
+        self.count += 1
+        return self.count % self.every == 0
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The message is formatted by the writer thread, the caller only pays for the enqueue
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class _ModuleFileHandler(logging.Handler):
+    """Routes records to one daily-rotated file per module, runs on the writer thread"""
+
+    def __init__(self):
+        super().__init__()
+        self.files: Dict[str, logging.Handler] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        mod_name = record.name.split('.')[0]
+
+        handler = self.files.get(mod_name)
+        if handler is None:
+            handler = TimedRotatingFileHandler(f'{LogConfig.DIRECTORY}/{mod_name}.log',
+                                               when='midnight', interval=1, backupCount=7)
+            handler.suffix = '%Y-%m-%d'
+            handler.setFormatter(JsonFormatter() if LogConfig.JSON
+                                 else logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+            self.files[mod_name] = handler
+
+        handler.handle(record)
+
+
+_log_queue = queue.SimpleQueue()
+_log_listener: Optional[QueueListener] = None
+
+
+def _start_log_listener() -> None:
+    global _log_listener
+
+    os.makedirs(LogConfig.DIRECTORY, exist_ok=True)
+
+    _log_listener = QueueListener(_log_queue, _ModuleFileHandler())
+    _log_listener.start()
+
+    # Writes whatever is still queued before the process exits
+    atexit.register(_log_listener.stop)
+
+
+def get_logger(mod_name, category: str = None) -> logging.Logger:
+    """
+    Logger of a module, or of a category inside it (e.g. get_logger(__name__, 'move') -> 'game.move')
+    - Records are queued and written to ./logs/<module>.log by a background thread
+    - ICHESS_LOG_LEVELS and ICHESS_LOG_SAMPLING turn single categories down, e.g. per-move logs in production
+    - Use lazy arguments, logger.info('%s moved', sid), so disabled or sampled-out records are never formatted
+    """
     if mod_name == '__main__':
         mod_name = 'app'
 
-    logger = logging.getLogger(mod_name)
-    logger.setLevel(logging.INFO)
+    name = f'{mod_name}.{category}' if category else mod_name
+    logger = logging.getLogger(name)
+
+    if _log_listener is None:
+        _start_log_listener()
 
-    handler = TimedRotatingFileHandler(f'./logs/{mod_name}.log', when='midnight', interval=1, backupCount=7)
-    handler.suffix = '%Y-%m-%d'
-    handler.setLevel(logging.INFO)
+    logger.setLevel(LogConfig.CATEGORY_LEVELS.get(name, LogConfig.LEVEL))
 
-    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-    handler.setFormatter(formatter)
+    if name in LogConfig.CATEGORY_SAMPLING and not logger.filters:
+        logger.addFilter(SamplingFilter(float(LogConfig.CATEGORY_SAMPLING[name])))
 
-    logger.addHandler(handler)
+    if not logger.handlers:
+        logger.addHandler(_DeferredQueueHandler(_log_queue))
+        logger.propagate = False
 
     return logger
 
@@ -0,0 +1,212 @@
+"""
+Spectators of live games
+
+A spectator is not a player of the game: they enter its watch room and never appear in Game.players.
+- `watch` sends a one-shot snapshot of the position, the clocks and the players to the new spectator
+- Moves only mark the game as changed, a background loop sends one `watch_update` per changed game
+  and UPDATE_INTERVAL to its watch room, serialized once whatever the number of spectators
+- Every update is a full snapshot, so a spectator who misses some is right again with the next one
+- With several workers, each publishes its changed games to the shared game list every LIST_INTERVAL,
+  and a spectator watching a game of another worker is registered by that worker, see cluster.forward_watch()
+
+Events to spectators, clocks in milliseconds like the compact protocol:
+    watch         {'game_id', 'fen', 'n', 'w', 'b', 't', 'u', 'white': {'name', 'elo'}, 'black': {...}}
+    watch_update  {'game_id', 'fen', 'n', 'w', 'b', 't', 'u'}
+    watch_end     {'game_id', 'result', 'reason'}, also the answer to watching a game that doesn't exist
+"""
+import time
+from typing import TYPE_CHECKING, Dict, List, Set
+
+from protocol import sync_payload
+from share import close_room, enter_room, get_logger, leave_room, running, send_command, send_room_command
+from state_backend import state
+
+if TYPE_CHECKING:
+    from game import Game
+
+logger = get_logger(__name__)
+
+
+class SpectatorConfig:
+    UPDATE_INTERVAL = 0.5   # Longest wait of a move for the spectators (seconds), updates in between coalesce
+    LIST_LIMIT = 100        # Most games returned by the game list
+    LIST_INTERVAL = 5.0     # Seconds between two publications of the changed games to the shared game list
+
+
+def watch_room(game) -> str:
+    return f'{game.room}/watch'
+
+
+def update_payload(game) -> dict:
+    payload = sync_payload(game)
+    payload['game_id'] = game.game_id
+    payload['u'] = game.board.peek().uci() if game.board.move_stack else None
+    return payload
+
+
+class Spectators:
+    def __init__(self):
+        self.watchers: Dict[str, Set[str]] = {}  # game id -> spectator sids
+        self.watching: Dict[str, 'Game'] = {}    # spectator sid -> game
+        self.changed_games: Set['Game'] = set()
+        self.relisted_games: Set['Game'] = set()  # Changed since last published to the shared game list
+        self.listed_at = 0.0
+
+        # Metrics
+        self.updates = 0
+
+    def watch(self, sid: str, game) -> None:
+        if self.watching.get(sid) is game:
+            return
+
+        self.unwatch(sid)
+
+        self.watching[sid] = game
+        self.watchers.setdefault(game.game_id, set()).add(sid)
+        enter_room(sid, watch_room(game))
+
+        send_command([sid], 'watch', self.snapshot(game))
+        logger.info('%s is watching game %s', sid, game.game_id)
+
+    def unwatch(self, sid: str) -> None:
+        game = self.watching.pop(sid, None)
+        if game is None:
+            return
+
+        watchers = self.watchers.get(game.game_id)
+        if watchers is not None:
+            watchers.discard(sid)
+            if not watchers:
+                del self.watchers[game.game_id]
+
+        if not game.is_game_over:
+            leave_room(sid, watch_room(game))
+
+    def count(self, game) -> int:
+        return len(self.watchers.get(game.game_id, ()))
+
+    def changed(self, game) -> None:
+        """Called on every turn change, only touches memory"""
+        if game.game_id in self.watchers:
+            self.changed_games.add(game)
+
+        if state.shared:
+            self.relisted_games.add(game)
+
+    def game_over(self, game, result: str, reason: str) -> None:
+        self.changed_games.discard(game)
+
+        if state.shared:
+            self.relisted_games.discard(game)
+            state.unlist_game(game.game_id)
+
+        watchers = self.watchers.pop(game.game_id, None)
+        if watchers is None:
+            return
+
+        send_room_command(watch_room(game), 'watch_end', {'game_id': game.game_id, 'result': result, 'reason': reason})
+        close_room(watch_room(game))
+
+        for sid in watchers:
+            self.watching.pop(sid, None)
+
+    def snapshot(self, game) -> dict:
+        payload = update_payload(game)
+        (white, white_elo), (black, black_elo) = game.ratings()
+        payload['white'] = {'name': white, 'elo': white_elo}
+        payload['black'] = {'name': black, 'elo': black_elo}
+        return payload
+
+    def send_updates(self) -> None:
+        games, self.changed_games = self.changed_games, set()
+
+        for game in games:
+            if game.is_game_over:
+                continue
+
+            send_room_command(watch_room(game), 'watch_update', update_payload(game))
+            self.updates += 1
+
+    def publish_list(self) -> None:
+        """The games of this worker that changed since last time, to the game list shared with the other workers"""
+        self.rank_restored()
+
+        games, self.relisted_games = self.relisted_games, set()
+        state.list_games([self.summary(game) for game in games if not game.is_game_over])
+
+    def run(self) -> None:
+        while True:
+            running.socketio.sleep(SpectatorConfig.UPDATE_INTERVAL)
+            self.send_updates()
+
+            if state.shared and time.monotonic() - self.listed_at >= SpectatorConfig.LIST_INTERVAL:
+                self.publish_list()
+                self.listed_at = time.monotonic()
+
+    @staticmethod
+    def rank_restored() -> None:
+        # Restored games join the index once their players' ratings are loaded
+        for game in list(running.unrated_games):
+            game.ratings()
+            running.rank_game(game)
+
+    def live_games(self, limit: int = SpectatorConfig.LIST_LIMIT, bots: bool = None, min_elo: int = 0) -> List[dict]:
+        """
+        Games worth watching, highest rated first, bot games flagged
+        Walks the rating index of running games from the top, only the games returned are summarized,
+        with several workers the shared game list, as of its last publication for the games of other workers
+        """
+        if state.shared:
+            return self.shared_games(limit, bots, min_elo)
+
+        self.rank_restored()
+
+        games = []
+        for negative_elo, game_id in running.games_by_rating:
+            if len(games) >= limit or -negative_elo < min_elo:
+                break
+
+            game = running.game_of_id[game_id]
+            if game.is_game_over or (bots is not None and (game.bot_sid is not None) != bots):
+                continue
+
+            games.append(self.summary(game))
+
+        return games
+
+    def shared_games(self, limit: int, bots: bool, min_elo: int) -> List[dict]:
+        games = []
+        for summary in state.listed_games(min_elo, limit):
+            if len(games) >= limit:
+                break
+            if bots is not None and summary['bot'] != bots:
+                continue
+
+            # Games of this worker are summarized as they are now
+            game = running.game_of_id.get(summary['game_id'])
+            if game is not None:
+                if game.is_game_over:
+                    continue
+                summary = self.summary(game)
+            else:
+                del summary['worker']
+
+            games.append(summary)
+
+        return games
+
+    def summary(self, game) -> dict:
+        (white, white_elo), (black, black_elo) = game.ratings()
+        return {
+            'game_id': game.game_id,
+            'white': {'name': white, 'elo': white_elo},
+            'black': {'name': black, 'elo': black_elo},
+            'elo': (white_elo + black_elo) // 2,
+            'bot': game.bot_sid is not None,
+            'time_control': f'{game.total_time}+{game.step_increment_time}',
+            'plies': len(game.board.move_stack),
+            'spectators': self.count(game),
+        }
+
+
+spectators = Spectators()
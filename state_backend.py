@@ -0,0 +1,274 @@
+import json
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from share import get_logger
+
+logger = get_logger(__name__)
+
+Message = Dict[str, object]
+Waiting = Tuple[str, dict]  # (sid, waiting entry)
+
+
+class StateConfig:
+    # Unset: a single in-process worker. Set: the shared state and the Socket.IO message queue live in Redis
+    REDIS_URL = os.environ.get('ICHESS_REDIS_URL')
+    WORKER_ID = os.environ.get('ICHESS_WORKER_ID', str(os.getpid()))  # Stable ids let a restarted worker clean up
+    KEY_PREFIX = os.environ.get('ICHESS_REDIS_PREFIX', 'ichess')
+
+
+class InProcessBackend:
+    """
+    State of a single worker, kept in its own memory
+    - The waiting pool, indexed by time control and level, in join order
+    - Messages to a worker are delivered to this process' own listener
+    - Every game is hosted here, the game list reads running.games_by_rating directly
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.worker_id = 'local'
+
+        # time_control -> level -> {sid: entry}, dicts keep the sids in join order
+        self.buckets: Dict[int, Dict[int, Dict[str, dict]]] = {}
+        self.waiting = 0
+        self.online = 0
+        self.handler: Optional[Callable[[Message], None]] = None
+
+    def start(self) -> None:
+        pass
+
+    def bucket_of(self, time_control: int, level: int) -> Dict[str, dict]:
+        return self.buckets.setdefault(time_control, {}).setdefault(level, {})
+
+    def add_waiting(self, sid: str, entry: dict) -> None:
+        self.bucket_of(entry['time_control'], entry['level'])[sid] = entry
+        self.waiting += 1
+
+    def remove_waiting(self, sid: str, entry: dict) -> bool:
+        """Take a player out of the pool, False if they were no longer in it"""
+        if self.bucket_of(entry['time_control'], entry['level']).pop(sid, None) is None:
+            return False
+
+        self.waiting -= 1
+        return True
+
+    def oldest_waiting(self, time_control: int, levels: Iterable[int], skip: str) -> Dict[int, Waiting]:
+        """The longest waiting player of each level, other than `skip`"""
+        found = {}
+        for level in levels:
+            for sid, entry in self.buckets.get(time_control, {}).get(level, {}).items():
+                if sid != skip:
+                    found[level] = (sid, entry)
+                    break
+
+        return found
+
+    def waiting_count(self) -> int:
+        return self.waiting
+
+    def connected(self, delta: int) -> None:
+        self.online += delta
+
+    def online_count(self) -> int:
+        return self.online
+
+    def hold_seat(self, pid: str) -> None:
+        pass  # Every seat is held here, running.away_game_of_pid finds them
+
+    def free_seat(self, pid: str) -> None:
+        pass
+
+    def seat_holder(self, pid: str) -> Optional[str]:
+        return None
+
+    def list_games(self, summaries: List[dict]) -> None:
+        pass
+
+    def unlist_game(self, game_id: str) -> None:
+        pass
+
+    def listed_games(self, min_elo: int, chunk: int) -> Iterator[dict]:
+        return iter(())
+
+    def game_owner(self, game_id: str) -> Optional[str]:
+        return None
+
+    def publish(self, worker_id: str, message: Message) -> None:
+        if self.handler is not None:
+            self.handler(message)
+
+    def listen(self, handler: Callable[[Message], None]) -> None:
+        self.handler = handler
+
+
+class RedisBackend:
+    """
+    State shared by every worker through Redis
+    - {prefix}:waiting:{time_control}:{level}, sorted sets of sids scored by join time
+    - {prefix}:waiting, hash of sid -> entry, with the profile the owning worker needs to host the game
+    - {prefix}:online, hash of worker id -> connection count, so a restarted worker can reset its own count
+    - {prefix}:away, hash of pid -> worker id holding the seat of a player away from their game,
+      so a login on any worker finds it
+    - {prefix}:games, sorted set of the live game ids of every worker scored by average rating,
+      {prefix}:game_info, hash of game id -> summary with the hosting worker, for the game list and spectators
+    - {prefix}:worker:{id}, the pub/sub channel of each worker
+    Removing a sid from its sorted set is the atomic claim, only one worker gets a waiting player.
+    """
+
+    shared = True
+
+    def __init__(self, client, worker_id: str, prefix: str = 'ichess'):
+        self.redis = client
+        self.worker_id = worker_id
+        self.prefix = prefix
+        self.handler: Optional[Callable[[Message], None]] = None
+
+    def key(self, *parts) -> str:
+        return ':'.join([self.prefix, *map(str, parts)])
+
+    def start(self) -> None:
+        """Drop what a previous run of this worker left behind"""
+        stale = []
+        for sid, raw in self.redis.hscan_iter(self.key('waiting')):
+            entry = json.loads(raw)
+            if entry.get('worker') == self.worker_id:
+                stale.append((sid.decode(), entry))
+
+        for sid, entry in stale:
+            self.remove_waiting(sid, entry)
+
+        self.redis.hdel(self.key('online'), self.worker_id)
+
+        # The seats of the games the journal resumes are held again by restore_games()
+        held = [pid for pid, worker_id in self.redis.hscan_iter(self.key('away'))
+                if worker_id.decode() == self.worker_id]
+        if held:
+            self.redis.hdel(self.key('away'), *held)
+
+        # So are their places in the game list
+        for game_id, raw in self.redis.hscan_iter(self.key('game_info')):
+            if json.loads(raw)['worker'] == self.worker_id:
+                self.unlist_game(game_id.decode())
+
+        if stale:
+            logger.info('Removed %s stale waiting players of worker %s', len(stale), self.worker_id)
+
+    def add_waiting(self, sid: str, entry: dict) -> None:
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key('waiting'), sid, json.dumps({'worker': self.worker_id, **entry}))
+        pipe.zadd(self.key('waiting', entry['time_control'], entry['level']), {sid: entry['join_time']})
+        pipe.execute()
+
+    def remove_waiting(self, sid: str, entry: dict) -> bool:
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key('waiting', entry['time_control'], entry['level']), sid)
+        pipe.hdel(self.key('waiting'), sid)
+        removed, _ = pipe.execute()
+
+        return removed == 1
+
+    def oldest_waiting(self, time_control: int, levels: Iterable[int], skip: str) -> Dict[int, Waiting]:
+        levels = list(levels)
+
+        pipe = self.redis.pipeline()
+        for level in levels:
+            pipe.zrange(self.key('waiting', time_control, level), 0, 1)
+
+        oldest = {}
+        for level, sids in zip(levels, pipe.execute()):
+            sids = [sid.decode() for sid in sids if sid.decode() != skip]
+            if sids:
+                oldest[level] = sids[0]
+
+        if not oldest:
+            return {}
+
+        entries = self.redis.hmget(self.key('waiting'), list(oldest.values()))
+
+        # An entry can be claimed between the two reads, it is then left out
+        return {level: (sid, json.loads(raw)) for (level, sid), raw in zip(oldest.items(), entries) if raw}
+
+    def waiting_count(self) -> int:
+        return self.redis.hlen(self.key('waiting'))
+
+    def connected(self, delta: int) -> None:
+        self.redis.hincrby(self.key('online'), self.worker_id, delta)
+
+    def online_count(self) -> int:
+        return sum(int(count) for count in self.redis.hvals(self.key('online')))
+
+    def hold_seat(self, pid: str) -> None:
+        self.redis.hset(self.key('away'), pid, self.worker_id)
+
+    def free_seat(self, pid: str) -> None:
+        # Unless another worker holds it by now
+        if self.seat_holder(pid) == self.worker_id:
+            self.redis.hdel(self.key('away'), pid)
+
+    def seat_holder(self, pid: str) -> Optional[str]:
+        worker_id = self.redis.hget(self.key('away'), pid)
+        return worker_id.decode() if worker_id is not None else None
+
+    def list_games(self, summaries: List[dict]) -> None:
+        """Add or refresh games hosted here in the game list of every worker"""
+        pipe = self.redis.pipeline()
+        for summary in summaries:
+            pipe.zadd(self.key('games'), {summary['game_id']: summary['elo']})
+            pipe.hset(self.key('game_info'), summary['game_id'], json.dumps({**summary, 'worker': self.worker_id}))
+        pipe.execute()
+
+    def unlist_game(self, game_id: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key('games'), game_id)
+        pipe.hdel(self.key('game_info'), game_id)
+        pipe.execute()
+
+    def listed_games(self, min_elo: int, chunk: int) -> Iterator[dict]:
+        """Summaries of the listed games rated `min_elo` or more, highest rated first, read `chunk` at a time"""
+        start = 0
+        while True:
+            game_ids = self.redis.zrevrangebyscore(self.key('games'), '+inf', min_elo, start=start, num=chunk)
+            if not game_ids:
+                return
+
+            # A game can end between the two reads, it is then left out
+            for raw in self.redis.hmget(self.key('game_info'), game_ids):
+                if raw:
+                    yield json.loads(raw)
+
+            start += chunk
+
+    def game_owner(self, game_id: str) -> Optional[str]:
+        raw = self.redis.hget(self.key('game_info'), game_id)
+        return json.loads(raw)['worker'] if raw else None
+
+    def publish(self, worker_id: str, message: Message) -> None:
+        self.redis.publish(self.key('worker', worker_id), json.dumps(message))
+
+    def listen(self, handler: Callable[[Message], None]) -> None:
+        """Deliver the messages published to this worker, blocks, run it as a background task"""
+        self.handler = handler
+
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.key('worker', self.worker_id))
+
+        for message in pubsub.listen():
+            try:
+                handler(json.loads(message['data']))
+            except Exception:
+                logger.exception('Failed to handle worker message %s', message)
+
+
+def create_backend():
+    if not StateConfig.REDIS_URL:
+        return InProcessBackend()
+
+    import redis
+
+    logger.info('Worker %s sharing state through %s', StateConfig.WORKER_ID, StateConfig.REDIS_URL)
+    return RedisBackend(redis.Redis.from_url(StateConfig.REDIS_URL), StateConfig.WORKER_ID, StateConfig.KEY_PREFIX)
+
+
+state = create_backend()
@@ -1,29 +1,168 @@
 # for mac with apple silicon
+import os
 import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
 
 import chess
+import chess.engine
+from eventlet.semaphore import Semaphore
+
+from metrics import engine_checkout_seconds
+
+
+class EngineUnavailable(Exception):
+    pass
 
 
 class StockfishPool:
-    def __init__(self, path: str, max_size: int):
+    """
+    Fixed-size pool of Stockfish processes
+    - At most `size` engines exist, busy or idle, callers wait for one up to `checkout_timeout` seconds
+    - The wait happens in the caller's greenlet, see slot(), the native threads are shared by the whole server
+      (journal, rating writes, archive) and none of them is ever parked waiting for an engine
+    - Crashed engines are replaced on checkout or when returned as failed
+    - get_engine and return_engine are called from native worker threads, so plain threading primitives are fine there
+    - With `niceness`, the engine processes get a lower CPU scheduling priority than the server
+    """
+
+    def __init__(self, path: str, size: int, checkout_timeout: float = 10.0, niceness: int = 0):
         self.path = path
-        self.max_size = max_size
-        self.pool = []
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.niceness = niceness
+
+        self.pool: List[chess.engine.SimpleEngine] = []
+        self.skill_levels: Dict[chess.engine.SimpleEngine, int] = {}
+        self.busy = 0
+        self.waiting = 0  # Callers waiting for an engine
+        self.slots = Semaphore(size)  # One per engine, taken by a greenlet before its native thread checks one out
         self.lock = threading.Lock()
 
-    def get_engine(self, skill_level: int):
+        # Metrics
+        self.spawned = 0
+        self.replaced = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def start(self) -> None:
+        """Pre-spawn every engine, so the first bot games don't pay for process start-up"""
+        engines = [self.spawn() for _ in range(self.size - len(self.pool) - self.busy)]
+
+        with self.lock:
+            self.pool.extend(engines)
+
+    def spawn(self) -> chess.engine.SimpleEngine:
+        popen_args = {'preexec_fn': lambda: os.nice(self.niceness)} if self.niceness else {}
+        engine = chess.engine.SimpleEngine.popen_uci(self.path, **popen_args)
+
         with self.lock:
-            if self.pool:
-                engine = self.pool.pop()
-            else:
-                engine = chess.engine.SimpleEngine.popen_uci(self.path)
-            
-            engine.configure({"Skill Level": skill_level})
-            return engine
-
-    def return_engine(self, engine):
+            self.spawned += 1
+
+        return engine
+
+    @contextmanager
+    def slot(self):
+        """
+        An engine is free for the caller's search once in the block, waited for without blocking the event loop
+        Raises EngineUnavailable after `checkout_timeout` seconds
+        """
+        start = time.monotonic()
+
+        self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.checkout_timeout)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - start
+        self.checkouts += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        engine_checkout_seconds.observe(waited)
+
+        if not acquired:
+            self.timeouts += 1
+            raise EngineUnavailable(f'No engine available within {self.checkout_timeout}s')
+
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def get_engine(self, skill_level: int) -> chess.engine.SimpleEngine:
+        """Within a slot(), an engine is idle or there is room to spawn one, so this never waits"""
         with self.lock:
-            if len(self.pool) < self.max_size:
+            engine = self.pool.pop() if self.pool else None
+            self.busy += 1
+
+        try:
+            if engine is not None and not self.is_alive(engine):
+                self.discard(engine)
+                engine = None
+
+            if engine is None:
+                engine = self.spawn()
+
+            # Configuring costs a round trip to the engine, skip it when the level is unchanged
+            if self.skill_levels.get(engine) != skill_level:
+                engine.configure({"Skill Level": skill_level})
+                self.skill_levels[engine] = skill_level
+
+        except Exception:
+            with self.lock:
+                self.busy -= 1
+            raise
+
+        return engine
+
+    def return_engine(self, engine: chess.engine.SimpleEngine, failed: bool = False):
+        if failed or not self.is_alive(engine):
+            self.discard(engine)
+            engine = None
+
+        with self.lock:
+            self.busy -= 1
+            if engine is not None:
                 self.pool.append(engine)
-            else:
-                engine.quit()
+
+    @staticmethod
+    def is_alive(engine: chess.engine.SimpleEngine) -> bool:
+        # Resolved once the process has exited
+        return not engine.protocol.returncode.done()
+
+    def discard(self, engine: chess.engine.SimpleEngine) -> None:
+        self.skill_levels.pop(engine, None)
+
+        with self.lock:
+            self.replaced += 1
+
+        try:
+            engine.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'size': self.size,
+                'busy': self.busy,
+                'waiting': self.waiting,
+                'idle': len(self.pool),
+                'spawned': self.spawned,
+                'replaced': self.replaced,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            engines, self.pool = self.pool, []
+
+        for engine in engines:
+            engine.quit()
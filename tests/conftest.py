@@ -0,0 +1,107 @@
+"""
+Run from the repository root after installing requirements-dev.txt:
+
+    python -m pytest
+"""
+import json
+import os
+import sys
+from typing import List
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cluster  # noqa: E402
+from share import running  # noqa: E402
+from state_backend import RedisBackend  # noqa: E402
+
+
+class Inbox:
+    """The messages published to one worker, read without a listener loop"""
+
+    def __init__(self, backend: RedisBackend):
+        self.pubsub = backend.redis.pubsub()
+        self.pubsub.subscribe(backend.key('worker', backend.worker_id))
+
+    def read(self) -> List[dict]:
+        messages = []
+        while True:
+            message = self.pubsub.get_message(timeout=0.05)
+            if message is None:
+                return messages
+            if message['type'] == 'message':
+                messages.append(json.loads(message['data']))
+
+
+class NullServer:
+    def enter_room(self, *args, **kwargs):
+        pass
+
+    def leave_room(self, *args, **kwargs):
+        pass
+
+    def close_room(self, *args, **kwargs):
+        pass
+
+
+class NullSocketIO:
+    """Records what is sent instead of sending it, background tasks are not run"""
+
+    def __init__(self):
+        self.server = NullServer()
+        self.sent = []
+
+    def emit(self, event, data=None, to=None, **kwargs):
+        self.sent.append((to, event, data))
+
+    def send(self, message, to=None, **kwargs):
+        self.sent.append((to, 'message', message))
+
+    def start_background_task(self, *args, **kwargs):
+        pass
+
+    def sleep(self, *args):
+        pass
+
+
+@pytest.fixture
+def socketio(monkeypatch):
+    null = NullSocketIO()
+    monkeypatch.setattr(running, 'socketio', null)
+    return null
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+def make_backend(server, worker_id: str) -> RedisBackend:
+    return RedisBackend(fakeredis.FakeRedis(server=server), worker_id, prefix='test')
+
+
+@pytest.fixture
+def workers(redis_server):
+    """Two workers sharing one Redis"""
+    return make_backend(redis_server, 'w1'), make_backend(redis_server, 'w2')
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    yield
+
+    running.online_players.clear()
+    running.waiting_players.clear()
+    running.games.clear()
+    running.game_of_sid.clear()
+    running.game_of_id.clear()
+    running.games_by_rating.clear()
+    running.unrated_games.clear()
+    running.away_game_of_pid.clear()
+    running.sid_of_pid.clear()
+    running.pid_of_sid.clear()
+    cluster.owners.clear()
+    cluster.guests.clear()
+    cluster.watched_on.clear()
@@ -0,0 +1,118 @@
+import itertools
+import os
+
+import chess
+import pytest
+
+import archive
+from archive import GameArchive, parse_cursor
+
+_ids = itertools.count(1)
+
+
+def snapshot() -> dict:
+    return {
+        'game_id': f'game_{next(_ids)}', 'date': '2026.01.01', 'names': ['White', 'Black'], 'elos': [1500, 1500],
+        'result': '1/2-1/2', 'time_control': '300+2', 'termination': 'CONSENSUS',
+        'moves': [chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5')], 'clocks': [(299, 300), (299, 298)],
+    }
+
+
+def game_ids(games) -> list:
+    return [line.split('"')[1] for pgn in games for line in pgn.splitlines() if line.startswith('[GameId')]
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    """Archives of workers sharing the directory"""
+
+    def make(worker_id: str) -> GameArchive:
+        monkeypatch.setattr(archive.StateConfig, 'WORKER_ID', worker_id)
+        writer = GameArchive(str(tmp_path))
+        writer.current_segment()  # Named now, with this worker's id
+        return writer
+
+    return make
+
+
+def archived(writer: GameArchive, count: int) -> list:
+    games = [snapshot() for _ in range(count)]
+    assert writer.write(games)
+    return [game['game_id'] for game in games]
+
+
+def read_all(reader: GameArchive, cursor: str = None, limit: int = 3):
+    games = []
+    while True:
+        page, cursor = reader.page(cursor, limit)
+        if not page:
+            return games, cursor
+        games.extend(page)
+
+
+def test_pages_go_through_every_game_once(worker):
+    writer = worker('w1')
+    ids = archived(writer, 5) + archived(writer, 4)
+
+    games, cursor = read_all(writer)
+
+    assert game_ids(games) == ids
+    assert writer.page(cursor) == ([], cursor)
+
+
+def test_games_appended_to_another_workers_older_segment_are_exported(worker):
+    w1, w2 = worker('w1'), worker('w2')
+    first = archived(w1, 2) + archived(w2, 2)
+    assert w1.segment < w2.segment
+
+    games, cursor = read_all(w1)
+    assert sorted(game_ids(games)) == sorted(first)
+
+    # w1 keeps appending to its segment, which sorts before the one of w2
+    later = archived(w1, 2) + archived(w2, 1)
+    games, _ = read_all(w1, cursor)
+
+    assert sorted(game_ids(games)) == sorted(later)
+
+
+def test_resuming_inside_a_batch(worker):
+    writer = worker('w1')
+    ids = archived(writer, 5)
+
+    page, cursor = writer.page(None, 2)
+    segment, offset, skip = parse_cursor(cursor)['w1']
+
+    assert game_ids(page) == ids[:2]
+    assert (offset, skip) == (0, 2)
+    assert game_ids(writer.page(cursor, 10)[0]) == ids[2:]
+
+
+def test_a_batch_still_being_written_is_left_for_later(worker, tmp_path):
+    writer = worker('w1')
+    ids = archived(writer, 2)
+    path = os.path.join(str(tmp_path), writer.segment)
+    complete = os.path.getsize(path)
+
+    archived(writer, 2)
+    with open(path, 'r+b') as segment:
+        segment.truncate(complete + 20)
+
+    games, cursor = read_all(writer)
+
+    assert game_ids(games) == ids
+    assert parse_cursor(cursor)['w1'][1] == complete
+
+
+def test_a_segment_name_is_a_cursor(worker):
+    writer = worker('w1')
+    archived(writer, 2)
+    writer.segment = archive.segment_name(archive.segment_number(writer.segment) + 1)
+    later = archived(writer, 2)
+
+    assert game_ids(writer.page(writer.segment, 10)[0]) == later
+
+
+@pytest.mark.parametrize('cursor', ['x', 'a.pgn.gz:1:1', '00000001-w1.pgn.gz:x:0', '00000001-w1.pgn.gz:1'])
+def test_a_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        parse_cursor(cursor)
@@ -0,0 +1,41 @@
+import chess
+
+import bot_search
+from bot_profiles import create_bot, release_bot
+from move_source import move_source
+
+
+class FakeGame:
+    def __init__(self, bot_sid: str):
+        self.game_id = 'game'
+        self.bot_sid = bot_sid
+        self.players = ['human', bot_sid]
+        self.player_times = [300, 300]
+        self.step_increment_time = 0
+        self.position_version = 1
+        self.is_game_over = False
+        self.moves = []
+
+    def on_move(self, move: dict, player: str) -> bool:
+        self.moves.append((move['move'], player))
+        return True
+
+
+def test_bot_plays_a_legal_move_without_an_engine(monkeypatch, socketio):
+    monkeypatch.setattr(bot_search.stockfish_pool, 'path', '/nonexistent/stockfish')
+    monkeypatch.setattr(move_source, 'lookup', lambda board, level: None)
+
+    bot_sid = create_bot(1500)
+    game = FakeGame(bot_sid)
+    board = chess.Board()
+    board.push_uci('e2e4')
+
+    try:
+        bot_search.run_search(game, board, game.position_version)
+    finally:
+        release_bot(bot_sid)
+
+    [(move, player)] = game.moves
+    assert player == bot_sid
+    assert chess.Move.from_uci(move) in board.legal_moves
+    assert bot_search.stockfish_pool.busy == 0
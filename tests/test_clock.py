@@ -0,0 +1,34 @@
+from clock import ClockService
+
+
+class FakeGame:
+    def __init__(self, game_id: str, broken: bool = False):
+        self.game_id = game_id
+        self.broken = broken
+        self.clock_version = 0
+        self.is_game_over = False
+        self.player_times = [0, 0]
+        self.current_player_index = 0
+        self.flagged = False
+
+    def flag_deadline(self) -> float:
+        return 0
+
+    def update_timer(self) -> None:
+        if self.broken:
+            raise RuntimeError('corrupt clock')
+
+    def on_flag(self) -> None:
+        self.flagged = True
+
+
+def test_a_failing_game_does_not_stop_the_sweep():
+    service = ClockService()
+    broken, game = FakeGame('broken', broken=True), FakeGame('game')
+    service.schedule(broken)
+    service.schedule(game)
+
+    service.process_due(1)
+
+    assert game.flagged
+    assert service.deadlines == [] and service.live == {}
@@ -0,0 +1,184 @@
+"""
+The cross-worker flow, two workers sharing one Redis in a single process: each step runs with
+the state backend of the worker it happens on, messages are delivered by hand
+"""
+import pytest
+from flask import Flask, request
+
+import cluster
+from conftest import Inbox
+from matchmaking import Matchmaker
+from share import running
+
+ALICE = {'pid': 'alice', 'name': 'Alice', 'elo': 1500, 'protocol': 2, 'binary': False}
+BOB = {'pid': 'bob', 'name': 'Bob', 'elo': 1500, 'protocol': 2, 'binary': False}
+
+
+class FakeGame:
+    def __init__(self):
+        self.seated = []
+
+    def seat(self, sid: str) -> None:
+        self.seated.append(sid)
+
+
+@pytest.fixture
+def on_worker(monkeypatch, workers):
+    """Switch to the state backend of a worker"""
+    backends = {backend.worker_id: backend for backend in workers}
+    return lambda worker_id: monkeypatch.setattr(cluster, 'state', backends[worker_id])
+
+
+@pytest.fixture
+def inboxes(workers):
+    return {backend.worker_id: Inbox(backend) for backend in workers}
+
+
+def test_opponent_waiting_on_another_worker_is_adopted(workers, on_worker, inboxes):
+    w1, w2 = workers
+    pairs, adopted = [], []
+    on_pair = lambda sids, time_control: pairs.append(sids)  # noqa: E731
+    matchmaker1 = Matchmaker(on_pair, None, w1)
+    matchmaker2 = Matchmaker(on_pair, None, w2, on_adopt=lambda sid, entry: adopted.append((sid, entry)))
+
+    matchmaker1.add('a', 0, 5, ALICE)
+    matchmaker2.add('b', 0, 5, BOB)
+
+    assert pairs == [['b', 'a']]
+    assert [(sid, entry['worker'], entry['pid']) for sid, entry in adopted] == [('a', 'w1', 'alice')]
+    assert w1.waiting_count() == 0
+
+    # The owner hosts the guest and tells their home worker
+    on_worker('w2')
+    cluster.adopt(*adopted[0])
+
+    assert cluster.guests == {'a': 'w1'}
+    assert running.pid_of_sid['a'] == 'alice' and 'a' in running.online_players
+
+    dropped = []
+    on_worker('w1')
+    for message in inboxes['w1'].read():
+        cluster.on_worker_message(message, dropped.append)
+
+    assert cluster.owners == {'a': 'w2'}
+    assert dropped == ['a']
+
+
+def test_events_of_a_guest_run_on_the_owner(monkeypatch, on_worker, inboxes):
+    moves = []
+    monkeypatch.setitem(cluster.handlers, 'test_move', None)
+    on_test_move = cluster.routed('test_move')(lambda sid, data: moves.append((sid, data)))
+
+    with Flask(__name__).test_request_context():
+        request.sid = 'a'
+
+        # Not adopted: handled here
+        on_worker('w1')
+        on_test_move({'move': 'e2e4'})
+        assert moves == [('a', {'move': 'e2e4'})]
+
+        # Adopted: forwarded to the owner
+        cluster.owners['a'] = 'w2'
+        on_test_move({'move': 'e7e5'})
+        assert len(moves) == 1
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+
+    assert moves[1] == ('a', {'move': 'e7e5'})
+
+
+def test_disconnect_of_a_guest_reaches_the_owner(monkeypatch, on_worker, inboxes):
+    gone = []
+    monkeypatch.setitem(cluster.handlers, 'disconnect', lambda sid, _: gone.append(sid))
+    cluster.owners['a'] = 'w2'
+    cluster.guests['a'] = 'w1'
+
+    on_worker('w1')
+    cluster.forward_disconnect('a')
+    assert cluster.owners == {}
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+
+    assert gone == ['a']
+    assert cluster.guests == {}
+
+
+def test_login_goes_to_the_worker_holding_the_seat(workers, on_worker, inboxes):
+    w1, w2 = workers
+    game = FakeGame()
+    w2.hold_seat('alice')
+    running.away_game_of_pid['alice'] = game
+
+    # Logged in again on their home worker
+    on_worker('w1')
+    assert cluster.forward_join('a2', ALICE) is True
+    assert cluster.owners == {'a2': 'w2'}
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+
+    assert game.seated == ['a2']
+    assert cluster.guests == {'a2': 'w1'}
+    assert running.pid_of_sid['a2'] == 'alice'
+
+
+def test_login_after_the_game_ended_returns_home(workers, on_worker, inboxes):
+    w1, w2 = workers
+    w2.hold_seat('alice')  # Not freed yet when the login was forwarded
+
+    on_worker('w1')
+    assert cluster.forward_join('a2', ALICE) is True
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+
+    assert cluster.guests == {}
+
+    on_worker('w1')
+    for message in inboxes['w1'].read():
+        cluster.on_worker_message(message, None)
+
+    assert cluster.owners == {}
+
+
+def test_login_stays_when_no_other_worker_holds_the_seat(workers, on_worker):
+    w1, _ = workers
+    on_worker('w1')
+    assert cluster.forward_join('a2', ALICE) is False
+
+    w1.hold_seat('alice')
+    assert cluster.forward_join('a2', ALICE) is False
+    assert cluster.owners == {}
+
+
+def test_watching_a_game_of_another_worker(monkeypatch, workers, on_worker, inboxes):
+    w1, w2 = workers
+    watched = []
+    monkeypatch.setitem(cluster.handlers, 'watch', lambda sid, data: watched.append((sid, data['game_id'])))
+    monkeypatch.setitem(cluster.handlers, 'unwatch', lambda sid, _: watched.remove((sid, 'g2')))
+    w2.list_games([{'game_id': 'g2', 'elo': 1500, 'bot': False}])
+
+    on_worker('w1')
+    assert cluster.forward_watch('s', {'game_id': 'g1'}) is False
+    assert cluster.forward_watch('s', {'game_id': 'g2'}) is True
+    assert cluster.watched_on == {'s': 'w2'}
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+    assert watched == [('s', 'g2')]
+
+    on_worker('w1')
+    cluster.forward_unwatch('s')
+    assert cluster.watched_on == {}
+
+    on_worker('w2')
+    for message in inboxes['w2'].read():
+        cluster.on_worker_message(message, None)
+    assert watched == []
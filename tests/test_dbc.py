@@ -0,0 +1,42 @@
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import dbc
+
+
+@pytest.fixture
+def players(monkeypatch):
+    monkeypatch.setattr(dbc, '_players', None)
+    return dbc.connect(mongomock.MongoClient())
+
+
+def test_connect_indexes_pid_as_unique(players):
+    players.insert_one({'pid': 'p1', 'name': 'Alice', 'elo': 1500})
+
+    with pytest.raises(DuplicateKeyError):
+        players.insert_one({'pid': 'p1', 'name': 'Bob', 'elo': 1600})
+
+    assert dbc.players_collection() is players
+
+
+def test_load_reads_only_player_fields(players):
+    players.insert_one({'pid': 'p1', 'name': 'Alice', 'elo': 1500, 'email': 'alice@example.com'})
+
+    assert dbc.load('p1') == {'pid': 'p1', 'name': 'Alice', 'elo': 1500}
+    assert dbc.load('p2') is None
+
+
+def test_bulk_upsert_inserts_and_updates(players):
+    players.insert_one({'pid': 'p1', 'name': 'Alice', 'elo': 1500})
+
+    assert dbc.bulk_upsert([{'pid': 'p1', 'elo': 1512}, {'pid': 'p2', 'name': 'Bob', 'elo': 1488}])
+
+    assert dbc.load('p1') == {'pid': 'p1', 'name': 'Alice', 'elo': 1512}
+    assert dbc.load('p2') == {'pid': 'p2', 'name': 'Bob', 'elo': 1488}
+    assert players.count_documents({}) == 2
+
+
+def test_bulk_upsert_without_users_skips_the_write(players):
+    assert dbc.bulk_upsert([])
+    assert players.count_documents({}) == 0
@@ -0,0 +1,51 @@
+import pytest
+
+from game import Game
+from player import join
+from protocol import register_client
+from share import running
+
+
+def login(sid: str, protocol: int = 2) -> str:
+    join(sid, f'pid_{sid}', sid, profile={'pid': f'pid_{sid}', 'name': sid, 'elo': 1500})
+    register_client(sid, {'protocol': protocol})
+    running.online_players.add(sid)
+    return sid
+
+
+@pytest.fixture
+def game(socketio):
+    game = Game([login('white'), login('black')], 300, 2)
+    running.add_game(game)
+    return game
+
+
+def test_the_side_to_move_moves(game):
+    assert game.on_move({'move': 'e2e4', 'n': 1}, 'white') is True
+    assert game.on_move({'move': 'e7e5', 'n': 2}, 'black') is True
+    assert [move.uci() for move in game.board.move_stack] == ['e2e4', 'e7e5']
+
+
+def test_a_move_out_of_turn_is_rejected(game, socketio):
+    assert game.on_move({'move': 'e2e4', 'n': 1}, 'white') is True
+
+    # White plays black's reply, e.g. while a bot opponent is still thinking
+    socketio.sent.clear()
+    assert game.on_move({'move': 'e7e5', 'n': 2}, 'white') is False
+
+    assert [move.uci() for move in game.board.move_stack] == ['e2e4']
+    assert game.current_player_index == 1
+    assert [(to, event) for to, event, _ in socketio.sent] == [('white', 'sync')]
+
+
+def test_a_legacy_client_out_of_turn_is_told_so(socketio):
+    game = Game([login('white', protocol=1), login('black', protocol=1)], 300, 2)
+    running.add_game(game)
+
+    assert game.on_move({'move': 'e2e4'}, 'white') is True
+
+    socketio.sent.clear()
+    assert game.on_move({'move': 'e7e5'}, 'white') is False
+
+    assert [move.uci() for move in game.board.move_stack] == ['e2e4']
+    assert socketio.sent == [('white', 'message', "Command error: {'move': 'e7e5'}, please re-enter.")]
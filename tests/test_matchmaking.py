@@ -0,0 +1,23 @@
+from matchmaking import MatchConfig, Matchmaker
+
+ALICE = {'pid': 'alice', 'name': 'Alice', 'elo': 1500, 'protocol': 2, 'binary': False}
+BOB = {'pid': 'bob', 'name': 'Bob', 'elo': 1500, 'protocol': 2, 'binary': False}
+
+
+def test_a_failing_bot_match_does_not_stop_the_tick(workers):
+    bots = []
+
+    def on_bot(sid: str, time_control: int) -> None:
+        if sid == 'a':
+            raise RuntimeError('no engine')
+        bots.append(sid)
+
+    matchmaker = Matchmaker(lambda sids, time_control: None, on_bot, workers[0])
+    matchmaker.add('a', 0, 5, ALICE)
+    matchmaker.add('b', 1, 5, BOB)
+
+    last_join = max(entry['join_time'] for _, _, _, entry in matchmaker.deadlines)
+    matchmaker.process_due(last_join + MatchConfig.BOT_WAIT_TIME)
+
+    assert bots == ['b']
+    assert matchmaker.deadlines == []
@@ -0,0 +1,59 @@
+import pytest
+
+import spectators as spectators_module
+from game import Game
+from share import running
+from spectators import spectators
+from test_game import login
+
+
+@pytest.fixture
+def shared(monkeypatch, workers):
+    """This worker is w1 of two sharing the game list"""
+    monkeypatch.setattr(spectators_module, 'state', workers[0])
+    monkeypatch.setattr(spectators, 'relisted_games', set())
+    return workers
+
+
+def new_game(white: str, black: str, elo: int) -> Game:
+    game = Game([login(white), login(black)], 300, 2)
+    game.start_ratings = [(white, elo), (black, elo)]
+    running.add_game(game)
+    return game
+
+
+def test_local_game_list_walks_the_rating_index(socketio):
+    low, high = new_game('a', 'b', 1400), new_game('c', 'd', 2000)
+
+    assert [game['game_id'] for game in spectators.live_games()] == [high.game_id, low.game_id]
+    assert [game['game_id'] for game in spectators.live_games(min_elo=1500)] == [high.game_id]
+    assert spectators.live_games(bots=True) == []
+
+
+def test_game_list_includes_the_games_of_other_workers(socketio, shared):
+    w1, w2 = shared
+    local = new_game('a', 'b', 1600)
+    w2.list_games([{'game_id': 'remote', 'elo': 1800, 'bot': True, 'plies': 7}])
+
+    # Listed once published
+    assert [game['game_id'] for game in spectators.live_games()] == ['remote']
+    spectators.publish_list()
+
+    games = spectators.live_games()
+    assert [game['game_id'] for game in games] == ['remote', local.game_id]
+    assert 'worker' not in games[0]
+    assert [game['game_id'] for game in spectators.live_games(bots=False)] == [local.game_id]
+
+    # Games of this worker are as they are now, not as published
+    local.on_move({'move': 'e2e4', 'n': 1}, local.players[0])
+    assert spectators.live_games(bots=False)[0]['plies'] == 1
+
+
+def test_finished_games_leave_the_shared_list(socketio, shared):
+    w1, w2 = shared
+    game = new_game('a', 'b', 1600)
+    spectators.publish_list()
+
+    spectators.game_over(game, '1-0', 'RESIGNED')
+
+    assert list(w2.listed_games(0, chunk=10)) == []
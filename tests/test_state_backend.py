@@ -0,0 +1,148 @@
+import threading
+
+from conftest import Inbox, make_backend
+from state_backend import InProcessBackend
+
+
+def entry(time_control: int = 0, level: int = 5, join_time: float = 0.0, **profile) -> dict:
+    return {'join_time': join_time, 'time_control': time_control, 'level': level, **profile}
+
+
+def test_oldest_waiting_per_level(workers):
+    w1, w2 = workers
+    w1.add_waiting('a', entry(level=5, join_time=1))
+    w2.add_waiting('b', entry(level=5, join_time=2))
+    w2.add_waiting('c', entry(level=6, join_time=3))
+    w1.add_waiting('d', entry(time_control=1, level=5, join_time=0))
+
+    found = w2.oldest_waiting(0, range(4, 8), skip='x')
+
+    assert {level: sid for level, (sid, _) in found.items()} == {5: 'a', 6: 'c'}
+    assert found[5][1]['worker'] == 'w1'
+    assert w1.waiting_count() == 4
+
+
+def test_oldest_waiting_skips_the_player_looking(workers):
+    w1, _ = workers
+    w1.add_waiting('a', entry(join_time=1))
+    w1.add_waiting('b', entry(join_time=2))
+
+    assert w1.oldest_waiting(0, [5], skip='a')[5][0] == 'b'
+    assert w1.oldest_waiting(0, [4], skip='a') == {}
+
+
+def test_only_one_worker_claims_a_player(workers):
+    w1, w2 = workers
+    w1.add_waiting('a', entry())
+
+    assert w2.remove_waiting('a', entry()) is True
+    assert w1.remove_waiting('a', entry()) is False
+    assert w1.waiting_count() == 0
+
+
+def test_online_count_sums_the_workers(workers):
+    w1, w2 = workers
+    w1.connected(3)
+    w2.connected(2)
+    w2.connected(-1)
+
+    assert w1.online_count() == 4
+
+
+def test_restart_drops_what_the_worker_left_behind(redis_server, workers):
+    w1, w2 = workers
+    w1.add_waiting('a', entry())
+    w2.add_waiting('b', entry(join_time=1))
+    w1.connected(5)
+    w1.hold_seat('alice')
+    w2.hold_seat('bob')
+
+    restarted = make_backend(redis_server, 'w1')
+    restarted.start()
+
+    assert restarted.waiting_count() == 1
+    assert restarted.oldest_waiting(0, [5], skip='x')[5][0] == 'b'
+    assert restarted.online_count() == 0
+    assert restarted.seat_holder('alice') is None
+    assert restarted.seat_holder('bob') == 'w2'
+
+
+def test_held_seats_are_seen_by_every_worker(workers):
+    w1, w2 = workers
+    w1.hold_seat('alice')
+    assert w2.seat_holder('alice') == 'w1'
+
+    # Only the holder frees it
+    w2.free_seat('alice')
+    assert w1.seat_holder('alice') == 'w1'
+
+    w1.free_seat('alice')
+    assert w2.seat_holder('alice') is None
+
+
+def test_messages_reach_the_addressed_worker(workers):
+    w1, w2 = workers
+    inbox1, inbox2 = Inbox(w1), Inbox(w2)
+
+    w1.publish('w2', {'type': 'released', 'sid': 'a'})
+
+    assert inbox2.read() == [{'type': 'released', 'sid': 'a'}]
+    assert inbox1.read() == []
+
+
+def test_listen_hands_messages_to_the_handler(workers):
+    w1, w2 = workers
+    received = threading.Event()
+    messages = []
+
+    def handler(message):
+        messages.append(message)
+        received.set()
+
+    threading.Thread(target=w2.listen, args=(handler,), daemon=True).start()
+
+    # The subscription is made by the listener thread, publish until it is in place
+    while not received.wait(0.05):
+        w1.publish('w2', {'type': 'released', 'sid': 'a'})
+
+    assert messages[0] == {'type': 'released', 'sid': 'a'}
+
+
+def test_in_process_backend_keeps_join_order():
+    backend = InProcessBackend()
+    backend.add_waiting('a', entry())
+    backend.add_waiting('b', entry())
+
+    assert backend.oldest_waiting(0, [5], skip='x')[5][0] == 'a'
+    assert backend.remove_waiting('a', entry()) is True
+    assert backend.remove_waiting('a', entry()) is False
+    assert backend.oldest_waiting(0, [5], skip='x')[5][0] == 'b'
+    assert backend.seat_holder('a') is None
+
+
+def summary(game_id: str, elo: int, bot: bool = False) -> dict:
+    return {'game_id': game_id, 'elo': elo, 'bot': bot}
+
+
+def test_game_list_is_shared_highest_rated_first(workers):
+    w1, w2 = workers
+    w1.list_games([summary('a', 1500), summary('b', 2100)])
+    w2.list_games([summary('c', 1800)])
+
+    assert [game['game_id'] for game in w2.listed_games(0, chunk=2)] == ['b', 'c', 'a']
+    assert [game['game_id'] for game in w2.listed_games(1600, chunk=2)] == ['b', 'c']
+    assert w2.game_owner('b') == 'w1' and w1.game_owner('c') == 'w2'
+
+    w1.unlist_game('b')
+    assert [game['game_id'] for game in w2.listed_games(0, chunk=10)] == ['c', 'a']
+    assert w2.game_owner('b') is None
+
+
+def test_restart_unlists_the_workers_games(redis_server, workers):
+    w1, w2 = workers
+    w1.list_games([summary('a', 1500)])
+    w2.list_games([summary('b', 1500)])
+
+    make_backend(redis_server, 'w1').start()
+
+    assert [game['game_id'] for game in w2.listed_games(0, chunk=10)] == ['b']
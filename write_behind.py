@@ -0,0 +1,92 @@
+import atexit
+from typing import Any, Callable, Dict, List
+
+from batch_writer import BatchWriter
+from dbc import bulk_upsert
+from share import get_logger, running
+
+logger = get_logger(__name__)
+
+
+class WriteBehindConfig:
+    FLUSH_SIZE = 200        # Pending players that trigger an early flush
+    FLUSH_INTERVAL = 1.0    # Longest time a change waits before being written (seconds)
+    RETRY_BACKOFF = 0.5     # First retry delay after a failed flush, doubled up to RETRY_BACKOFF_MAX (seconds)
+    RETRY_BACKOFF_MAX = 30.0
+    SHUTDOWN_RETRIES = 3
+
+
+class WriteBehindQueue(BatchWriter):
+    """
+    Coalesces player updates by pid and writes them in bulk
+    - put() only touches memory, the latest fields per pid win
+    - A background loop flushes every FLUSH_INTERVAL, or sooner once FLUSH_SIZE players are pending
+    - Failed batches go back to the queue and are retried with exponential backoff
+    """
+
+    ITEMS = 'player updates'
+    FLUSH_INTERVAL = WriteBehindConfig.FLUSH_INTERVAL
+    SHUTDOWN_RETRIES = WriteBehindConfig.SHUTDOWN_RETRIES
+    SHUTDOWN_BACKOFF = WriteBehindConfig.RETRY_BACKOFF
+
+    def __init__(self, upsert: Callable[[List[Dict[str, Any]]], bool]):
+        super().__init__(logger)
+        self.upsert = upsert
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.in_flight: Dict[str, Dict[str, Any]] = {}
+        self.backoff = 0.0
+
+        # Metrics
+        self.written = 0
+
+    def put(self, fields: Dict[str, Any]) -> None:
+        self.pending.setdefault(fields['pid'], {}).update(fields)
+
+        if len(self.pending) >= WriteBehindConfig.FLUSH_SIZE and not self.flushing and not self.backoff:
+            running.socketio.start_background_task(self.flush)
+
+    def pending_of(self, pid: str) -> Dict[str, Any]:
+        """Fields of the player not written yet, newest first"""
+        fields = dict(self.in_flight.get(pid, {}))
+        fields.update(self.pending.get(pid, {}))
+        return fields
+
+    def has_pending(self) -> bool:
+        return bool(self.pending)
+
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    def take(self) -> List[Dict[str, Any]]:
+        self.in_flight, self.pending = self.pending, {}
+        return list(self.in_flight.values())
+
+    def write(self, batch: List[Dict[str, Any]]) -> bool:
+        # pymongo blocks on the socket
+        return self.upsert(batch)
+
+    def settle(self, batch: List[Dict[str, Any]], ok: bool) -> None:
+        if ok:
+            self.written += len(batch)
+            self.backoff = 0.0
+        else:
+            backoff = max(self.backoff * 2, WriteBehindConfig.RETRY_BACKOFF)
+            self.backoff = min(backoff, WriteBehindConfig.RETRY_BACKOFF_MAX)
+
+            # Changes made since the batch was taken are newer, they win
+            for pid, fields in self.in_flight.items():
+                self.pending[pid] = {**fields, **self.pending.get(pid, {})}
+
+        self.in_flight = {}
+
+    def run(self) -> None:
+        while True:
+            running.socketio.sleep(self.backoff or WriteBehindConfig.FLUSH_INTERVAL)
+            self.flush()
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'written': self.written}
+
+
+rating_writes = WriteBehindQueue(bulk_upsert)
+atexit.register(rating_writes.close)